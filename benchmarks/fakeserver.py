@@ -0,0 +1,239 @@
+"""Serve fixtures.py over HTTP as a local stand-in for every Telia host.
+
+Requests arrive as http://<address>/<host><path>, which is what WebUtils
+sends when the "apiBaseUrl" setting is http://<address>. Graphql requests
+must carry one of the persisted query hashes in TeliaPlay.graphql_hashes,
+like the real backend, and get PERSISTED_QUERY_NOT_FOUND otherwise.
+
+Network conditions are applied per endpoint: the latency and jitter delay
+the response headers, the throughput cap paces the body, and errors are
+injected at the given rate. An error status of 0 drops the connection
+without answering.
+
+    python benchmarks/fakeserver.py [--port 8470] [--latency 40]
+        [--jitter 10] [--throughput 2000] [--error-rate 0.01]
+        [--error-status 503] [--conditions FILE] [--fixtures DIR]
+
+The conditions file maps graphql operation names or endpoint names from
+fixtures.ENDPOINTS to overrides of the command line defaults:
+
+    {"getPanel": {"latency_ms": 300, "throughput_kbps": 250},
+     "streamingticket": {"error_rate": 0.1, "error_status": 0}}
+"""
+import os
+import sys
+import ast
+import json
+import time
+import random
+import argparse
+import threading
+import collections
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_CONDITIONS = {
+    "latency_ms": 0,
+    "jitter_ms": 0,
+    # kB/s, 0 for unlimited
+    "throughput_kbps": 0,
+    "error_rate": 0,
+    "error_status": 503
+}
+
+
+def known_hashes():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from resources.lib.api import TeliaPlay
+    return set(TeliaPlay.graphql_hashes.fget(None).values())
+
+
+def parse_value(value):
+    # GET parameters are dict reprs with double quotes, not always json.
+    try:
+        return json.loads(value)
+    except ValueError:
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+
+class FakeTeliaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.answer("GET")
+
+    def do_POST(self):
+        self.answer("POST")
+
+    def do_DELETE(self):
+        self.answer("DELETE")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def answer(self, method):
+        import fixtures
+
+        parts = urllib.parse.urlsplit(self.path)
+        (host, _, path) = parts.path.lstrip("/").partition("/")
+        path = "/" + path
+        params = dict(
+            (key, parse_value(value))
+            for (key, value) in urllib.parse.parse_qsl(parts.query)
+        )
+        size = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(size) if size else b""
+        payload = json.loads(body.decode("utf-8")) if body else None
+
+        (name, _) = fixtures.find_endpoint(method, path)
+        query = params if name == "graphql" else payload or {}
+        if name in ("graphql", "mutation"):
+            name = query.get("operationName")
+        conditions = self.server.conditions_for(name)
+        self.server.count(method, host, name)
+
+        delay = conditions["latency_ms"] + random.uniform(
+            -conditions["jitter_ms"], conditions["jitter_ms"]
+        )
+        time.sleep(max(0, delay)/1000)
+
+        if random.random() < conditions["error_rate"]:
+            if not conditions["error_status"]:
+                self.close_connection = True
+                return
+            (status, response_json) = (conditions["error_status"], {
+                "errorCode": conditions["error_status"],
+                "message": "Injected error"
+            })
+        elif query.get("extensions") and self.server.hashes and \
+                query["extensions"].get("persistedQuery", {}).get(
+                    "sha256Hash"
+                ) not in self.server.hashes:
+            (status, response_json) = (200, {"errors": [{
+                "message": "PersistedQueryNotFound",
+                "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}
+            }]})
+        else:
+            (status, response_json) = fixtures.respond(
+                method, path, params, payload
+            )
+
+        content = json.dumps(response_json).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.write_paced(content, conditions["throughput_kbps"])
+
+    def write_paced(self, content, throughput_kbps):
+        if not throughput_kbps:
+            self.wfile.write(content)
+            return
+
+        # Send a slice every 50 ms so the cap also holds for short bodies.
+        chunk_size = max(1, int(throughput_kbps*1024/20))
+        start = time.perf_counter()
+        for offset in range(0, len(content), chunk_size):
+            self.wfile.write(content[offset:offset + chunk_size])
+            self.wfile.flush()
+            ahead = (offset + chunk_size)/(throughput_kbps*1024) - \
+                (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+class FakeTeliaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), defaults=None,
+                 conditions=None, check_hashes=True, verbose=False):
+        super().__init__(address, FakeTeliaHandler)
+        self.defaults = dict(DEFAULT_CONDITIONS)
+        self.defaults.update(defaults or {})
+        self.conditions = conditions or {}
+        self.hashes = known_hashes() if check_hashes else None
+        self.verbose = verbose
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://{0}:{1}".format(*self.server_address[:2])
+
+    def conditions_for(self, name):
+        conditions = dict(self.defaults)
+        conditions.update(self.conditions.get(name, {}))
+        return conditions
+
+    def count(self, method, host, name):
+        with self.lock:
+            self.requests["{0} {1}".format(method, name or host)] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8470)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Delay before the response headers in ms.")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="Uniform +/- variation of the latency in ms.")
+    parser.add_argument("--throughput", type=float, default=0,
+                        help="Body throughput cap in kB/s.")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--conditions",
+                        help="JSON file with per endpoint conditions.")
+    parser.add_argument("--fixtures",
+                        help="Directory with recorded <name>.json responses.")
+    parser.add_argument("--no-hash-check", action="store_true")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        os.environ["TELIAPLAY_FIXTURES"] = os.path.abspath(args.fixtures)
+    conditions = {}
+    if args.conditions:
+        with open(args.conditions) as f:
+            conditions = json.load(f)
+
+    server = FakeTeliaServer((args.host, args.port), {
+        "latency_ms": args.latency,
+        "jitter_ms": args.jitter,
+        "throughput_kbps": args.throughput,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status
+    }, conditions, not args.no_hash_check, not args.quiet)
+    print("Serving Telia Play fixtures on {0}".format(server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    for (name, value) in sorted(server.requests.items()):
+        print("    {0:<44}{1:>6}".format(name, value))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Recorded or synthetic responses for every Telia Play endpoint.
+
+respond() maps a request to a (status, body) pair. A response recorded as
+<name>.json in the fixture directory wins over the synthetic one, where
+name is the graphql operation name or the endpoint name in ENDPOINTS.
+Synthetic responses have just the fields the add-on reads, and their sizes
+follow the requested limits so that large pages can be benchmarked.
+"""
+import os
+import re
+import json
+import time
+import datetime
+
+
+PANEL_SIZE = 500
+CHANNELS = 60
+PROGRAMS_PER_DAY = 24
+EPISODES = 12
+
+# (endpoint name, method, path pattern)
+ENDPOINTS = (
+    ("login", "POST", r"/logingateway/rest/v1/login$"),
+    ("refresh", "POST", r"/logingateway/rest/v1/login/refresh$"),
+    ("logout", "POST", r"/logingateway/rest/secure/v1/logout$"),
+    ("provision", "POST", r"/tvclientgateway/rest/secure/v1/provision$"),
+    ("explore", "GET", r"/exploregateway/rest/v4/explore/media/(?P<id>[^/]+)$"),
+    ("rent", "POST", r"/mediarentals/videos/(?P<id>[^/]+)$"),
+    ("streamingticket", "POST",
+     r"/streamingticket/(?P<type>[A-Z]+)/(?P<id>[^/]+)$"),
+    ("deleteticket", "DELETE",
+     r"/streamingticket/(?P<type>[A-Z]+)/(?P<id>[^/]+)$"),
+    ("graphql", "GET", r"/graphql$"),
+    ("mutation", "POST", r"/graphql$"),
+)
+
+fixture_directory = os.environ.get("TELIAPLAY_FIXTURES")
+
+
+def recorded(name):
+    if not fixture_directory:
+        return None
+    path = os.path.join(fixture_directory, name + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def image(kind, media_id):
+    return {"source": "https%3A%2F%2Fimages.example%2F{0}%2F{1}.jpg".format(
+        media_id, kind
+    )}
+
+
+def poster(index):
+    media_id = "{0}{1:07d}".format("s" if index % 5 == 0 else "m", index)
+    item = {
+        "__typename": "MediaPanelItem",
+        "id": media_id,
+        "image": image("poster", media_id),
+        "images": {"showcard16x9": image("showcard16x9", media_id)},
+        "genre": "Drama" if index % 2 else None,
+        "description": "Synopsis of title {0}.".format(index),
+        "descriptionLong": None,
+        "ratings": None,
+        "duration": {"readableShort": "1 tim 45 min"},
+        "price": {"readable": "49 kr"} if index % 17 == 0 else None,
+        "details": {"overlay": {"placeholder": "Title {0}".format(index)}},
+        "analytics": {"content_media_id": media_id}
+    }
+    if index % 3 == 0:
+        item["ratings"] = {"imdb": {
+            "url": "https://www.imdb.com/title/tt{0:07d}".format(index),
+            "readableScore": "7.{0}".format(index % 10)
+        }}
+    return item
+
+
+def posters(limit, offset, total=PANEL_SIZE):
+    items = [poster(index) for index in range(offset, min(offset + limit, total))]
+    page_info = {"hasNextPage": offset + limit < total, "totalCount": total}
+    return (items, page_info)
+
+
+def program(channel_id, index, start):
+    media_id = "m{0}{1:04d}".format(channel_id, index)
+    return {
+        "startTime": {"timestamp": start},
+        "endTime": {"timestamp": start + 3600000},
+        "media": {
+            "id": media_id,
+            "title": "Program {0}".format(index),
+            "descriptionLong": "About program {0}.".format(index),
+            "images": {
+                "showcard2x3": image("showcard2x3", media_id),
+                "showcard16x9": image("showcard16x9", media_id)
+            },
+            "ratings": None
+        }
+    }
+
+
+def channel(index, programs):
+    return {
+        "id": str(index),
+        "name": "Channel {0}".format(index),
+        "icons": {"dark": image("icon", "channel{0}".format(index))},
+        "programs": {"programItems": programs}
+    }
+
+
+def graphql(operation, variables):
+    if operation == "getMainMenu":
+        return {"data": {"mainMenu": {"items": [
+            {"name": name, "link3": {"to": page_id}}
+            for (name, page_id) in (
+                ("Start", "start"), ("Filmer", "movies"), ("Serier", "series"),
+                ("Barn", "kids"), ("Hyrfilmer", "rentals")
+            )
+        ]}}}
+
+    elif operation == "getPage":
+        stores_panel = {
+            "__typename": "StoresPanel", "id": "panel-stores",
+            "title": "Alla Playtjänster",
+            "storesContent": {"items": [
+                {"id": "store-{0}".format(index),
+                 "name": "Store {0}".format(index),
+                 "icons": {"dark": image("icon", "store{0}".format(index))}}
+                for index in range(12)
+            ]}
+        }
+        if variables.get("id") == "all-stores":
+            return {"data": {"page": {"pagePanels": {"panels": [
+                stores_panel
+            ]}}}}
+
+        (items, page_info) = posters(24, 0)
+        return {"data": {"page": {"pagePanels": {"panels": [
+            {"__typename": "SelectionMediaPanel", "id": "panel-movies",
+             "title": "Filmer",
+             "selectionMediaContent": {"items": items, "pageInfo": page_info}},
+            {"__typename": "MyListPanel", "id": "panel-my-list",
+             "title": "Min lista",
+             "myListContent": {"items": items[:8]}},
+            {"__typename": "PosterListPanel", "id": "panel-popular",
+             "title": "Populärt",
+             "posters": {"items": items[8:], "pageInfo": page_info}},
+            stores_panel
+        ]}}}}
+
+    elif operation == "getPanel":
+        config = variables.get("config", {})
+        (items, page_info) = posters(
+            config.get("limit", 60), config.get("offset", 0)
+        )
+        return {"data": {"panel": {"selectionMediaContent": {
+            "items": items, "pageInfo": page_info
+        }}}}
+
+    elif operation == "search2":
+        (items, page_info) = posters(
+            variables.get("limit", 50), variables.get("offset", 0), 120
+        )
+        return {"data": {"search2": {"posters": items, "pageInfo": page_info}}}
+
+    elif operation == "getStorePage":
+        (items, page_info) = posters(60, 0)
+        media = [{"media": {
+            "id": item["id"],
+            "title": item["details"]["overlay"]["placeholder"],
+            "images": {"showcard2x3": item["image"],
+                       "showcard16x9": item["images"]["showcard16x9"]},
+            "genre": item["genre"],
+            "descriptionLong": item["description"],
+            "ratings": item["ratings"],
+            "duration": item["duration"],
+            "price": item["price"]
+        }} for item in items]
+        return {"data": {"store": {
+            "icons": {"dark": image("icon", variables.get("id", "store"))},
+            "pagePanels": {"items": [
+                {"__typename": "MediaPanel", "id": "store-panel-{0}".format(
+                    index
+                ), "title": "Panel {0}".format(index) if index else None,
+                 "mediaContent": {"items": media, "pageInfo": page_info}}
+                for index in range(4)
+            ]}
+        }}}
+
+    elif operation == "getCdpSeries":
+        series_id = variables.get("id", "s0000000")
+        return {"data": {"series": {
+            "images": {"backdrop16x9": image("backdrop16x9", series_id),
+                       "showcard2x3": image("showcard2x3", series_id)},
+            "suggestedEpisode": {
+                "id": "m" + series_id[1:],
+                "episodeNumber": {"readable": "Säsong 1 Avsnitt 1"},
+                "genre": "Drama",
+                "descriptionLong": "The first episode.",
+                "duration": {"readableShort": "45 min"},
+                "price": None,
+                "series": {"seasonLinks": {"items": [
+                    {"id": "{0}-{1}".format(series_id, number),
+                     "seasonNumber": {"number": number},
+                     "descriptionLong": "Season {0}.".format(number)}
+                    for number in range(1, 6)
+                ]}}
+            }
+        }}}
+
+    elif operation == "getCdpSeasonPanel":
+        now = int(time.time()*1000)
+        return {"data": {"season": {"panel": {"posters": {"items": [
+            {"analytics": {"content_media_id": "m{0:07d}".format(index)},
+             "details": {"aside": {"header": "Avsnitt {0}".format(index + 1)}},
+             "episodeNumber": {"readable": "Avsnitt {0}".format(index + 1)},
+             "image": image("poster", index),
+             "images": {"showcard16x9": image("showcard16x9", index)},
+             "descriptionLong": "Episode {0}.".format(index + 1),
+             "duration": {"readableShort": "45 min"},
+             "price": None,
+             "availableFrom": {"timestamp": now - index*7*86400000}}
+            for index in range(EPISODES)
+        ]}}}}}
+
+    elif operation == "getTvChannels":
+        limit = variables.get("limit", 3)
+        offset = variables.get("offset", 0)
+        timestamp = variables.get("timestamp", int(time.time()*1000))
+        start = timestamp // 3600000 * 3600000
+        return {"data": {"channels": {
+            "channelItems": [
+                channel(index, [
+                    program(index, number, start + number*3600000)
+                    for number in range(variables.get("programLimit", 3))
+                ])
+                for index in range(offset, min(offset + limit, CHANNELS))
+            ],
+            "pageInfo": {"hasNextPage": offset + limit < CHANNELS}
+        }}}
+
+    elif operation == "getTvChannel":
+        channel_id = variables.get("id", "0")
+        start = variables.get("timestamp", int(time.time()*1000))
+        return {"data": {"channel": channel(channel_id, [
+            program(channel_id, number, start + number*3600000)
+            for number in range(PROGRAMS_PER_DAY)
+        ])}}
+
+    elif operation in ("addToMyList", "removeFromMyList"):
+        return {"data": {operation: {"id": variables.get("id")}}}
+
+    return {"errors": [{"message": "Unknown operation '{0}'".format(
+        operation
+    )}]}
+
+
+def token_data():
+    valid_to = datetime.datetime.now(datetime.timezone.utc) + \
+        datetime.timedelta(hours=12)
+    return {
+        "accessToken": "fixture-access-token",
+        "refreshToken": "fixture-refresh-token",
+        "validTo": valid_to.isoformat()
+    }
+
+
+def rest(name, match, payload):
+    if name in ("login", "refresh"):
+        return (200, token_data())
+    elif name in ("logout", "provision", "deleteticket"):
+        return (200, {})
+    elif name == "explore":
+        return (200, {match["id"]: {"assets": {"vod": [
+            {"id": "vod-" + match["id"], "type": "TVOD", "deviceType": "WEB"}
+        ]}}})
+    elif name == "rent":
+        now = int(time.time()*1000)
+        return (200, {"mediaRentals": [{
+            "id": match["id"], "startTime": now,
+            "endTime": now + 48*3600000, "price": "49 kr"
+        }]})
+    elif name == "streamingticket":
+        kind = "live" if match["type"] == "CHANNEL" else "vod"
+        base = "https://cdn.example/{0}/{1}".format(kind, match["id"])
+        drm = {
+            "licenseUrl": "https://license.example/widevine",
+            "headers": {"X-AxDRM-Message": "fixture-drm-token"}
+        }
+        return (200, {"streams": [
+            {"url": base + "/trailer/manifest.mpd", "drm": drm},
+            {"url": base + "/manifest.mpd", "drm": drm}
+        ]})
+    return (404, {"errorCode": 404, "message": "Unknown endpoint"})
+
+
+def find_endpoint(method, path):
+    for (name, endpoint_method, pattern) in ENDPOINTS:
+        if method != endpoint_method:
+            continue
+        match = re.search(pattern, path)
+        if match:
+            return (name, match.groupdict())
+    return (None, {})
+
+
+def respond(method, path, params=None, payload=None):
+    params = params or {}
+    (name, match) = find_endpoint(method, path)
+    if name == "graphql":
+        variables = params.get("variables") or {}
+        if isinstance(variables, str):
+            variables = json.loads(variables)
+        operation = params.get("operationName")
+        body = recorded(operation)
+        return (200, body if body is not None else graphql(operation, variables))
+    elif name == "mutation":
+        operation = payload.get("operationName")
+        body = recorded(operation)
+        return (200, body if body is not None else graphql(
+            operation, payload.get("variables") or {}
+        ))
+    elif name is None:
+        return (404, {"errorCode": 404, "message": "Unknown endpoint"})
+
+    body = recorded(name)
+    if body is not None:
+        return (200, body)
+    return rest(name, match, payload)
@@ -0,0 +1,175 @@
+"""Compare peak memory of decoding large panel responses whole and streamed.
+
+Synthetic getPanel responses are written to disk and read back in network
+sized chunks, once with json.loads and once with JsonStream. Every run
+happens in a fresh interpreter and reports the tracemalloc peak, how much
+the resident set grew while decoding and the peak resident set size. The script exits with a non-zero status
+when both decoders disagree about the items or the page info.
+
+    python benchmarks/json_memory.py [--items 500 2000 10000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK_SIZE = 65536
+ITEMS_PATH = ("data", "panel", "selectionMediaContent", "items")
+
+
+def make_item(index):
+    media_id = "m{0:08d}".format(index)
+    return {
+        "__typename": "MediaPanelItem",
+        "id": media_id,
+        "genre": "Drama",
+        "description": "Synopsis of movie number {0}. ".format(index)*8,
+        "image": {"source": "https://images.example/{0}/poster.jpg".format(
+            media_id
+        )},
+        "images": {"showcard16x9": {
+            "source": "https://images.example/{0}/wide.jpg".format(media_id)
+        }},
+        "ratings": {"imdb": {
+            "url": "https://www.imdb.com/title/tt{0:07d}".format(index),
+            "readableScore": "7.{0}".format(index % 10)
+        }},
+        "duration": {"readableShort": "1 h 45 min"},
+        "details": {"overlay": {"placeholder": "Movie {0}".format(index)}},
+        "analytics": {"content_media_id": media_id}
+    }
+
+
+def write_fixture(path, count):
+    document = {"data": {"panel": {"selectionMediaContent": {
+        "items": [make_item(index) for index in range(count)],
+        "pageInfo": {"hasNextPage": True, "totalCount": count*2}
+    }}}}
+    with open(path, "w") as f:
+        json.dump(document, f)
+
+
+def read_chunks(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def current_rss_kb():
+    # ru_maxrss is a peak that interpreter startup has usually reached
+    # already, so growth is measured on the current resident set. None
+    # where /proc is not available.
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages*resource.getpagesize()//1024
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return peak//1024 if sys.platform == "darwin" else peak
+
+
+def consume(items):
+    # Keep roughly what a menu keeps per item: a label and a url.
+    return [(item["details"]["overlay"]["placeholder"], item["id"])
+            for item in items]
+
+
+def child(mode, path):
+    sys.path.insert(0, ROOT)
+    from resources.lib.jsonstream import JsonStream
+
+    rss_before = current_rss_kb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    if mode == "loads":
+        document = json.loads(b"".join(read_chunks(path)).decode("utf-8"))
+        panel = document["data"]["panel"]["selectionMediaContent"]
+        records = consume(panel["items"])
+        page_info = panel["pageInfo"]
+    else:
+        stream = JsonStream(read_chunks(path), ITEMS_PATH)
+        records = consume(stream)
+        page_info = stream.container["pageInfo"]
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # Measured while the decoded data is still referenced.
+    rss_after = current_rss_kb()
+
+    print(json.dumps({
+        "peak_kb": peak/1024,
+        "rss_kb": None if rss_before is None else rss_after - rss_before,
+        "peak_rss_kb": peak_rss_kb(),
+        "ms": elapsed*1000,
+        "records": records,
+        "page_info": page_info
+    }))
+
+
+def run_child(mode, path):
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), "--child", mode,
+        "--fixture", path
+    ])
+    return json.loads(output.decode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, nargs="+",
+                        default=[500, 2000, 10000])
+    parser.add_argument("--child")
+    parser.add_argument("--fixture")
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.fixture)
+        return 0
+
+    failures = []
+    directory = tempfile.mkdtemp(prefix="teliaplay-json-")
+    print("{0:>7}{1:>10}{2:>8}{3:>14}{4:>12}{5:>14}{6:>10}".format(
+        "items", "body kB", "mode", "peak heap kB", "rss +kB",
+        "peak rss kB", "ms"
+    ))
+    for count in args.items:
+        path = os.path.join(directory, "panel_{0}.json".format(count))
+        write_fixture(path, count)
+        body_kb = os.path.getsize(path)/1024
+
+        results = {}
+        for mode in ("loads", "stream"):
+            results[mode] = result = run_child(mode, path)
+            print("{0:>7}{1:>10.0f}{2:>8}{3:>14.0f}{4:>12}{5:>14}"
+                  "{6:>10.1f}".format(
+                      count, body_kb, mode, result["peak_kb"],
+                      "n/a" if result["rss_kb"] is None else result["rss_kb"],
+                      result["peak_rss_kb"], result["ms"]
+                  ))
+
+        if results["loads"]["records"] != results["stream"]["records"] or \
+                results["loads"]["page_info"] != results["stream"]["page_info"]:
+            failures.append("{0} items: decoders disagree".format(count))
+
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
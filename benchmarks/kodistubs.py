@@ -0,0 +1,348 @@
+import os
+import sys
+import time
+import types
+import tempfile
+import collections
+import xml.etree.ElementTree as ET
+
+
+ADDON_ID = "plugin.video.teliaplay-se"
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Number of calls made into each stubbed Kodi function.
+calls = collections.Counter()
+# perf_counter() timestamp of the first call that hands output to Kodi.
+first_output = []
+settings = {}
+properties = {}
+# isPlaying() answers True this many more times; a successful resolve
+# starts "playback" for a single poll.
+playing_polls = [0]
+keyboard_input = [""]
+
+
+def count(name):
+    calls[name] += 1
+
+
+def output(name):
+    count(name)
+    if not first_output:
+        first_output.append(time.perf_counter())
+
+
+def default_settings():
+    defaults = {}
+    tree = ET.parse(os.path.join(ADDON_PATH, "resources", "settings.xml"))
+    for setting in tree.iter("setting"):
+        default = setting.find("default")
+        if default is not None and default.text is not None:
+            defaults[setting.get("id")] = default.text
+        else:
+            defaults[setting.get("id")] = ""
+    return defaults
+
+
+def reset():
+    calls.clear()
+    del first_output[:]
+
+
+def make_xbmc():
+    xbmc = types.ModuleType("xbmc")
+    xbmc.LOGDEBUG = 0
+    xbmc.LOGINFO = 1
+    xbmc.LOGWARNING = 2
+    xbmc.LOGERROR = 3
+
+    def log(msg, level=0):
+        count("xbmc.log")
+
+    def sleep(milliseconds):
+        count("xbmc.sleep")
+
+    def executebuiltin(function, wait=False):
+        count("xbmc.executebuiltin")
+
+    def getInfoLabel(label):
+        count("xbmc.getInfoLabel")
+        if label == "System.BuildVersion":
+            return "20.2 (20.2.0) Git:20230629-5f418d0b13"
+        return ""
+
+    class Monitor():
+
+        def abortRequested(self):
+            return False
+
+        def waitForAbort(self, timeout=-1):
+            return True
+
+    class Player():
+
+        def __init__(self):
+            count("xbmc.Player")
+
+        def isPlaying(self):
+            if playing_polls[0] > 0:
+                playing_polls[0] -= 1
+                return True
+            return False
+
+        def seekTime(self, seconds):
+            count("xbmc.Player.seekTime")
+
+    class Keyboard():
+
+        def __init__(self, default="", heading=""):
+            pass
+
+        def doModal(self):
+            pass
+
+        def isConfirmed(self):
+            return True
+
+        def getText(self):
+            return keyboard_input[0]
+
+    xbmc.log = log
+    xbmc.sleep = sleep
+    xbmc.executebuiltin = executebuiltin
+    xbmc.getInfoLabel = getInfoLabel
+    xbmc.Monitor = Monitor
+    xbmc.Player = Player
+    xbmc.Keyboard = Keyboard
+    return xbmc
+
+
+def info_tag_setter(method, key):
+    def setter(self, value, *args):
+        count("xbmc.InfoTagVideo." + method)
+        self.info[key] = value
+    return setter
+
+
+def make_info_tag(setters):
+    # Kodi 19 has InfoTagVideo with getters only, Kodi 20 added setters.
+    class InfoTagVideo():
+
+        def __init__(self, info):
+            self.info = info
+
+    if setters:
+        for (method, key) in (
+            ("setTitle", "title"), ("setSortTitle", "sorttitle"),
+            ("setPlot", "plot"), ("setDuration", "duration"),
+            ("setDateAdded", "dateadded"), ("setIMDBNumber", "imdbnumber"),
+            ("setRating", "rating"), ("setGenres", "genre")
+        ):
+            setattr(InfoTagVideo, method, info_tag_setter(method, key))
+    return InfoTagVideo
+
+
+def make_xbmcgui(InfoTagVideo, info_tag=False):
+    xbmcgui = types.ModuleType("xbmcgui")
+
+    class ListItem():
+
+        def __init__(self, label="", label2="", path="", offscreen=False):
+            count("xbmcgui.ListItem")
+            self.label = label
+            self.path = path
+            self.art = {}
+            self.info = {}
+            self.properties = {}
+            self.context_menu = []
+
+        def setArt(self, values):
+            count("xbmcgui.ListItem.setArt")
+            self.art.update(values)
+
+        def setInfo(self, info_type, info_labels):
+            count("xbmcgui.ListItem.setInfo")
+            self.info.update(info_labels)
+
+        def setProperty(self, key, value):
+            count("xbmcgui.ListItem.setProperty")
+            self.properties[key] = value
+
+        def setProperties(self, values):
+            count("xbmcgui.ListItem.setProperties")
+            self.properties.update(values)
+
+        def addContextMenuItems(self, items):
+            count("xbmcgui.ListItem.addContextMenuItems")
+            self.context_menu.extend(items)
+
+        def setContentLookup(self, enable):
+            count("xbmcgui.ListItem.setContentLookup")
+
+        def setMimeType(self, mime_type):
+            count("xbmcgui.ListItem.setMimeType")
+
+        def setPath(self, path):
+            count("xbmcgui.ListItem.setPath")
+            self.path = path
+
+        def getVideoInfoTag(self):
+            count("xbmcgui.ListItem.getVideoInfoTag")
+            return InfoTagVideo(self.info)
+
+    if info_tag:
+        # A Kodi version that no longer has setInfo().
+        del ListItem.setInfo
+
+    class Dialog():
+
+        def textviewer(self, heading, text):
+            count("xbmcgui.Dialog.textviewer")
+
+        def yesno(self, heading, message, *args, **kwargs):
+            count("xbmcgui.Dialog.yesno")
+            return False
+
+        def numeric(self, dialog_type, heading, *args, **kwargs):
+            count("xbmcgui.Dialog.numeric")
+            return ""
+
+        def ok(self, heading, message):
+            count("xbmcgui.Dialog.ok")
+            return True
+
+        def notification(self, heading, message, *args, **kwargs):
+            count("xbmcgui.Dialog.notification")
+
+    class Window():
+
+        def __init__(self, window_id=0):
+            pass
+
+        def getProperty(self, key):
+            return properties.get(key, "")
+
+        def setProperty(self, key, value):
+            properties[key] = value
+
+        def clearProperty(self, key):
+            properties.pop(key, None)
+
+    xbmcgui.ListItem = ListItem
+    xbmcgui.Dialog = Dialog
+    xbmcgui.Window = Window
+    return xbmcgui
+
+
+def make_xbmcplugin():
+    xbmcplugin = types.ModuleType("xbmcplugin")
+    xbmcplugin.SORT_METHOD_UNSORTED = 0
+    xbmcplugin.SORT_METHOD_TITLE = 9
+    xbmcplugin.SORT_METHOD_DATEADDED = 21
+
+    def addDirectoryItems(handle, items, totalItems=0):
+        output("xbmcplugin.addDirectoryItems")
+        return True
+
+    def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
+        output("xbmcplugin.addDirectoryItem")
+        return True
+
+    def addSortMethod(handle, sortMethod, labelMask=""):
+        count("xbmcplugin.addSortMethod")
+
+    def endOfDirectory(handle, succeeded=True, updateListing=False,
+                       cacheToDisc=True):
+        output("xbmcplugin.endOfDirectory")
+
+    def setResolvedUrl(handle, succeeded, listitem):
+        output("xbmcplugin.setResolvedUrl")
+        if succeeded:
+            playing_polls[0] = 1
+
+    def setContent(handle, content):
+        count("xbmcplugin.setContent")
+
+    xbmcplugin.addDirectoryItems = addDirectoryItems
+    xbmcplugin.addDirectoryItem = addDirectoryItem
+    xbmcplugin.addSortMethod = addSortMethod
+    xbmcplugin.endOfDirectory = endOfDirectory
+    xbmcplugin.setResolvedUrl = setResolvedUrl
+    xbmcplugin.setContent = setContent
+    return xbmcplugin
+
+
+def make_xbmcaddon(profile):
+    xbmcaddon = types.ModuleType("xbmcaddon")
+    addon_info = {
+        "id": ADDON_ID,
+        "name": "Telia Play SE",
+        "path": ADDON_PATH,
+        "profile": profile,
+        "icon": os.path.join(ADDON_PATH, "resources", "icon.png"),
+        "version": "1.2.7+matrix.1"
+    }
+
+    class Addon():
+
+        def __init__(self, addon_id=None):
+            count("xbmcaddon.Addon")
+            self.addon_id = addon_id or ADDON_ID
+
+        def getAddonInfo(self, key):
+            return addon_info.get(key, "")
+
+        def getSetting(self, key):
+            count("xbmcaddon.Addon.getSetting")
+            return settings.get(key, "")
+
+        def setSetting(self, key, value):
+            settings[key] = value
+
+        def getLocalizedString(self, string_id):
+            return "#{0}".format(string_id)
+
+        def openSettings(self):
+            pass
+
+    xbmcaddon.Addon = Addon
+    return xbmcaddon
+
+
+def make_xbmcvfs():
+    xbmcvfs = types.ModuleType("xbmcvfs")
+
+    def translatePath(path):
+        return path
+
+    def exists(path):
+        return os.path.exists(path)
+
+    xbmcvfs.translatePath = translatePath
+    xbmcvfs.exists = exists
+    return xbmcvfs
+
+
+def install(profile=None, overrides=None, info_tag=False):
+    if profile is None:
+        profile = tempfile.mkdtemp(prefix="teliaplay-bench-")
+    settings.clear()
+    settings.update(default_settings())
+    if overrides:
+        settings.update(overrides)
+
+    sys.modules["xbmc"] = make_xbmc()
+    sys.modules["xbmc"].InfoTagVideo = make_info_tag(info_tag)
+    sys.modules["xbmcgui"] = make_xbmcgui(
+        sys.modules["xbmc"].InfoTagVideo, info_tag
+    )
+    sys.modules["xbmcplugin"] = make_xbmcplugin()
+    sys.modules["xbmcaddon"] = make_xbmcaddon(profile)
+    sys.modules["xbmcvfs"] = make_xbmcvfs()
+    if ADDON_PATH not in sys.path:
+        sys.path.insert(0, ADDON_PATH)
+    return profile
+
+
+def set_argv(query=""):
+    sys.argv = ["plugin://{0}/".format(ADDON_ID), "1", "?" + query]
@@ -0,0 +1,77 @@
+"""Measure Kodi API calls and time spent building a 500 item directory.
+
+Panel items are normalized and turned into ListItems through the menus'
+own helpers against stubbed Kodi modules, once with ListItem.setInfo()
+as on Kodi 19 to 21, and once with only the InfoTagVideo setters as on a
+Kodi without setInfo(). Each mode runs in a fresh interpreter since the
+API is detected at import time.
+
+    python benchmarks/listitems.py [--items 500] [--repeat 20]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import timeit
+
+
+def child(info_tag, count, repeat):
+    import kodistubs
+    kodistubs.install(info_tag=info_tag)
+    kodistubs.set_argv("menu=panel")
+
+    from mediaitem import make_item
+    from resources.lib.mediaitem import POSTER
+    from resources.lib.menus import MenuList
+
+    menu_list = MenuList()
+    media_items = list(POSTER.normalize_all(
+        [make_item(index) for index in range(count)]
+    ))
+
+    def build():
+        items = []
+        for media_item in media_items:
+            menu_list._add_media_item(items, media_item)
+        return items
+
+    kodistubs.reset()
+    build()
+    calls = dict(
+        (name, value) for (name, value) in kodistubs.calls.items()
+        if name.startswith(("xbmcgui.ListItem", "xbmc.InfoTagVideo"))
+    )
+    best = min(timeit.repeat(build, number=1, repeat=repeat))
+    print(json.dumps({"calls": calls, "ms": best*1000}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--child")
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child == "infotag", args.items, args.repeat)
+        return 0
+
+    for mode in ("infotag", "setinfo"):
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), "--child", mode,
+            "--items", str(args.items), "--repeat", str(args.repeat)
+        ])
+        result = json.loads(output.decode("utf-8"))
+        total = sum(result["calls"].values())
+        print("{0}: {1:.2f} ms per directory, {2:.2f} Kodi calls per item".format(
+            mode, result["ms"], total/args.items
+        ))
+        for (name, value) in sorted(result["calls"].items()):
+            print("    {0:<40}{1:>8}".format(name, value))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
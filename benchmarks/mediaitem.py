@@ -0,0 +1,154 @@
+"""Measure per-item cost of normalizing panel items into MediaItem records.
+
+A 500 item panel fixture where most items lack images, ratings, genre or
+duration is normalized with the POSTER schema and, for comparison, with the
+try/except extraction the menus used before. The script exits with a
+non-zero status when both disagree about any field.
+
+    python benchmarks/mediaitem.py [--items 500] [--repeat 20]
+"""
+import os
+import sys
+import argparse
+import timeit
+import urllib.parse
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIELDS = (
+    "icon", "fanart", "genre", "description", "imdb", "rating", "duration",
+    "title", "price"
+)
+
+
+def make_item(index):
+    media_id = "{0}{1:08d}".format("s" if index % 4 == 0 else "m", index)
+    item = {
+        "id": media_id,
+        "image": None,
+        "images": {"showcard16x9": None},
+        "genre": None,
+        "description": None,
+        "descriptionLong": None,
+        "ratings": None,
+        "duration": None,
+        "price": None,
+        "details": {"overlay": {"placeholder": "Title {0}".format(index)}},
+        "analytics": {"content_media_id": media_id}
+    }
+    # Only every third item is complete, the rest miss most fields.
+    if index % 3 == 0:
+        item["image"] = {"source": "https%3A%2F%2Fimages.example%2F{0}".format(
+            media_id
+        )}
+        item["images"]["showcard16x9"] = {
+            "source": "https://images.example/{0}/wide".format(media_id)
+        }
+        item["genre"] = "Drama"
+        item["description"] = "Synopsis {0}".format(index)
+        item["ratings"] = {"imdb": {
+            "url": "https://www.imdb.com/title/tt{0:07d}".format(index),
+            "readableScore": "7.1"
+        }}
+        item["duration"] = {"readableShort": "1 tim 45 min"}
+    elif index % 3 == 1:
+        item["descriptionLong"] = "Long synopsis {0}".format(index)
+    if index % 10 == 0:
+        item["price"] = {"readable": "49 kr"}
+    return item
+
+
+def legacy(item):
+    from resources.lib.timeutils import TimezoneStamps
+
+    try:
+        icon = urllib.parse.unquote(item["image"]["source"])
+    except Exception:
+        icon = None
+    try:
+        fanart = urllib.parse.unquote(item["images"]["showcard16x9"]["source"])
+    except Exception:
+        fanart = None
+    try:
+        genre = item["genre"]
+    except Exception:
+        genre = ""
+    try:
+        description = item["description"]
+    except Exception:
+        description = ""
+    if not description:
+        try:
+            description = item["descriptionLong"]
+        except Exception:
+            description = ""
+    try:
+        imdb = item["ratings"]["imdb"]["url"].split("/")[-1]
+    except Exception:
+        imdb = ""
+    try:
+        rating = item["ratings"]["imdb"]["readableScore"]
+    except Exception:
+        rating = ""
+    try:
+        duration = TimezoneStamps.convert_to_seconds(
+            item["duration"]["readableShort"]
+        )
+    except Exception:
+        duration = 0
+    try:
+        price = item["price"]["readable"]
+    except Exception:
+        price = None
+    title = item["details"]["overlay"]["placeholder"]
+    return {
+        "icon": icon, "fanart": fanart, "genre": genre or "",
+        "description": description or "", "imdb": imdb, "rating": rating,
+        "duration": duration, "title": title, "price": price
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from resources.lib.mediaitem import POSTER
+
+    items = [make_item(index) for index in range(args.items)]
+
+    mismatches = 0
+    for (item, media_item) in zip(items, POSTER.normalize_all(items)):
+        expected = legacy(item)
+        for field in FIELDS:
+            if getattr(media_item, field) != expected[field]:
+                mismatches += 1
+                print("MISMATCH {0}.{1}: {2!r} != {3!r}".format(
+                    item["id"], field, getattr(media_item, field),
+                    expected[field]
+                ))
+
+    results = {}
+    for (name, normalize) in (
+        ("try/except", lambda: [legacy(item) for item in items]),
+        ("schema", lambda: list(POSTER.normalize_all(items)))
+    ):
+        best = min(timeit.repeat(normalize, number=1, repeat=args.repeat))
+        results[name] = best
+        print("{0:<12}{1:>10.2f} us/item{2:>10.2f} ms/panel".format(
+            name, best/args.items*1e6, best*1000
+        ))
+    print("speedup     {0:>10.2f}x".format(
+        results["try/except"]/results["schema"]
+    ))
+
+    if mismatches:
+        print("FAIL {0} mismatching fields".format(mismatches))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
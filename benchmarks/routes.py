@@ -0,0 +1,278 @@
+"""Time every plugin route end to end against stubbed Kodi and replayed API.
+
+The Kodi modules are replaced by kodistubs and WebUtils by a fake that
+answers every TeliaPlay request from fixtures.py, so the numbers cover the
+add-on's own work: routing, decoding, normalization and ListItem building.
+Each route reports p50/p95 wall time, calls into the Kodi stubs and API
+requests per run, and the peak of traced allocations.
+
+With --network the real WebUtils is used instead, against fakeserver.py
+running in a thread with the given latency, jitter and throughput cap, so
+caching, prefetching and concurrency show up under network conditions.
+
+    python benchmarks/routes.py [--repeat 20] [--routes page panel]
+        [--cache] [--trace] [--fixtures DIR] [--save FILE] [--compare FILE]
+        [--network [--latency 40] [--jitter 10] [--throughput 2000]
+         [--conditions FILE]]
+
+With --compare, routes whose p50 grew by more than --tolerance percent
+over the saved results are reported and the script exits non-zero.
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import collections
+import tracemalloc
+
+
+# route: query string
+ROUTES = collections.OrderedDict((
+    ("main", ""),
+    ("page", "menu=page&pageId=start"),
+    ("pageSubmenu", "menu=page&pageId=start&mode=Filmer"),
+    ("panel", "menu=panel&panelId=panel-movies&page=0"),
+    ("stores", "menu=page&mode=Alla Playtjänster"),
+    ("store", "menu=page&mode=Alla Playtjänster&storeId=store-1"),
+    ("storePanel", "menu=storePanel&storeId=store-1&panelId=store-panel-1"),
+    ("series", "menu=series&seriesId=s0000005"),
+    ("season", "menu=season&seasonId=s0000005-1"),
+    ("epg", "menu=page&pageId=epg"),
+    ("epgDay", "menu=page&pageId=epg&channelId=3&dayOffset=-1"),
+    ("search", "menu=search&panelId=0&page=0"),
+    ("play", "menu=play&streamId=m0000001&streamType=vod"),
+))
+
+requests_made = collections.Counter()
+
+
+class FakeResponse():
+
+    def __init__(self, url, status_code, body):
+        self.url = url
+        self.status_code = status_code
+        self.reason = "OK" if status_code == 200 else "Error"
+        self.headers = {"Content-Type": "application/json"}
+        self.encoding = "utf-8"
+        self.content = json.dumps(body).encode("utf-8")
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class FakeWebUtils():
+
+    def __init__(self, pool_port=None, validator_store=None, base_url=None):
+        pass
+
+    def make_request(self, request, headers=None, payload=None, stream=False):
+        import fixtures
+
+        method = list(request.keys())[0]
+        path = request[method].get("filename", "")
+        params = request[method].get("query")
+        (status, body) = fixtures.respond(method, path, params, payload)
+
+        (name, _) = fixtures.find_endpoint(method, path)
+        if name == "graphql":
+            name = params["operationName"]
+        elif name == "mutation":
+            name = payload["operationName"]
+        requests_made["{0} {1}".format(method, name)] += 1
+        return FakeResponse(request[method]["host"] + path, status, body)
+
+
+def install_fakes(cache, trace=False, base_url=None):
+    import kodistubs
+    profile = kodistubs.install(overrides={
+        "user1": "bench@example.com",
+        "pass1": "secret",
+        "cache": "true" if cache else "false",
+        "tracing": "true" if trace else "false",
+        "apiBaseUrl": base_url or ""
+    })
+
+    if not base_url:
+        from resources.lib import webutils
+        webutils.WebUtils = FakeWebUtils
+
+    # inputstreamhelper is a separate add-on; it always finds Widevine here.
+    inputstreamhelper = types.ModuleType("inputstreamhelper")
+
+    class Helper():
+        inputstream_addon = "inputstream.adaptive"
+
+        def __init__(self, protocol, drm=None):
+            pass
+
+        def check_inputstream(self):
+            return True
+
+    inputstreamhelper.Helper = Helper
+    sys.modules["inputstreamhelper"] = inputstreamhelper
+
+    kodistubs.set_argv()
+    from resources.lib.kodiutils import SearchHistory
+    SearchHistory("bench@example.com").add("drama")
+    return profile
+
+
+def run_route(query):
+    import kodistubs
+    from resources.lib import plugin
+
+    kodistubs.set_argv(query)
+    plugin.run()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction*(len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(route, query, repeat):
+    import kodistubs
+
+    # The first run logs in and warms caches; it is not counted.
+    run_route(query)
+
+    timings = []
+    for _ in range(repeat):
+        kodistubs.reset()
+        requests_made.clear()
+        start = time.perf_counter()
+        run_route(query)
+        timings.append((time.perf_counter() - start)*1000)
+    stub_calls = dict(kodistubs.calls)
+    api_requests = dict(requests_made)
+
+    tracemalloc.start()
+    run_route(query)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "route": route,
+        "p50_ms": percentile(timings, 0.5),
+        "p95_ms": percentile(timings, 0.95),
+        "stub_calls": stub_calls,
+        "api_requests": api_requests,
+        "peak_kb": peak/1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--routes", nargs="+", choices=list(ROUTES))
+    parser.add_argument("--cache", action="store_true",
+                        help="Enable the response cache.")
+    parser.add_argument("--fixtures",
+                        help="Directory with recorded <name>.json responses.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="List stub calls and API requests per route.")
+    parser.add_argument("--trace", action="store_true",
+                        help="Record traces and print their summary.")
+    parser.add_argument("--network", action="store_true",
+                        help="Send real requests to a local fakeserver.py.")
+    parser.add_argument("--latency", type=float, default=40)
+    parser.add_argument("--jitter", type=float, default=10)
+    parser.add_argument("--throughput", type=float, default=2000,
+                        help="Body throughput cap in kB/s, 0 for none.")
+    parser.add_argument("--conditions",
+                        help="JSON file with per endpoint conditions.")
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=20)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        os.environ["TELIAPLAY_FIXTURES"] = os.path.abspath(args.fixtures)
+    server = None
+    if args.network:
+        global requests_made
+        from fakeserver import FakeTeliaServer
+
+        conditions = {}
+        if args.conditions:
+            with open(args.conditions) as f:
+                conditions = json.load(f)
+        server = FakeTeliaServer(defaults={
+            "latency_ms": args.latency,
+            "jitter_ms": args.jitter,
+            "throughput_kbps": args.throughput
+        }, conditions=conditions).start()
+        requests_made = server.requests
+    install_fakes(args.cache, args.trace, server and server.base_url)
+
+    results = []
+    print("{0:<13}{1:>9}{2:>9}{3:>12}{4:>10}{5:>12}".format(
+        "route", "p50 ms", "p95 ms", "stub calls", "requests", "peak kB"
+    ))
+    for (route, query) in ROUTES.items():
+        if args.routes and route not in args.routes:
+            continue
+        result = measure(route, query, args.repeat)
+        results.append(result)
+        print("{0:<13}{1:>9.2f}{2:>9.2f}{3:>12}{4:>10}{5:>12.0f}".format(
+            route, result["p50_ms"], result["p95_ms"],
+            sum(result["stub_calls"].values()),
+            sum(result["api_requests"].values()), result["peak_kb"]
+        ))
+        if args.verbose:
+            for (name, value) in sorted(result["stub_calls"].items()):
+                print("    {0:<44}{1:>6}".format(name, value))
+            for (name, value) in sorted(result["api_requests"].items()):
+                print("    {0:<44}{1:>6}".format(name, value))
+
+    if args.trace:
+        from resources.lib.tracing import tracer, summarize
+        summary = summarize(tracer.records())
+        for (layer, totals) in sorted(summary["layers"].items()):
+            print("{0:<13}{1:>9.0f} ms in {2} calls".format(
+                layer, totals["ms"], totals["count"]
+            ))
+        for request in summary["slowest"]:
+            print("    {0:<44}{1:>8.2f} ms".format(
+                request["name"], request["ms"]
+            ))
+        tracer.clear()
+
+    if server:
+        server.stop()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = dict((result["route"], result) for result in json.load(f))
+        for result in results:
+            before = baseline.get(result["route"])
+            if before and result["p50_ms"] > \
+                    before["p50_ms"]*(1 + args.tolerance/100):
+                failures.append("{0}: p50 {1:.2f} ms, was {2:.2f} ms".format(
+                    result["route"], result["p50_ms"], before["p50_ms"]
+                ))
+
+    for failure in failures:
+        print("REGRESSION " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Measure plugin startup cost per route using stubbed Kodi modules.
+
+Every route is run in a fresh interpreter so that import costs are not
+hidden by modules loaded by an earlier run. The script exits with a
+non-zero status when a route exceeds its time budget or loads a module
+it has no use for.
+
+    python benchmarks/startup.py [--repeat 5] [--scale 1.0]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+
+HEAVY_MODULES = ("requests", "dateutil", "pytz", "inputstreamhelper")
+
+# route: (query string, budget for first output in milliseconds)
+ROUTES = {
+    "searchmenu": ("menu=searchmenu", 60),
+    "history": ("menu=history", 60),
+    "removesearch": ("menu=removesearch&panelId=0", 60),
+    "clearsearch": ("menu=clearsearch", 60),
+}
+
+
+def seed(profile):
+    import kodistubs
+    kodistubs.install(profile)
+    kodistubs.set_argv()
+    from resources.lib.kodiutils import SearchHistory
+    history = SearchHistory("")
+    for query in ("first", "second", "third"):
+        history.add(query)
+
+
+def child(route, profile):
+    import kodistubs
+    kodistubs.install(profile)
+    kodistubs.set_argv(ROUTES[route][0])
+
+    start = time.perf_counter()
+    from resources.lib import plugin
+    imported = time.perf_counter()
+    plugin.run()
+    finished = time.perf_counter()
+
+    if kodistubs.first_output:
+        first_output = kodistubs.first_output[0]
+    else:
+        first_output = finished
+
+    print(json.dumps({
+        "import_ms": (imported - start)*1000,
+        "first_output_ms": (first_output - start)*1000,
+        "total_ms": (finished - start)*1000,
+        "heavy_modules": sorted(
+            name for name in HEAVY_MODULES if name in sys.modules
+        )
+    }))
+
+
+def run_child(*args):
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__)] + list(args)
+    )
+    return json.loads(output.decode("utf-8")) if output.strip() else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scale", type=float, default=1.0,
+        help="Multiply all budgets, e.g. 4 on slow set-top boxes."
+    )
+    parser.add_argument("--child")
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--profile")
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.profile)
+        return 0
+    if args.child:
+        child(args.child, args.profile)
+        return 0
+
+    failures = []
+    print("{0:<14}{1:>12}{2:>14}{3:>12}  {4}".format(
+        "route", "import ms", "first out ms", "budget ms", "heavy modules"
+    ))
+    for (route, (query, budget)) in ROUTES.items():
+        results = []
+        for _ in range(args.repeat):
+            profile = tempfile.mkdtemp(prefix="teliaplay-startup-")
+            run_child("--seed", "--profile", profile)
+            results.append(run_child("--child", route, "--profile", profile))
+
+        import_ms = statistics.median(r["import_ms"] for r in results)
+        first_output_ms = statistics.median(
+            r["first_output_ms"] for r in results
+        )
+        heavy_modules = sorted(set(
+            name for r in results for name in r["heavy_modules"]
+        ))
+        print("{0:<14}{1:>12.1f}{2:>14.1f}{3:>12.0f}  {4}".format(
+            route, import_ms, first_output_ms, budget*args.scale,
+            ", ".join(heavy_modules) or "-"
+        ))
+
+        if first_output_ms > budget*args.scale:
+            failures.append("{0}: {1:.1f} ms exceeds budget of {2:.0f} ms".format(
+                route, first_output_ms, budget*args.scale
+            ))
+        if heavy_modules:
+            failures.append("{0}: loaded {1}".format(
+                route, ", ".join(heavy_modules)
+            ))
+
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -1,7 +1,11 @@
 import platform
 import uuid
 import json
-from resources.lib.webutils import WebUtils
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from resources.lib.jsonstream import JsonStream
+from resources.lib.tracing import tracer
 
 
 class TeliaException(Exception):
@@ -24,14 +28,52 @@ def error_check(response_json):
         raise TeliaException(response_json["message"])
 
 
+def fetch_manifest(web_utils, url):
+    parts = urllib.parse.urlsplit(url)
+    request = {
+        "GET": {
+            "scheme": parts.scheme,
+            "host": parts.netloc,
+            # Keep the signed query exactly as the gateway made it.
+            "filename": urllib.parse.urlunsplit(
+                ("", "", parts.path, parts.query, "")
+            )
+        }
+    }
+    headers = {
+        "User-Agent": "kodi.tv"
+    }
+    response = web_utils.make_request(request, headers=headers)
+    if response.status_code != 200:
+        raise TeliaException("Manifest request failed: {0} {1}".format(
+            response.status_code, response.reason
+        ))
+    return response.text
+
+
 class TeliaPlay():
 
-    def __init__(self, userdata):
+    def __init__(self, userdata, cache=None, web_utils=None):
         self.tv_client_boot_id = userdata["bootUUID"]
         self.device_id = userdata["deviceUUID"]
         self.session_id = str(uuid.uuid4())
         self.token_data = userdata["tokenData"]
-        self.web_utils = WebUtils()
+        if web_utils is None:
+            from resources.lib.webutils import WebUtils
+            web_utils = WebUtils()
+        self.web_utils = web_utils
+        self.cache = cache
+        # Large panel pages are fetched as several smaller windows in parallel.
+        self.panel_chunk_size = None
+        self.panel_workers = 4
+        # Expired cache entries younger than this are served while they
+        # are refreshed in the background.
+        self.max_stale = 0
+        self.revalidations = []
+        self.stream_chunk_size = 65536
+        # Remembers provisioning per device and boot session, see provision().
+        self.state_store = None
+        self.provision_ttl = 6*3600
 
     @property
     def graphql_hashes(self):
@@ -49,6 +91,97 @@ class TeliaPlay():
             "removeFromMyList": "630c2f99d817682d4f15d41084cdc2f40dc158a5dae0bd2ab0e815ce268da277"
         }
 
+    def cached_query(self, request, headers):
+        query = request["GET"]["query"]
+        operation = query["operationName"]
+        variables = query["variables"]
+
+        if self.cache:
+            entry = self.cache.get_entry(
+                operation, variables, self.device_id,
+                max(self.max_stale, self.cache.ttls.get(operation, 0))
+            )
+            if entry is not None:
+                (response_json, age) = entry
+                stale = age > self.cache.ttls[operation]
+                tracer.event(
+                    "cache", operation, outcome="stale" if stale else "hit",
+                    age=round(age, 1)
+                )
+                if stale:
+                    self.revalidate(request, headers, response_json)
+                return response_json
+            if self.cache.is_cacheable(operation):
+                tracer.event("cache", operation, outcome="miss")
+
+        return self.fetch_query(request, headers)
+
+    def fetch_query(self, request, headers):
+        query = request["GET"]["query"]
+        response_json = self.web_utils.make_request(
+            request, headers=headers
+        ).json()
+        error_check(response_json)
+
+        if self.cache:
+            self.cache.put(
+                query["operationName"], query["variables"], response_json,
+                self.device_id
+            )
+        return response_json
+
+    def stream_query(self, request, headers, path):
+        # Yields the items of the array at path while the response is still
+        # being decoded. Fresh cache entries are streamed from their stored
+        # body, network responses are not written back to the cache since
+        # that would mean keeping the whole body in memory after all.
+        # GraphQL errors are only raised once the body has been read, that
+        # is after the items before them have been consumed.
+        query = request["GET"]["query"]
+        if self.cache:
+            entry = self.cache.get_entry(
+                query["operationName"], query["variables"], self.device_id,
+                self.cache.ttls.get(query["operationName"], 0), raw=True
+            )
+            if entry is not None:
+                tracer.event(
+                    "cache", query["operationName"], outcome="hit",
+                    age=round(entry[1], 1), streamed=True
+                )
+                return JsonStream([entry[0]], path, error_check)
+
+        response = self.web_utils.make_request(
+            request, headers=headers, stream=True
+        )
+        return JsonStream(
+            response.iter_content(self.stream_chunk_size), path, error_check
+        )
+
+    def revalidate(self, request, headers, stale_json):
+        # Serve the stale response now and refresh the cache in the background.
+        revalidation = {"stale": stale_json, "fresh": None}
+
+        def run():
+            try:
+                revalidation["fresh"] = self.fetch_query(request, headers)
+            except Exception:
+                pass
+
+        revalidation["thread"] = threading.Thread(target=run)
+        revalidation["thread"].start()
+        self.revalidations.append(revalidation)
+
+    def finish_revalidations(self):
+        changed = False
+        for revalidation in self.revalidations:
+            revalidation["thread"].join()
+            fresh = revalidation["fresh"]
+            if fresh is not None and json.dumps(fresh, sort_keys=True) != \
+                    json.dumps(revalidation["stale"], sort_keys=True):
+                changed = True
+        self.revalidations = []
+        return changed
+
     def login(self, username, password):
         request = {
             "POST": {
@@ -172,13 +305,10 @@ class TeliaPlay():
             "x-country": "SE"
         }
 
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["mainMenu"]["items"]
 
-    def search(self, query, limit, offset):
+    def search(self, query, limit, offset, stream=False):
         request = {
             "GET": {
                 "scheme": "https",
@@ -211,10 +341,11 @@ class TeliaPlay():
             "x-country": "SE"
         }
         
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        if stream:
+            return self.stream_query(
+                request, headers, ("data", "search2", "posters")
+            )
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["search2"]
 
     def get_page(self, page_id):
@@ -246,10 +377,7 @@ class TeliaPlay():
             "x-country": "SE"
         }
 
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        response_json = self.cached_query(request, headers)
         filtered_list = [item for item in response_json["data"]["page"]["pagePanels"]["panels"] if "title" in item]
         return filtered_list
 
@@ -284,10 +412,7 @@ class TeliaPlay():
             "x-country": "SE"
         }
 
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["channels"]
 
     def get_channel(self, channel_id, timestamp):
@@ -320,10 +445,7 @@ class TeliaPlay():
             "x-country": "SE"
         }
 
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["channel"]
 
     def get_store(self, store_id):
@@ -355,13 +477,34 @@ class TeliaPlay():
             "x-country": "SE"
         }
 
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["store"]
 
-    def get_panel(self, panel_id, limit, offset):
+    def get_panel(self, panel_id, limit, offset, stream=False):
+        chunk_size = self.panel_chunk_size
+        if stream or not chunk_size or limit <= chunk_size:
+            return self.get_panel_window(panel_id, limit, offset, stream)
+
+        offsets = range(offset, offset + limit, chunk_size)
+        with ThreadPoolExecutor(max_workers=self.panel_workers) as executor:
+            chunks = list(executor.map(
+                lambda chunk_offset: self.get_panel_window(
+                    panel_id, min(chunk_size, offset + limit - chunk_offset),
+                    chunk_offset
+                ), offsets
+            ))
+
+        panel = dict(chunks[0])
+        panel["items"] = []
+        for chunk in chunks:
+            panel["items"].extend(chunk["items"] or [])
+            panel["pageInfo"] = chunk.get("pageInfo")
+            # Windows past the end of the panel are empty.
+            if not (chunk.get("pageInfo") and chunk["pageInfo"]["hasNextPage"]):
+                break
+        return panel
+
+    def get_panel_window(self, panel_id, limit, offset, stream=False):
         request = {
             "GET": {
                 "scheme": "https",
@@ -398,10 +541,11 @@ class TeliaPlay():
             "x-country": "SE"
         }
 
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        if stream:
+            return self.stream_query(request, headers, (
+                "data", "panel", "selectionMediaContent", "items"
+            ))
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["panel"]["selectionMediaContent"]
 
     def get_series(self, series_id):
@@ -432,13 +576,10 @@ class TeliaPlay():
             "Authorization": "Bearer " + self.token_data["accessToken"],
             "x-country": "SE"
         }
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["series"]
 
-    def get_season(self, season_id):
+    def get_season(self, season_id, stream=False):
         request = {
             "GET": {
                 "scheme": "https",
@@ -470,10 +611,11 @@ class TeliaPlay():
             "x-country": "SE"
         }
 
-        response_json = self.web_utils.make_request(
-            request, headers=headers
-        ).json()
-        error_check(response_json)
+        if stream:
+            return self.stream_query(request, headers, (
+                "data", "season", "panel", "posters", "items"
+            ))
+        response_json = self.cached_query(request, headers)
         return response_json["data"]["season"]["panel"]["posters"]["items"]
 
     def validate_stream(self):
@@ -503,6 +645,26 @@ class TeliaPlay():
         if response.status_code != 200:
             error_check(response.json())
 
+    def provision(self):
+        # The device only has to be provisioned once in a while, not before
+        # every stream. Returns whether a request was made.
+        key = "provision:" + self.tv_client_boot_id
+        if self.state_store and \
+                self.state_store.get_state(self.device_id, key):
+            return False
+        self.validate_stream()
+        if self.state_store:
+            self.state_store.put_state(
+                self.device_id, key, True, self.provision_ttl
+            )
+        return True
+
+    def forget_provision(self):
+        if self.state_store:
+            self.state_store.clear_state(
+                self.device_id, "provision:" + self.tv_client_boot_id
+            )
+
     def get_vod(self, video_id):
         request = {
             "GET": {
@@ -582,6 +744,8 @@ class TeliaPlay():
             request, headers=headers, payload=payload
         ).json()
         error_check(response_json)
+        if self.cache:
+            self.cache.invalidate("getPage", "getPanel")
         return response_json
 
     def remove_from_my_list(self, media_id):
@@ -615,16 +779,23 @@ class TeliaPlay():
             request, headers=headers, payload=payload
         ).json()
         error_check(response_json)
+        if self.cache:
+            self.cache.invalidate("getPage", "getPanel")
         return response_json
 
+    @staticmethod
+    def ticket_path(stream_id, stream_type):
+        return "{0}/{1}".format(
+            "CHANNEL" if stream_type == "live" else "MEDIA", stream_id
+        )
+
     def get_stream(self, stream_id, stream_type):
         request = {
             "POST": {
                 "scheme": "https",
                 "host": "streaminggateway.clientapi-prod.live.tv.telia.net",
                 "filename": "/streaminggateway/rest/secure/v2/streamingticket/"
-                "{0}/{1}".format(
-                    "CHANNEL" if stream_type == "live" else "MEDIA", stream_id),
+                + self.ticket_path(stream_id, stream_type),
                 "query": {
                     "country": "SE"
                 }
@@ -677,14 +848,18 @@ class TeliaPlay():
         except IndexError:
             return response_json["streams"][0]
 
-    def delete_stream(self):
+    def get_manifest(self, url):
+        return fetch_manifest(self.web_utils, url)
+
+    def delete_stream(self, ticket_path, session_id=None):
         request = {
             "DELETE": {
                 "scheme": "https",
                 "host": "streaminggateway.clientapi-prod.live.tv.telia.net",
-                "filename": "/streaminggateway/rest/secure/v2/streamingticket/CHANNEL/18",
+                "filename": "/streaminggateway/rest/secure/v2/streamingticket/"
+                + ticket_path,
                 "query": {
-                    "sessionId": self.session_id,
+                    "sessionId": session_id or self.session_id,
                     "whiteLabelBrand": "TELIA",
                     "country": "SE"
                 }
@@ -0,0 +1,173 @@
+import json
+import time
+import hashlib
+from resources.lib.database import Database
+
+
+class ResponseCache(Database):
+    filename = "cache.db"
+    schema = (
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, operation TEXT, body TEXT, "
+        "size INTEGER, stored REAL, accessed REAL)",
+        "CREATE INDEX IF NOT EXISTS responses_accessed "
+        "ON responses (accessed)"
+    )
+    # Time to live in seconds for each cacheable graphql operation.
+    ttls = {
+        "getMainMenu":       6*3600,
+        "getStorePage":      6*3600,
+        "getCdpSeries":      3600,
+        "getCdpSeasonPanel": 30*60,
+        "getPage":           15*60,
+        "getTvChannel":      15*60,
+        "getPanel":          10*60,
+        "search2":           5*60,
+        "getTvChannels":     30
+    }
+
+    def __init__(self, directory, max_size):
+        super().__init__(directory)
+        self.max_size = max_size
+
+    @staticmethod
+    def make_key(operation, variables, scope=""):
+        key_data = json.dumps(
+            [scope, operation, variables], sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha1(key_data.encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, operation):
+        return operation in self.ttls
+
+    def get(self, operation, variables, scope=""):
+        entry = self.get_entry(operation, variables, scope)
+        if entry is None or entry[1] > self.ttls[operation]:
+            return None
+        return entry[0]
+
+    def get_entry(self, operation, variables, scope="", max_age=None,
+                  raw=False):
+        # Returns the cached value and its age, even when it has expired.
+        # With raw the undecoded json body is returned instead.
+        if not self.is_cacheable(operation):
+            return None
+
+        key = self.make_key(operation, variables, scope)
+        now = time.time()
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT body, stored FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            body, stored = row
+            if max_age is not None and now - stored > max_age:
+                return None
+            conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return (body if raw else json.loads(body), now - stored)
+
+    def put(self, operation, variables, value, scope=""):
+        if not self.is_cacheable(operation):
+            return
+
+        key = self.make_key(operation, variables, scope)
+        body = json.dumps(value, separators=(",", ":"))
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, operation, body, size, stored, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, operation, body, len(body), now, now)
+            )
+            self.evict(conn, "responses", self.max_size)
+
+    def invalidate(self, *operations):
+        with self.connection() as conn:
+            conn.executemany(
+                "DELETE FROM responses WHERE operation = ?",
+                [(operation,) for operation in operations]
+            )
+
+    def clear(self):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM responses")
+
+
+class ValidatorStore(Database):
+    filename = "validators.db"
+    schema = (
+        "CREATE TABLE IF NOT EXISTS validators ("
+        "key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+        "headers TEXT, encoding TEXT, body BLOB, size INTEGER, "
+        "accessed REAL)",
+        "CREATE INDEX IF NOT EXISTS validators_accessed "
+        "ON validators (accessed)",
+        "CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER)"
+    )
+
+    def __init__(self, directory, max_size):
+        super().__init__(directory)
+        self.max_size = max_size
+
+    @staticmethod
+    def make_key(url, scope=""):
+        # Persisted query URLs are the same for every account, while the
+        # bodies of per-user operations are not.
+        return "{0} {1}".format(scope, url)
+
+    def get(self, url, scope=""):
+        key = self.make_key(url, scope)
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT etag, last_modified, headers, encoding, body "
+                "FROM validators WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE validators SET accessed = ? WHERE key = ?",
+                (time.time(), key)
+            )
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "headers": json.loads(row[2]),
+            "encoding": row[3],
+            "body": row[4]
+        }
+
+    def put(self, url, etag, last_modified, headers, encoding, body,
+            scope=""):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO validators (key, etag, last_modified, "
+                "headers, encoding, body, size, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.make_key(url, scope), etag, last_modified, json.dumps(headers), encoding,
+                 body, len(body), time.time())
+            )
+            self.evict(conn, "validators", self.max_size)
+
+    def record_revalidation(self, bytes_saved):
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO stats (key, value) VALUES (?, 0)",
+                (("revalidations",), ("bytes_saved",))
+            )
+            conn.execute(
+                "UPDATE stats SET value = value + 1 WHERE key = 'revalidations'"
+            )
+            conn.execute(
+                "UPDATE stats SET value = value + ? WHERE key = 'bytes_saved'",
+                (bytes_saved,)
+            )
+
+    def stats(self):
+        with self.connection() as conn:
+            rows = conn.execute("SELECT key, value FROM stats").fetchall()
+        return dict(rows)
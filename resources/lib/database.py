@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import contextlib
+
+
+class Database():
+    filename = None
+    schema = ()
+
+    def __init__(self, directory, filename=None):
+        os.makedirs(directory, exist_ok=True)
+        self.filepath = os.path.join(directory, filename or self.filename)
+        with self.connection() as conn:
+            # Lets plugin invocations read while the service is writing.
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                conn.execute(statement)
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.filepath, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def evict(conn, table, max_size):
+        # Drop least recently used rows until the table fits again. The table
+        # needs key, size and accessed columns.
+        total_size = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM {0}".format(table)
+        ).fetchone()[0]
+        if total_size <= max_size:
+            return
+
+        kept_size = 0
+        evicted_keys = []
+        for (key, size) in conn.execute(
+            "SELECT key, size FROM {0} ORDER BY accessed DESC".format(table)
+        ).fetchall():
+            kept_size += size
+            if kept_size > max_size:
+                evicted_keys.append((key,))
+        conn.executemany(
+            "DELETE FROM {0} WHERE key = ?".format(table), evicted_keys
+        )
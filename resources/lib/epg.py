@@ -0,0 +1,329 @@
+import json
+import time
+import hashlib
+import urllib.parse
+from resources.lib.database import Database
+from resources.lib.kodiutils import AddonUtils
+
+
+def program_record(program):
+    media = program["media"]
+
+    try:
+        icon = urllib.parse.unquote(media["images"]["showcard2x3"]["source"])
+    except Exception:
+        icon = None
+
+    try:
+        fanart = urllib.parse.unquote(
+            media["images"]["showcard16x9"]["source"]
+        )
+    except Exception:
+        fanart = None
+
+    try:
+        imdb = media["ratings"]["imdb"]["url"].split("/")[-1]
+    except Exception:
+        imdb = ""
+
+    try:
+        rating = media["ratings"]["imdb"]["readableScore"]
+    except Exception:
+        rating = ""
+
+    return {
+        "start": program["startTime"]["timestamp"],
+        "end": program["endTime"]["timestamp"],
+        "media_id": media["id"],
+        "title": media["title"],
+        "description": media.get("descriptionLong") or "",
+        "icon": icon,
+        "fanart": fanart,
+        "imdb": imdb,
+        "rating": rating
+    }
+
+
+def channel_record(channel):
+    try:
+        icon = urllib.parse.unquote(channel["icons"]["dark"]["source"])
+    except Exception:
+        icon = None
+
+    return {
+        "id": channel["id"],
+        "name": channel.get("name") or "",
+        "icon": icon
+    }
+
+
+class EpgStore(Database):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS channels ("
+        "id TEXT PRIMARY KEY, position INTEGER, name TEXT, icon TEXT)",
+        "CREATE TABLE IF NOT EXISTS programs ("
+        "channel_id TEXT, start INTEGER, end INTEGER, media_id TEXT, "
+        "title TEXT, description TEXT, icon TEXT, fanart TEXT, imdb TEXT, "
+        "rating TEXT, PRIMARY KEY (channel_id, start))",
+        "CREATE INDEX IF NOT EXISTS programs_end ON programs (channel_id, end)",
+        "CREATE TABLE IF NOT EXISTS days ("
+        "channel_id TEXT, day INTEGER, digest TEXT, synced REAL, "
+        "PRIMARY KEY (channel_id, day))",
+        # Days that failed to sync are left alone until retry_at.
+        "CREATE TABLE IF NOT EXISTS failures ("
+        "channel_id TEXT, day INTEGER, retry_at REAL, "
+        "PRIMARY KEY (channel_id, day))",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)"
+    )
+    program_columns = (
+        "start", "end", "media_id", "title", "description", "icon",
+        "fanart", "imdb", "rating"
+    )
+
+    def __init__(self, directory, username):
+        # Channel line-ups depend on the subscription, so keep one database
+        # per account.
+        scope = hashlib.sha1(username.encode("utf-8")).hexdigest()[:12]
+        super().__init__(directory, "epg_{0}.db".format(scope))
+
+    def channels_synced(self):
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'channels'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def set_channels(self, channels):
+        records = [channel_record(channel) for channel in channels]
+        with self.connection() as conn:
+            conn.execute("DELETE FROM channels")
+            conn.executemany(
+                "INSERT INTO channels (id, position, name, icon) "
+                "VALUES (?, ?, ?, ?)",
+                [(record["id"], position, record["name"], record["icon"])
+                 for (position, record) in enumerate(records)]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('channels', ?)", (time.time(),)
+            )
+            for channel in channels:
+                try:
+                    programs = channel["programs"]["programItems"]
+                except (KeyError, TypeError):
+                    continue
+                self._insert_programs(conn, channel["id"], programs)
+
+    def get_channels(self, limit=-1, offset=0):
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, name, icon FROM channels ORDER BY position "
+                "LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+            total = conn.execute("SELECT COUNT(*) FROM channels").fetchone()[0]
+        channels = [
+            {"id": row[0], "name": row[1], "icon": row[2]} for row in rows
+        ]
+        has_next_page = limit >= 0 and offset + limit < total
+        return (channels, has_next_page)
+
+    def current_programs(self, channel_ids, timestamp):
+        current = {}
+        with self.connection() as conn:
+            for channel_id in channel_ids:
+                row = conn.execute(
+                    "SELECT {0} FROM programs WHERE channel_id = ? "
+                    "AND start <= ? AND end > ?".format(
+                        ", ".join(self.program_columns)
+                    ), (channel_id, timestamp, timestamp)
+                ).fetchone()
+                if row:
+                    current[channel_id] = dict(zip(self.program_columns, row))
+        return current
+
+    def get_day(self, channel_id, day, day_end, max_age=None):
+        # day_end is the next midnight, days are 23 or 25 hours long when
+        # the clocks change.
+        if self.needs_sync(channel_id, day, max_age):
+            return None
+
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT {0} FROM programs WHERE channel_id = ? "
+                "AND start >= ? AND start < ? ORDER BY start".format(
+                    ", ".join(self.program_columns)
+                ), (channel_id, day, day_end)
+            ).fetchall()
+        return [dict(zip(self.program_columns, row)) for row in rows]
+
+    def needs_sync(self, channel_id, day, max_age):
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT synced FROM days WHERE channel_id = ? AND day = ?",
+                (channel_id, day)
+            ).fetchone()
+        if row is None:
+            return True
+        return max_age is not None and time.time() - row[0] > max_age
+
+    def synced_days(self):
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT channel_id, day, synced FROM days"
+            ).fetchall()
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    def failed_days(self):
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT channel_id, day, retry_at FROM failures"
+            ).fetchall()
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    def set_failed(self, channel_id, day, retry_at):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO failures (channel_id, day, retry_at) "
+                "VALUES (?, ?, ?)", (channel_id, day, retry_at)
+            )
+
+    def store_day(self, channel_id, day, day_end, programs):
+        digest = hashlib.sha1(json.dumps(
+            programs, sort_keys=True
+        ).encode("utf-8")).hexdigest()
+
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT digest FROM days WHERE channel_id = ? AND day = ?",
+                (channel_id, day)
+            ).fetchone()
+            # Unchanged schedules only need their sync time bumped.
+            if row is None or row[0] != digest:
+                conn.execute(
+                    "DELETE FROM programs WHERE channel_id = ? "
+                    "AND start >= ? AND start < ?",
+                    (channel_id, day, day_end)
+                )
+                self._insert_programs(conn, channel_id, programs)
+            conn.execute(
+                "INSERT OR REPLACE INTO days (channel_id, day, digest, synced) "
+                "VALUES (?, ?, ?, ?)", (channel_id, day, digest, time.time())
+            )
+            conn.execute(
+                "DELETE FROM failures WHERE channel_id = ? AND day = ?",
+                (channel_id, day)
+            )
+
+    def _insert_programs(self, conn, channel_id, programs):
+        rows = []
+        for program in programs:
+            try:
+                record = program_record(program)
+            except (KeyError, TypeError):
+                continue
+            rows.append(
+                (channel_id,) + tuple(
+                    record[column] for column in self.program_columns
+                )
+            )
+        conn.executemany(
+            "INSERT OR REPLACE INTO programs (channel_id, {0}) "
+            "VALUES (?, {1})".format(
+                ", ".join(self.program_columns),
+                ", ".join("?" for _ in self.program_columns)
+            ), rows
+        )
+
+    def prune(self, before):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM programs WHERE end < ?", (before,))
+            conn.execute("DELETE FROM days WHERE day < ?", (before,))
+            conn.execute("DELETE FROM failures WHERE day < ?", (before,))
+
+
+class EpgSync():
+    days = range(-7, 8)
+    channels_max_age = 6*3600
+    # Past schedules never change; upcoming ones are refreshed now and then.
+    today_max_age = 3*3600
+    upcoming_max_age = 12*3600
+    channels_per_request = 100
+    # Seconds before a day that failed to sync is requested again.
+    failure_backoff = 3600
+
+    def __init__(self, telia_play, store, timezone_stamps):
+        self.addon = AddonUtils()
+        self.telia_play = telia_play
+        self.store = store
+        self.timezone_stamps = timezone_stamps
+
+    def sync_channels(self):
+        channels = []
+        offset = 0
+        timestamp = self.timezone_stamps.now("ms") // 60000 * 60000
+        while True:
+            response = self.telia_play.get_channels(
+                timestamp, self.channels_per_request, offset
+            )
+            channels.extend(response["channelItems"])
+            if not (response.get("pageInfo") and
+                    response["pageInfo"]["hasNextPage"]):
+                break
+            offset += self.channels_per_request
+        self.store.set_channels(channels)
+
+    @classmethod
+    def max_age(cls, day_offset):
+        if day_offset < 0:
+            return None
+        elif day_offset <= 1:
+            return cls.today_max_age
+        return cls.upcoming_max_age
+
+    def pending(self):
+        (channels, _) = self.store.get_channels()
+        synced_days = self.store.synced_days()
+        failed_days = self.store.failed_days()
+        time_now = time.time()
+        # Closest days first, so the most useful data arrives first.
+        for day_offset in sorted(self.days, key=abs):
+            day = self.timezone_stamps.today(day_offset, "ms")
+            day_end = self.timezone_stamps.today(day_offset + 1, "ms")
+            max_age = self.max_age(day_offset)
+            for channel in channels:
+                if failed_days.get((channel["id"], day), 0) > time_now:
+                    continue
+                synced = synced_days.get((channel["id"], day))
+                if synced is None or (
+                    max_age is not None and time_now - synced > max_age
+                ):
+                    yield (channel["id"], day, day_end)
+
+    def sync(self, max_requests=None, should_abort=None):
+        if time.time() - self.store.channels_synced() > self.channels_max_age:
+            self.sync_channels()
+
+        requests_made = 0
+        for (channel_id, day, day_end) in self.pending():
+            if max_requests is not None and requests_made >= max_requests:
+                return False
+            if should_abort and should_abort():
+                return False
+            requests_made += 1
+            # One channel failing must not hold up the rest of the guide.
+            try:
+                channel = self.telia_play.get_channel(channel_id, day)
+                self.store.store_day(
+                    channel_id, day, day_end,
+                    channel["programs"]["programItems"]
+                )
+            except Exception as e:
+                self.addon.log("EPG sync of channel {0} failed: {1}".format(
+                    channel_id, e
+                ))
+                self.store.set_failed(
+                    channel_id, day, time.time() + self.failure_backoff
+                )
+
+        self.store.prune(self.timezone_stamps.today(self.days[0], "ms"))
+        return True
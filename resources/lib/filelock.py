@@ -0,0 +1,55 @@
+import os
+import time
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class FileLock():
+    # Plugin invocations run in separate interpreters, so locking is done
+    # with an exclusively created lock file, which works on every platform
+    # Kodi supports.
+
+    def __init__(self, path, timeout=30, stale_after=120):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                self._remove_if_stale()
+                if time.time() >= deadline:
+                    raise LockTimeout(
+                        "Timed out waiting for '{0}'".format(self.path)
+                    )
+                time.sleep(0.05)
+                continue
+            with os.fdopen(fd, "w") as lock_file:
+                lock_file.write(str(os.getpid()))
+            return
+
+    def _remove_if_stale(self):
+        # A crashed process never releases its lock.
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,137 @@
+import codecs
+import json
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class JsonStream():
+    # Incrementally decodes a JSON document and yields the elements of the
+    # array found at `path` one at a time. Objects leading up to the array
+    # are walked key by key, every other value is decoded whole and kept in
+    # `document`, so only one array element is held in memory at a time.
+    whitespace = " \t\n\r"
+    number_chars = "0123456789.eE+-"
+
+    def __init__(self, chunks, path, on_complete=None):
+        self.chunks = iter(chunks)
+        self.path = tuple(path)
+        self.on_complete = on_complete
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.document = {}
+        # The object holding the streamed array, e.g. the one with pageInfo.
+        self.container = None
+
+    def __iter__(self):
+        if self._peek() != "{":
+            raise JsonStreamError("Expected a JSON object")
+        yield from self._walk_object(self.document, ())
+        if self.on_complete:
+            self.on_complete(self.document)
+
+    def _fill(self):
+        if self.eof:
+            return False
+
+        # Drop everything that has already been consumed.
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                chunk = self.text_decoder.decode(chunk)
+            if chunk:
+                self.buffer += chunk
+                return True
+        self.buffer += self.text_decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise JsonStreamError("Unexpected end of JSON document")
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise JsonStreamError("Expected '{0}' at position {1}".format(
+                char, self.pos
+            ))
+        self.pos += 1
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut off by the end of the buffer decodes as a shorter
+            # number, e.g. "2." as 2, so wait for the rest of it.
+            if (end == len(self.buffer) or (
+                isinstance(value, (int, float)) and
+                self.buffer[end] in self.number_chars
+            )) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _walk_object(self, target, path):
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self._decode()
+            self._expect(":")
+            key_path = path + (key,)
+            char = self._peek()
+            if key_path == self.path:
+                self.container = target
+                if char == "[":
+                    yield from self._walk_array()
+                else:
+                    target[key] = self._decode()
+            elif key_path == self.path[:len(key_path)] and char == "{":
+                target[key] = {}
+                yield from self._walk_object(target[key], key_path)
+            else:
+                target[key] = self._decode()
+
+            char = self._peek()
+            self.pos += 1
+            if char == "}":
+                return
+            elif char != ",":
+                raise JsonStreamError("Expected ',' or '}}' at position {0}".format(
+                    self.pos - 1
+                ))
+
+    def _walk_array(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield self._decode()
+            char = self._peek()
+            self.pos += 1
+            if char == "]":
+                return
+            elif char != ",":
+                raise JsonStreamError("Expected ',' or ']' at position {0}".format(
+                    self.pos - 1
+                ))
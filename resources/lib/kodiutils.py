@@ -4,7 +4,41 @@ import json
 import urllib.parse
 import xbmc
 import xbmcaddon
+import xbmcgui
 import xbmcvfs
+from resources.lib.filelock import FileLock
+
+
+# setInfo() keys and the InfoTagVideo setters that replace them.
+INFO_TAG_SETTERS = {
+    "title": ("setTitle", str),
+    "sorttitle": ("setSortTitle", str),
+    "plot": ("setPlot", str),
+    "duration": ("setDuration", int),
+    "dateadded": ("setDateAdded", str),
+    "imdbnumber": ("setIMDBNumber", str),
+    "rating": ("setRating", float),
+    "genre": ("setGenres", lambda genre: [genre])
+}
+# Kodi 19 already has InfoTagVideo, but without setters. setInfo() takes
+# all fields in one call, so the setters are only used once it is gone.
+USE_INFO_TAG = hasattr(getattr(xbmc, "InfoTagVideo", None), "setTitle") and \
+    not hasattr(xbmcgui.ListItem, "setInfo")
+
+
+def set_video_info(list_item, info):
+    if not USE_INFO_TAG:
+        list_item.setInfo("video", info)
+        return
+
+    info_tag = list_item.getVideoInfoTag()
+    for (key, value) in info.items():
+        (setter, convert) = INFO_TAG_SETTERS[key]
+        try:
+            value = convert(value)
+        except ValueError:
+            continue
+        getattr(info_tag, setter)(value)
 
 
 class AddonUtils():
@@ -14,7 +48,9 @@ class AddonUtils():
         self.id = self.addon.getAddonInfo("id")
         self.name = self.addon.getAddonInfo("name")
         self.url = sys.argv[0]
-        self.handle = int(sys.argv[1])
+        self.query = sys.argv[2] if len(sys.argv) > 2 else ""
+        # Services are started without a plugin handle.
+        self.handle = int(sys.argv[1]) if len(sys.argv) > 1 else -1
 
         self.path = xbmcvfs.translatePath(self.addon.getAddonInfo("path"))
         self.profile = xbmcvfs.translatePath(self.addon.getAddonInfo("profile"))
@@ -71,99 +107,264 @@ class AddonUtils():
     def get_setting_as_int(self, setting):
         return int(self.get_setting_as_float(setting))
 
+    def get_property(self, name):
+        return xbmcgui.Window(10000).getProperty(
+            "{0}.{1}".format(self.id, name)
+        )
 
-class UserDataHandler():
-    filename = "userdata.json"
-
-    def __init__(self):
-        self.addon_utils = AddonUtils()
-        os.makedirs(self.addon_utils.profile, exist_ok=True)
-        self.filepath = os.path.join(
-            self.addon_utils.profile, self.filename
+    def set_property(self, name, value):
+        xbmcgui.Window(10000).setProperty(
+            "{0}.{1}".format(self.id, name), str(value)
         )
-        self.load()
 
-    def load(self):
-        try:
-            with open(self.filepath, "r") as data_file:
-                self.userdata_json = json.load(data_file)
-        except FileNotFoundError:
-            self.userdata_json = {}
-            self.save()
+    def clear_property(self, name):
+        xbmcgui.Window(10000).clearProperty("{0}.{1}".format(self.id, name))
 
-    def save(self):
-        with open(self.filepath, "w") as data_file:
-            json.dump(self.userdata_json, data_file, indent=4)
 
-    def add(self, username, userdata):
-        self.userdata_json.update({username: userdata})
-        self.save()
+class InputstreamCheck():
+    # inputstreamhelper probes the add-on and the Widevine CDM on disk each
+    # time. The result only changes when Kodi, inputstream.adaptive or the
+    # CDM change, so it is remembered for that combination.
+    filename = "inputstream.json"
+    inputstream_addon = "inputstream.adaptive"
+    cdm_manifest = "special://home/cdm/manifest.json"
 
-    def remove(self, username):
-        if username in self.userdata_json:
-            self.userdata_json.pop(username)
-            self.save()
+    def __init__(self, protocol="mpd", drm="com.widevine.alpha"):
+        self.protocol = protocol
+        self.drm = drm
+        self.cached = False
+        self.save_path = os.path.join(AddonUtils().profile, self.filename)
 
-    def clear(self):
-        self.userdata_json = {}
-        self.save()
+    def fingerprint(self):
+        try:
+            addon_version = xbmcaddon.Addon(
+                self.inputstream_addon
+            ).getAddonInfo("version")
+        except RuntimeError:
+            addon_version = None
 
-    def get(self, username):
-        if username in self.userdata_json:
-            return self.userdata_json[username]
-        else:
+        try:
+            with open(xbmcvfs.translatePath(self.cdm_manifest), "r") as f:
+                cdm_version = json.load(f).get("version")
+        except (OSError, ValueError):
+            # Android ships Widevine with the system.
+            cdm_version = None
+
+        return [
+            self.protocol, self.drm, xbmc.getInfoLabel("System.BuildVersion"),
+            addon_version, cdm_version
+        ]
+
+    def check(self):
+        # Returns the inputstream add-on to use, None if playback is not
+        # possible.
+        fingerprint = self.fingerprint()
+        try:
+            with open(self.save_path, "r") as f:
+                saved = json.load(f)
+            if saved["fingerprint"] == fingerprint:
+                self.cached = True
+                return saved["addon"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        import inputstreamhelper
+        is_helper = inputstreamhelper.Helper(self.protocol, drm=self.drm)
+        if not is_helper.check_inputstream():
             return None
 
+        # inputstreamhelper may just have installed or updated something.
+        temp_path = self.save_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "fingerprint": self.fingerprint(),
+                "addon": is_helper.inputstream_addon
+            }, f)
+        os.replace(temp_path, self.save_path)
+        return is_helper.inputstream_addon
+
+    def invalidate(self):
+        try:
+            os.remove(self.save_path)
+        except FileNotFoundError:
+            pass
+
 
 class SearchHistory():
-    filename = "search_history.json"
+    filename = "search_history.journal"
+    legacy_filename = "search_history.json"
+    max_queries = 100
+    # The journal is rewritten once it holds this many records more than
+    # there are queries left in it.
+    compact_slack = 200
 
     def __init__(self, username):
         self.username = username
         self.addon = AddonUtils()
         os.makedirs(self.addon.profile, exist_ok=True)
         self.save_path = os.path.join(self.addon.profile, self.filename)
+        self.legacy_path = os.path.join(
+            self.addon.profile, self.legacy_filename
+        )
         self.load()
 
-    def load(self):
+    def load(self, locked=False):
+        # Per user: query id -> query, oldest first, and query -> query id.
+        # locked tells that the caller holds the lock.
+        self.queries = {}
+        self.ids = {}
+        self.next_ids = {}
+        self.records = 0
         try:
-            with open(self.save_path, "r") as history_file:
-                self.history_json = json.load(history_file)
-                if self.username not in self.history_json:
-                    self.history_json[self.username] = []
+            with open(self.save_path, "r", encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        self.apply(json.loads(line))
+                    except (ValueError, KeyError):
+                        # A write cut short by a crash.
+                        continue
         except FileNotFoundError:
-            self.history_json = {}
-            self.history_json[self.username] = []
-            self.save()
-
-    def save(self):
-        with open(self.save_path, "w") as history_file:
-            json.dump(self.history_json, history_file, indent=4)
+            if locked:
+                self.migrate()
+            elif os.path.exists(self.legacy_path):
+                # Migrating writes the journal, so it is done under the lock,
+                # after checking that nobody else has migrated meanwhile.
+                with self.lock():
+                    self.load(locked=True)
+                return
+        self.queries.setdefault(self.username, {})
+        self.ids.setdefault(self.username, {})
+
+    def migrate(self):
+        # Older versions kept all history in one json file, newest first,
+        # and used list positions as ids. Keep those ids.
+        try:
+            with open(self.legacy_path, "r") as history_file:
+                history_json = json.load(history_file)
+        except (FileNotFoundError, ValueError):
+            return
+
+        records = []
+        for (username, queries) in history_json.items():
+            for query_id in reversed(range(len(queries))):
+                records.append({
+                    "user": username, "op": "add", "id": query_id,
+                    "query": queries[query_id]
+                })
+            records.append(
+                {"user": username, "op": "next", "id": len(queries)}
+            )
+        for record in records:
+            self.apply(record)
+        self.compact()
+        os.remove(self.legacy_path)
+
+    def apply(self, record):
+        username = record["user"]
+        queries = self.queries.setdefault(username, {})
+        ids = self.ids.setdefault(username, {})
+        if record["op"] == "add":
+            queries[record["id"]] = record["query"]
+            ids[record["query"]] = record["id"]
+            self.next_ids[username] = max(
+                self.next_ids.get(username, 0), record["id"] + 1
+            )
+        elif record["op"] == "next":
+            # Ids are never handed out twice, even once removed queries have
+            # been compacted away, since links to them may still exist.
+            self.next_ids[username] = max(
+                self.next_ids.get(username, 0), record["id"]
+            )
+        elif record["op"] == "remove":
+            query = queries.pop(record["id"], None)
+            if query is not None:
+                del ids[query]
+        elif record["op"] == "clear":
+            queries.clear()
+            ids.clear()
+        self.records += 1
+
+    def lock(self):
+        # Writers reload under the lock first, so that ids are not handed out
+        # twice and compacting does not drop what others appended.
+        return FileLock(self.save_path + ".lock")
+
+    def append(self, *records):
+        # Callers hold the lock.
+        for record in records:
+            self.apply(record)
+        with open(self.save_path, "a", encoding="utf-8") as journal:
+            journal.write("".join(
+                json.dumps(record, separators=(",", ":")) + "\n"
+                for record in records
+            ))
+
+        live = sum(len(queries) for queries in self.queries.values())
+        if self.records > live + len(self.next_ids) + self.compact_slack:
+            self.compact()
+
+    def compact(self):
+        records = [
+            {"user": username, "op": "add", "id": query_id, "query": query}
+            for (username, queries) in self.queries.items()
+            for (query_id, query) in queries.items()
+        ] + [
+            {"user": username, "op": "next", "id": next_id}
+            for (username, next_id) in self.next_ids.items()
+        ]
+        temp_path = self.save_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as journal:
+            journal.write("".join(
+                json.dumps(record, separators=(",", ":")) + "\n"
+                for record in records
+            ))
+        os.replace(temp_path, self.save_path)
+        self.records = len(records)
 
     def get(self, query_id):
-        return self.get_queries()[int(query_id)]
+        return self.queries[self.username][int(query_id)]
 
     def get_id(self, query, reload_data=False):
         if reload_data:
             self.load()
-        try:
-            return self.get_queries().index(query)
-        except ValueError:
-            return None
+        return self.ids[self.username].get(query)
 
     def get_queries(self):
-        return self.history_json[self.username]
+        return [query for (_, query) in self.items()]
+
+    def items(self):
+        # (query id, query) pairs, newest first.
+        return list(reversed(list(self.queries[self.username].items())))
 
     def add(self, query):
-        queries = self.history_json[self.username]
-        if query not in queries:
-            queries.insert(0, query)
-        self.save()
+        with self.lock():
+            self.load(locked=True)
+            if query in self.ids[self.username]:
+                return
+
+            query_id = self.next_ids.get(self.username, 0)
+            records = [
+                {"user": self.username, "op": "add", "id": query_id,
+                 "query": query}
+            ]
+            queries = self.queries[self.username]
+            for old_id in list(queries)[:max(
+                0, len(queries) + 1 - self.max_queries
+            )]:
+                records.append(
+                    {"user": self.username, "op": "remove", "id": old_id}
+                )
+            self.append(*records)
 
     def remove(self, query_id):
-        del self.history_json[self.username][int(query_id)]
-        self.save()
+        with self.lock():
+            self.load(locked=True)
+            if int(query_id) in self.queries[self.username]:
+                self.append({
+                    "user": self.username, "op": "remove", "id": int(query_id)
+                })
 
     def clear(self):
-        self.history_json[self.username] = []
-        self.save()
+        with self.lock():
+            self.load(locked=True)
+            self.append({"user": self.username, "op": "clear"})
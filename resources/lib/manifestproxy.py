@@ -0,0 +1,251 @@
+import io
+import re
+import time
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DASH_NS = "urn:mpeg:dash:schema:mpd:2011"
+# Manifests may use ISO 639-2 codes, the setting ISO 639-1 codes.
+LANGUAGE_CODES = {
+    "swe": "sv", "eng": "en", "nor": "no", "nob": "no", "nb": "no",
+    "dan": "da", "fin": "fi", "ger": "de", "deu": "de", "fre": "fr",
+    "fra": "fr", "spa": "es", "ita": "it"
+}
+DURATION = re.compile(
+    r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?)?$"
+)
+
+
+class ManifestProxyError(Exception):
+    pass
+
+
+def tag(name):
+    return "{{{0}}}{1}".format(DASH_NS, name)
+
+
+def language(code):
+    primary = (code or "").strip().lower().replace("_", "-").split("-")[0]
+    return LANGUAGE_CODES.get(primary, primary)
+
+
+def parse_duration(value):
+    match = DURATION.match(value or "")
+    if not match:
+        return None
+    (days, hours, minutes, seconds) = match.groups()
+    return int(days or 0)*86400 + int(hours or 0)*3600 + \
+        int(minutes or 0)*60 + float(seconds or 0)
+
+
+def content_type(adaptation_set):
+    first = adaptation_set.find(tag("Representation"))
+    if first is None:
+        first = adaptation_set
+    mime_type = adaptation_set.get("mimeType") or first.get("mimeType") or ""
+    codecs = adaptation_set.get("codecs") or first.get("codecs") or ""
+    if "ttml" in mime_type or codecs.startswith(("stpp", "wvtt")):
+        return "text"
+    return adaptation_set.get("contentType") or mime_type.split("/")[0]
+
+
+def height(representation, adaptation_set):
+    return int(
+        representation.get("height") or adaptation_set.get("height") or 0
+    )
+
+
+def register_namespaces(content):
+    # Keeps the prefixes of the original, ElementTree would use ns0 etc.
+    for (_, (prefix, uri)) in ET.iterparse(
+        io.BytesIO(content), events=("start-ns",)
+    ):
+        try:
+            ET.register_namespace(prefix, uri)
+        except ValueError:
+            pass
+
+
+def lifetime(root):
+    # Seconds a manifest stays current, None for static manifests.
+    if root.get("type") != "dynamic":
+        return None
+    return parse_duration(root.get("minimumUpdatePeriod")) or 0
+
+
+def trim_manifest(content, url, max_height=0, languages=()):
+    # Drops the video representations above max_height and the audio and
+    # subtitle adaptation sets in other languages. Segment URLs are made
+    # absolute, since the manifest is no longer served from its origin.
+    register_namespaces(content)
+    root = ET.fromstring(content)
+    wanted = set(language(code) for code in languages if code.strip())
+
+    for period in root.findall(tag("Period")):
+        adaptation_sets = period.findall(tag("AdaptationSet"))
+        for kind in ("audio", "text"):
+            of_kind = [
+                adaptation_set for adaptation_set in adaptation_sets
+                if content_type(adaptation_set) == kind
+            ]
+            # Rather keep everything than leave a stream without audio.
+            if not wanted or not any(
+                language(adaptation_set.get("lang")) in wanted
+                for adaptation_set in of_kind
+            ):
+                continue
+            for adaptation_set in of_kind:
+                if adaptation_set.get("lang") and \
+                        language(adaptation_set.get("lang")) not in wanted:
+                    period.remove(adaptation_set)
+
+        if not max_height:
+            continue
+        for adaptation_set in adaptation_sets:
+            if content_type(adaptation_set) != "video":
+                continue
+            representations = adaptation_set.findall(tag("Representation"))
+            too_high = [
+                representation for representation in representations
+                if height(representation, adaptation_set) > max_height
+            ]
+            if len(too_high) == len(representations):
+                too_high.remove(min(
+                    representations, key=lambda representation: height(
+                        representation, adaptation_set
+                    )
+                ))
+            for representation in too_high:
+                adaptation_set.remove(representation)
+
+    base_urls = root.findall(tag("BaseURL"))
+    for base_url in base_urls:
+        base_url.text = urllib.parse.urljoin(
+            url, (base_url.text or "").strip()
+        )
+    if not base_urls:
+        base_url = ET.Element(tag("BaseURL"))
+        base_url.text = urllib.parse.urljoin(url, ".")
+        # BaseURL has to follow the ProgramInformation elements.
+        root.insert(len(root.findall(tag("ProgramInformation"))), base_url)
+
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+class ManifestProxyHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(
+            urllib.parse.urlsplit(self.path).query
+        ))
+        if "url" not in params:
+            self.send_error(400)
+            return
+
+        try:
+            content = self.server.manifest(
+                params["url"], int(params.get("maxHeight") or 0),
+                tuple(
+                    code.strip()
+                    for code in params.get("languages", "").split(",")
+                    if code.strip()
+                )
+            )
+        except ManifestProxyError as e:
+            self.send_error(403, str(e))
+            return
+        except ET.ParseError:
+            # Let inputstream.adaptive deal with it unmodified.
+            self.send_response(302)
+            self.send_header("Location", params["url"])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        except Exception as e:
+            self.send_error(502, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/dash+xml")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ManifestProxyServer(ThreadingHTTPServer):
+    # Serves trimmed copies of the manifests of issued streaming tickets.
+    # expiry(url) returns when the ticket of a manifest expires, None for
+    # unknown manifests, so that this is never an open proxy.
+    daemon_threads = True
+
+    def __init__(self, web_utils, expiry):
+        super().__init__(("127.0.0.1", 0), ManifestProxyHandler)
+        self.web_utils = web_utils
+        self.expiry = expiry
+        # key: (expires, content)
+        self.manifests = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def cached(self, key):
+        with self.lock:
+            (expires, content) = self.manifests.get(key, (0, None))
+        return content if expires > time.time() else None
+
+    def store(self, key, content, expires):
+        now = time.time()
+        with self.lock:
+            for (old_key, (old_expires, _)) in list(self.manifests.items()):
+                if old_expires <= now:
+                    del self.manifests[old_key]
+            if expires > now:
+                self.manifests[key] = (expires, content)
+
+    def expires(self, url, content):
+        # Static manifests are kept for the lifetime of the ticket, live
+        # manifests until they have to be refreshed.
+        expires = self.expiry(url)
+        if expires is None:
+            raise ManifestProxyError("Unknown manifest")
+        seconds = lifetime(ET.fromstring(content))
+        return expires if seconds is None else \
+            min(expires, time.time() + seconds)
+
+    def original(self, url):
+        from resources.lib.api import fetch_manifest
+
+        if self.expiry(url) is None:
+            raise ManifestProxyError("Unknown manifest")
+        content = self.cached((url,))
+        if content is None:
+            content = fetch_manifest(self.web_utils, url).encode("utf-8")
+            self.store((url,), content, self.expires(url, content))
+        return content
+
+    def manifest(self, url, max_height, languages):
+        key = (url, max_height, languages)
+        content = self.cached(key)
+        if content is None:
+            original = self.original(url)
+            content = trim_manifest(original, url, max_height, languages)
+            self.store(key, content, self.expires(url, original))
+        return content
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
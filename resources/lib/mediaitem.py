@@ -0,0 +1,184 @@
+import urllib.parse
+from resources.lib.timeutils import TimezoneStamps
+
+
+class MediaItem():
+    __slots__ = (
+        "id", "media_id", "title", "episode", "icon", "fanart", "genre",
+        "description", "imdb", "rating", "duration", "price",
+        "available_from"
+    )
+
+    @property
+    def is_series(self):
+        return self.media_id.startswith("s")
+
+    @property
+    def is_movie(self):
+        return self.media_id.startswith("m")
+
+
+def lookup(data, keys):
+    # Follows a path of keys, a missing node or one that is not an object
+    # anywhere along it gives None.
+    for key in keys:
+        try:
+            data = data.get(key)
+        except AttributeError:
+            return None
+        if data is None:
+            return None
+    return data
+
+
+def imdb_id(url):
+    return url.split("/")[-1]
+
+
+def duration_seconds(duration_str):
+    try:
+        return TimezoneStamps.convert_to_seconds(duration_str)
+    except (ValueError, IndexError):
+        return 0
+
+
+class MediaSchema():
+    defaults = {
+        "id": None,
+        "media_id": "",
+        "title": "",
+        "episode": "",
+        "icon": None,
+        "fanart": None,
+        "genre": "",
+        "description": "",
+        "imdb": "",
+        "rating": "",
+        "duration": 0,
+        "price": None,
+        "available_from": None
+    }
+    converters = {
+        "icon": urllib.parse.unquote,
+        "fanart": urllib.parse.unquote,
+        "imdb": imdb_id,
+        "duration": duration_seconds
+    }
+
+    def __init__(self, root=None, **fields):
+        # Paths are split into their keys once, normalizing an item only
+        # walks them.
+        self.root = tuple(root.split(".")) if root else ()
+        # (name, paths, converter, default), alternative paths are tried in
+        # order and the first non-empty value wins.
+        self.fields = []
+        self.constants = []
+        for (name, default) in self.defaults.items():
+            if name not in fields:
+                self.constants.append((name, default))
+                continue
+            paths = fields[name]
+            if isinstance(paths, str):
+                paths = (paths,)
+            self.fields.append((
+                name, tuple(tuple(path.split(".")) for path in paths),
+                self.converters.get(name), default
+            ))
+
+    def normalize(self, data):
+        if self.root:
+            data = lookup(data, self.root) or {}
+        item = MediaItem()
+        for (name, default) in self.constants:
+            setattr(item, name, default)
+        for (name, paths, converter, default) in self.fields:
+            for keys in paths:
+                value = lookup(data, keys)
+                if value:
+                    break
+            if not value:
+                value = default
+            elif converter:
+                value = converter(value)
+            setattr(item, name, value)
+        return item
+
+    def normalize_all(self, items):
+        for data in items or ():
+            yield self.normalize(data)
+
+
+POSTER = MediaSchema(
+    id="id",
+    media_id="analytics.content_media_id",
+    title="details.overlay.placeholder",
+    icon="image.source",
+    fanart="images.showcard16x9.source",
+    genre="genre",
+    description=("description", "descriptionLong"),
+    imdb="ratings.imdb.url",
+    rating="ratings.imdb.readableScore",
+    duration="duration.readableShort",
+    price="price.readable"
+)
+
+STORE_MEDIA = MediaSchema(
+    root="media",
+    id="id",
+    media_id="id",
+    title="title",
+    icon="images.showcard2x3.source",
+    fanart="images.showcard16x9.source",
+    genre="genre",
+    description="descriptionLong",
+    imdb="ratings.imdb.url",
+    rating="ratings.imdb.readableScore",
+    duration="duration.readableShort",
+    price="price.readable"
+)
+
+EPISODE = MediaSchema(
+    id="analytics.content_media_id",
+    media_id="analytics.content_media_id",
+    title="details.aside.header",
+    episode="episodeNumber.readable",
+    icon="image.source",
+    fanart="images.showcard16x9.source",
+    description="descriptionLong",
+    duration="duration.readableShort",
+    price="price.readable",
+    available_from="availableFrom.timestamp"
+)
+
+SUGGESTED_EPISODE = MediaSchema(
+    id="id",
+    media_id="id",
+    title="episodeNumber.readable",
+    genre="genre",
+    description="descriptionLong",
+    duration="duration.readableShort",
+    price="price.readable"
+)
+
+SERIES = MediaSchema(
+    id="id",
+    icon="images.showcard2x3.source",
+    fanart="images.backdrop16x9.source"
+)
+
+# Items of page panels all share the poster layout, store panels wrap
+# theirs in a media object.
+PAGE_PANEL_SCHEMAS = {
+    "SelectionMediaPanel": POSTER,
+    "PosterListPanel": POSTER,
+    "ContinueWatchingPanel": POSTER,
+    "MyListPanel": POSTER,
+    "TimelinePanel": POSTER,
+    "RentalsPanel": POSTER,
+    "ShowcasePanel": POSTER
+}
+
+STORE_PANEL_SCHEMAS = {
+    "SelectionMediaPanel": STORE_MEDIA,
+    "MediaPanel": STORE_MEDIA
+}
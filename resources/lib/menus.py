@@ -1,20 +1,24 @@
 import os
+import json
+import time
 import functools
-import datetime
-import uuid
+import contextlib
 import urllib.parse
-import dateutil.parser
-import pytz
-import inputstreamhelper
+from concurrent.futures import ThreadPoolExecutor, wait
 import xbmc
 from xbmcgui import ListItem, Dialog
 from xbmcplugin import addDirectoryItems, addSortMethod, \
         endOfDirectory, setResolvedUrl, SORT_METHOD_TITLE, \
         SORT_METHOD_UNSORTED, SORT_METHOD_DATEADDED
 from resources.lib.api import TeliaPlay, TeliaException
-from resources.lib.kodiutils import AddonUtils, UserDataHandler, \
-    SearchHistory
-from resources.lib.timeutils import TimezoneStamps
+from resources.lib.epg import EpgStore, EpgSync, channel_record, \
+    program_record
+from resources.lib.kodiutils import AddonUtils, SearchHistory, \
+    InputstreamCheck, set_video_info
+from resources.lib.mediaitem import POSTER, EPISODE, SUGGESTED_EPISODE, \
+    SERIES, STORE_MEDIA, PAGE_PANEL_SCHEMAS, STORE_PANEL_SCHEMAS
+from resources.lib.timeutils import TimezoneStamps, timezone_stamps
+from resources.lib.tracing import tracer, summarize
 
 
 def logging(method):
@@ -31,54 +35,118 @@ def logging(method):
             ]
             arguments = ", ".join(args_repr + kwargs_repr)
             addon.log("Calling {0}({1})".format(method.__name__, arguments))
-        retval = method(*args, **kwargs)
+        with tracer.span("menu", method.__name__):
+            retval = method(*args, **kwargs)
         if debug:
             addon.log("Call returned successfully")
         return retval
     return wrapped_method_call
 
 
+def stale_while_revalidate(method):
+
+    @functools.wraps(method)
+    def wrapped_method_call(self, *args, **kwargs):
+        if not self.addon.get_setting_as_bool("staleWhileRevalidate"):
+            return method(self, *args, **kwargs)
+
+        self.telia_play.max_stale = self.addon.get_setting_as_int(
+            "maxStaleHours"
+        )*3600
+        try:
+            retval = method(self, *args, **kwargs)
+        finally:
+            self.telia_play.max_stale = 0
+        if self.telia_play.finish_revalidations():
+            self.refresh_if_current()
+        return retval
+    return wrapped_method_call
+
+
 class MenuList():
+    # Seconds a search waits for search2 before showing indexed titles only.
+    search_wait = 0.3
+    search_page_size = 50
+    search_results_max_age = 5*60
 
     def __init__(self):
         self.addon = AddonUtils()
-        self.userdata_handler = UserDataHandler()
 
-        username = self.addon.get_setting(
+        self.username = self.addon.get_setting(
             "user" + self.addon.get_setting("defaultUser")
         )
 
-        password = self.addon.get_setting(
+        self.password = self.addon.get_setting(
             "pass" + self.addon.get_setting("defaultUser")
         )
 
-        self.search_history = SearchHistory(username)
-        userdata = self.userdata_handler.get(username)
-
-        if not userdata:
-            userdata = self.telia_login(username, password)
-            self.userdata_handler.add(username, userdata)
-            userdata = self.userdata_handler.get(username)
+        self.search_history = SearchHistory(self.username)
+        self.default_icon = os.path.join(self.addon.media, "telia_logo.png")
+        self.listitem_ms = 0
+        # Media items shown in this directory, for the local search index.
+        self.indexed_items = [] \
+            if self.addon.get_setting_as_bool("searchIndex") else None
+        self._telia_play = None
+        self._epg_store = None
+        self._search_index = None
+        self._tickets = None
+
+    @property
+    def telia_play(self):
+        # Logging in pulls in the network stack, so only do it for routes
+        # that actually talk to Telia Play.
+        if self._telia_play is None:
+            self._telia_play = self._create_telia_play()
+        return self._telia_play
+
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            from resources.lib.searchindex import SearchIndex
+            self._search_index = SearchIndex(self.addon.profile, self.username)
+        return self._search_index
+
+    @property
+    def tickets(self):
+        if self._tickets is None:
+            from resources.lib.tickets import TicketRegistry
+            self._tickets = TicketRegistry(self.addon.profile)
+        return self._tickets
+
+    def _create_telia_play(self):
+        from resources.lib.cache import ResponseCache, ValidatorStore
+        from resources.lib.tokens import TokenRefresher
+        from resources.lib.webutils import WebUtils
+
+        cache_size = self.addon.get_setting_as_int("cacheSize")*1024*1024
+        if self.addon.get_setting_as_bool("cache"):
+            cache = ResponseCache(self.addon.profile, cache_size)
+            validator_store = ValidatorStore(self.addon.profile, cache_size)
+        else:
+            cache = None
+            validator_store = None
 
-        self.telia_play = TeliaPlay(userdata)
+        session_port = self.addon.get_property("sessionPort")
+        self.web_utils = WebUtils(
+            int(session_port) if session_port else None, validator_store,
+            self.addon.get_setting("apiBaseUrl") or None
+        )
 
-        token_valid_time = dateutil.parser.isoparse(
-            userdata["tokenData"]["validTo"]
-        ) - datetime.timedelta(minutes=30)
+        # The service keeps tokens fresh in the background, so this normally
+        # just reads a valid token from the profile.
+        token_refresher = TokenRefresher(self.web_utils)
+        userdata = token_refresher.get_userdata(self.username, self.password)
+        self.web_utils.validator_scope = userdata["deviceUUID"]
 
-        time_now = datetime.datetime.now(pytz.timezone("Europe/Stockholm"))
-        if time_now >= token_valid_time:
-            try:
-                token_data = self.telia_play.refresh_token()
-                userdata["tokenData"] = token_data
-            except TeliaException as te:
-                if  "refresh token not found" in str(te).lower():
-                    userdata = self.telia_play.login(username, password)
-                    import json
-                    Dialog().textviewer("DEBUG", json.dumps(userdata, indent=4))
-                else:
-                    raise te
-            self.userdata_handler.add(username, userdata)
+        telia_play = TeliaPlay(userdata, cache, self.web_utils)
+        telia_play.state_store = token_refresher.userdata_store
+        telia_play.panel_chunk_size = self.addon.get_setting_as_int(
+            "panelChunkSize"
+        )
+        telia_play.panel_workers = self.addon.get_setting_as_int(
+            "panelWorkers"
+        )
+        return telia_play
 
     def _add_folder_item(
         self, items, label, url, icon=None, fanart=None, sort_title="",
@@ -86,76 +154,136 @@ class MenuList():
         is_playable=False, context_menu_items=None, offscreen=True,
         imdb="", rating="", title=""
     ):
-
-        if not fanart:
-            fanart = os.path.join(self.addon.resources, "fanart.jpg")
-
-        if not icon:
-            icon = os.path.join(self.addon.media, "telia_logo.png")
+        if tracer.enabled:
+            start = time.perf_counter()
 
         list_item = ListItem(label=label, offscreen=offscreen)
-        list_item.setArt({"thumb": icon, "fanart": fanart})
-        if title:
-            list_item.setInfo("video", {
-                "title": title, "sorttitle": sort_title
-            })
-        else:
-            list_item.setInfo("video", {
-                "title": label, "sorttitle": sort_title
-            })
+
+        # Items without fanart inherit the add-on fanart from Kodi.
+        art = {"thumb": icon or self.default_icon}
+        if fanart:
+            art["fanart"] = fanart
+        list_item.setArt(art)
 
         if is_playable:
             list_item.setProperty("IsPlayable", "true")
-        else:
-            list_item.setProperty("IsPlayable", "false")
 
+        video_info = {"title": title or label}
+        if sort_title:
+            video_info["sorttitle"] = sort_title
         if datetime_str:
-            list_item.setInfo("video", {"dateadded": datetime_str})
-
+            video_info["dateadded"] = datetime_str
         if duration:
-            list_item.setInfo("video", {"duration": duration})
-
+            video_info["duration"] = duration
         if info:
-            list_item.setInfo("video", {"plot": info})
-
+            video_info["plot"] = info
         if imdb:
-            list_item.setInfo("video", {"imdbnumber": imdb})
-
+            video_info["imdbnumber"] = imdb
         if rating:
-            list_item.setInfo("video", {"rating": rating})
-
+            video_info["rating"] = rating
         if genre:
-            list_item.setInfo("video", {"genre": genre})
+            video_info["genre"] = genre
+        set_video_info(list_item, video_info)
 
         if context_menu_items:
             list_item.addContextMenuItems(context_menu_items)
 
         items.append((url, list_item, is_folder))
+        if tracer.enabled:
+            self.listitem_ms += (time.perf_counter() - start)*1000
+
+    def _add_media_item(
+        self, items, media_item, in_my_list=False, searchable=True
+    ):
+        if media_item.is_series:
+            plugin_url = self.addon.plugin_url({
+                "menu": "series",
+                "seriesId": media_item.media_id
+            })
+            is_folder = True
+            is_playable = False
+        elif media_item.is_movie:
+            plugin_url = self.addon.plugin_url({
+                "menu": "play",
+                "streamType": "rental" if media_item.price else "vod",
+                "streamId": media_item.media_id
+            })
+            is_folder = False
+            is_playable = True
+        else:
+            return
+
+        if searchable and self.indexed_items is not None:
+            self.indexed_items.append(media_item)
+
+        context_url_add = self.addon.plugin_url({
+            "menu": "removeFromList" if in_my_list else "addToList",
+            "mediaId": media_item.id,
+        })
+        context_menu = [
+            (self.addon.localize(30103 if in_my_list else 30020),
+             "RunPlugin({0})".format(context_url_add))
+        ]
+
+        label = media_item.title
+        if media_item.price:
+            label = "{0} [COLOR red]({1})[/COLOR]".format(
+                media_item.title, media_item.price
+            )
+            context_url_rent = self.addon.plugin_url({
+                "menu": "rent",
+                "videoId": media_item.id
+            })
+            context_url_trailer = self.addon.plugin_url({
+                "menu": "play",
+                "streamType": "trailer",
+                "streamId": media_item.id
+            })
+            context_menu.append(
+                (self.addon.localize(30019),
+                 "PlayMedia({0})".format(context_url_trailer))
+            )
+            context_menu.append(
+                (self.addon.localize(30015),
+                 "RunPlugin({0})".format(context_url_rent))
+            )
+
+        self._add_folder_item(
+            items, label, plugin_url, media_item.icon, media_item.fanart,
+            info=media_item.description, genre=media_item.genre,
+            is_playable=is_playable, is_folder=is_folder,
+            imdb=media_item.imdb, rating=media_item.rating,
+            duration=media_item.duration, context_menu_items=context_menu,
+            title=media_item.title
+        )
 
     def _end_folder(self, items, sort_methods=()):
-        addDirectoryItems(self.addon.handle, items, totalItems=len(items))
+        with tracer.span("directory", "end", count=len(items)):
+            addDirectoryItems(self.addon.handle, items, totalItems=len(items))
 
-        for sort_method in sort_methods:
-            addSortMethod(self.addon.handle, sort_method)
+            for sort_method in sort_methods:
+                addSortMethod(self.addon.handle, sort_method)
 
-        endOfDirectory(self.addon.handle)
+            endOfDirectory(self.addon.handle)
+        tracer.event(
+            "listitems", "build", ms=self.listitem_ms, count=len(items)
+        )
+        self.listitem_ms = 0
+        self._index_items()
 
-    @logging
-    def telia_login(self, username, password):
-        boot_uuid = str(uuid.uuid4())
-        device_uuid = "WEB-" + boot_uuid
-        userdata = {
-            "bootUUID": boot_uuid,
-            "deviceUUID": device_uuid,
-            "tokenData": None
-        }
-        telia_play = TeliaPlay(userdata)
-        token_data = telia_play.login(username, password)
-        telia_play.validate_login()
-        userdata["tokenData"] = token_data
-        return userdata
+    def _index_items(self):
+        # Runs after the directory has been handed to Kodi.
+        if not self.indexed_items:
+            return
+        try:
+            with tracer.span("index", "add", count=len(self.indexed_items)):
+                self.search_index.add(self.indexed_items)
+        except Exception as e:
+            self.addon.log("Indexing failed: {0}".format(e))
+        self.indexed_items = []
 
     @logging
+    @stale_while_revalidate
     def main_menu(self):
         menu_items = self.telia_play.get_main_menu()
 
@@ -171,6 +299,51 @@ class MenuList():
             "menu": "searchmenu",
         })
         self._add_folder_item(items, self.addon.localize(30016), plugin_url)
+
+        if tracer.enabled:
+            plugin_url = self.addon.plugin_url({
+                "menu": "diagnostics",
+            })
+            self._add_folder_item(items, self.addon.localize(30107), plugin_url)
+        self._end_folder(items)
+
+    @logging
+    def diagnostics_menu(self):
+        summary = summarize(tracer.records())
+
+        items = []
+        if not summary["routes"]:
+            self._add_folder_item(
+                items, self.addon.localize(30112), "", is_folder=False
+            )
+
+        for route in summary["routes"]:
+            self._add_folder_item(items, self.addon.localize(30109).format(
+                route["name"], route["p50"], route["p95"], route["count"]
+            ), "", is_folder=False)
+
+        total_ms = summary["total_ms"] or 1
+        for (layer, totals) in sorted(
+            summary["layers"].items(), key=lambda item: item[1]["ms"],
+            reverse=True
+        ):
+            self._add_folder_item(items, self.addon.localize(30110).format(
+                layer, totals["ms"], totals["count"],
+                totals["ms"]*100/total_ms
+            ), "", is_folder=False)
+
+        for request in summary["slowest"]:
+            self._add_folder_item(items, self.addon.localize(30111).format(
+                request["name"], request.get("host", ""), request["ms"],
+                request.get("bytes", "?"), request.get("status", "?")
+            ), "", is_folder=False)
+
+        plugin_url = self.addon.plugin_url({
+            "menu": "cleartraces",
+        })
+        self._add_folder_item(
+            items, self.addon.localize(30108), plugin_url, is_folder=False
+        )
         self._end_folder(items)
 
     @logging
@@ -198,7 +371,7 @@ class MenuList():
     @logging
     def show_search_history(self):
         items = []
-        for (query_id, query) in enumerate(self.search_history.get_queries()):
+        for (query_id, query) in self.search_history.items():
             url = "{0}?menu={1}&panelId={2}&page=0".format(
                 self.addon.url, "search", query_id
             )
@@ -226,7 +399,21 @@ class MenuList():
     def refresh(self):
         xbmc.executebuiltin("Container.Refresh")
 
+    def refresh_if_current(self):
+        # The user may have moved on while fresh data was being fetched.
+        if xbmc.getInfoLabel("Container.FolderPath") == \
+                self.addon.url + self.addon.query:
+            self.refresh()
+
+    def update_if_current(self, url):
+        # Unlike a refresh this also leaves routes that must not run twice,
+        # such as a new search asking for its query.
+        if xbmc.getInfoLabel("Container.FolderPath") == \
+                self.addon.url + self.addon.query:
+            xbmc.executebuiltin("Container.Update({0},replace)".format(url))
+
     @logging
+    @stale_while_revalidate
     def page_menu(self, page_id):
         menu_items = self.telia_play.get_page(page_id)
 
@@ -238,6 +425,46 @@ class MenuList():
             if item["title"] != "":
                 self._add_folder_item(items, item["title"], plugin_url)
         self._end_folder(items)
+        self._prefetch_panels(menu_items)
+
+    def _prefetch_panels(self, panels):
+        # The directory has already been handed to Kodi, so warm the cache
+        # with the first page behind every "Show more" entry while the user
+        # is looking at it.
+        if not self.telia_play.cache or \
+                not self.addon.get_setting_as_bool("prefetch"):
+            return
+
+        panel_ids = []
+        for panel in panels:
+            for content in panel.values():
+                if isinstance(content, dict) and content.get("pageInfo") \
+                        and content["pageInfo"]["hasNextPage"]:
+                    panel_ids.append(panel["id"])
+                    break
+
+        results_per_page = self.addon.get_setting_as_int("moviesPerPage")
+        max_workers = self.addon.get_setting_as_int("prefetchWorkers")
+        # Nothing shown is backed by these pages, so stale ones are fetched
+        # again rather than revalidated, which would refresh the listing.
+        max_stale = self.telia_play.max_stale
+        self.telia_play.max_stale = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        self.telia_play.get_panel, panel_id,
+                        results_per_page, 0
+                    )
+                    for panel_id in panel_ids
+                ]
+                for future in futures:
+                    if future.exception():
+                        self.addon.log("Prefetch failed: {0}".format(
+                            future.exception()
+                        ))
+        finally:
+            self.telia_play.max_stale = max_stale
 
     @logging
     def page_submenu(self, page_id, menu_id):
@@ -261,6 +488,7 @@ class MenuList():
                     menu = submenu["showcaseContent"]
                 elif submenu["__typename"] == "SingleFeaturePanelX":
                     self.play_stream(submenu["id"], "vod")
+                    return
                 elif submenu["__typename"] == "StoresPanel":
                     menu = submenu["storesContent"]
                     self.play_stores_menu(menu["items"])
@@ -269,122 +497,11 @@ class MenuList():
         else:
             return
 
-        menu_items = menu["items"]
-        if not menu_items:
-            menu_items = []
-
+        schema = PAGE_PANEL_SCHEMAS.get(submenu["__typename"], POSTER)
         items = []
-        for item in menu_items:
-
-            try:
-                icon = urllib.parse.unquote(
-                    item["image"]["source"]
-                )
-            except Exception:
-                icon = None
-
-            try:
-                fanart = urllib.parse.unquote(
-                    item["images"]["showcard16x9"]["source"]
-                )
-            except Exception:
-                fanart = None
-
-            try:
-                genre = item["genre"]
-            except Exception:
-                genre = ""
-
-            try:
-                desc = item["description"]
-            except Exception:
-                desc = ""
-
-            if not desc:
-                try:
-                    desc = item["descriptionLong"]
-                except Exception:
-                    desc = ""
-
-            try:
-                imdb_url = item["ratings"]["imdb"]["url"]
-                imdb = imdb_url.split("/")[-1]
-            except Exception:
-                imdb = ""
-
-            try:
-                rating = item["ratings"]["imdb"]["readableScore"]
-            except Exception:
-                rating = ""
-
-            try:
-                duration = item["duration"]["readableShort"]
-                duration = TimezoneStamps(
-                    "Europe/Stockholm"
-                ).convert_to_seconds(duration)
-            except Exception:
-                duration = 0
-
-            context_url_add = self.addon.plugin_url({
-                "menu": "addToList" if menu_id != "Min lista"
-                else "removeFromList",
-                "mediaId": item["id"],
-            })
-            context_menu = [
-                (self.addon.localize(
-                    30103 if menu_id == "Min lista" else 30020
-                ),
-                 "RunPlugin({0})".format(context_url_add))
-            ]
-
-            try:
-                title = item["details"]["overlay"]["placeholder"]
-                label = "{0} [COLOR red]({1})[/COLOR]".format(
-                    title, item["price"]["readable"]
-                )
-                context_url_rent = self.addon.plugin_url({
-                    "menu": "rent",
-                    "videoId": item["id"]
-                })
-                context_url_trailer = self.addon.plugin_url({
-                    "menu": "play",
-                    "streamType": "trailer",
-                    "streamId": media["id"]
-                })
-                context_menu.append(
-                    (self.addon.localize(30019),
-                     "PlayMedia({0})".format(context_url_trailer))
-                )
-                context_menu.append(
-                    (self.addon.localize(30015),
-                     "RunPlugin({0})".format(context_url_rent))
-                )
-                is_rental = True
-            except Exception:
-                label = title = item["details"]["overlay"]["placeholder"]
-                is_rental = False
-
-            if item["analytics"]["content_media_id"].startswith("s"):
-                plugin_url = self.addon.plugin_url({
-                    "menu": "series",
-                    "seriesId": item["analytics"]["content_media_id"]
-                })
-                is_folder = True
-                is_playable = False
-            elif item["analytics"]["content_media_id"].startswith("m"):
-                plugin_url = self.addon.plugin_url({
-                    "menu": "play",
-                    "streamType": "rental" if is_rental else "vod",
-                    "streamId": item["analytics"]["content_media_id"]
-                })
-                is_folder = False
-                is_playable = True
-
-            self._add_folder_item(
-                items, label, plugin_url, icon, fanart, genre=genre,
-                is_playable=is_playable, is_folder=is_folder, info=desc,
-                imdb=imdb, duration=duration, context_menu_items=context_menu,
-                rating=rating, title=title
+        for media_item in schema.normalize_all(menu["items"]):
+            self._add_media_item(
+                items, media_item, in_my_list=menu_id == "Min lista"
             )
 
         if "pageInfo" in menu and menu["pageInfo"]["hasNextPage"]:
@@ -401,6 +518,7 @@ class MenuList():
         self._end_folder(items)
 
     @logging
+    @stale_while_revalidate
     def play_stores_menu(self, channels=None):
 
         def add_channel(items, channel):
@@ -435,6 +553,7 @@ class MenuList():
         self._end_folder(items, (SORT_METHOD_UNSORTED, SORT_METHOD_TITLE))
 
     @logging
+    @stale_while_revalidate
     def play_store_menu(self, store_id):
         store_panels = self.telia_play.get_store(store_id)
 
@@ -468,6 +587,7 @@ class MenuList():
 
         for panel in store_panels["items"]:
             if panel_id == panel["id"]:
+                schema = STORE_PANEL_SCHEMAS.get(panel["__typename"], STORE_MEDIA)
                 if panel["__typename"] == "SelectionMediaPanel":
                     panel = panel["selectionMediaContent"]
                 elif panel["__typename"] == "MediaPanel":
@@ -477,108 +597,8 @@ class MenuList():
             return
 
         items = []
-        for item in panel["items"]:
-            media = item["media"]
-            try:
-                icon = urllib.parse.unquote(
-                    media["images"]["showcard2x3"]["source"]
-                )
-            except Exception:
-                icon = None
-
-            try:
-                fanart = urllib.parse.unquote(
-                    media["images"]["showcard16x9"]["source"]
-                )
-            except Exception:
-                fanart = None
-
-            try:
-                description = media["descriptionLong"]
-            except Exception:
-                description = ""
-
-            try:
-                genre = media["genre"]
-            except Exception:
-                genre = ""
-
-            try:
-                imdb_url = media["ratings"]["imdb"]["url"]
-                imdb = imdb_url.split("/")[-1]
-            except Exception:
-                imdb = ""
-
-            try:
-                rating = media["ratings"]["imdb"]["readableScore"]
-            except Exception:
-                rating = ""
-
-            try:
-                duration = media["duration"]["readableShort"]
-                duration = TimezoneStamps(
-                    "Europe/Stockholm"
-                ).convert_to_seconds(duration)
-            except Exception:
-                duration = 0
-
-            context_url_add = self.addon.plugin_url({
-                "menu": "addToList",
-                "mediaId": media["id"],
-            })
-            context_menu = [
-                (self.addon.localize(30020),
-                 "RunPlugin({0})".format(context_url_add))
-            ]
-            try:
-                title = media["title"]
-                label = "{0} [COLOR red]({1})[/COLOR]".format(
-                    title, media["price"]["readable"]
-                )
-                context_url_rent = self.addon.plugin_url({
-                    "menu": "rent",
-                    "videoId": media["id"]
-                })
-                context_url_trailer = self.addon.plugin_url({
-                    "menu": "play",
-                    "streamType": "trailer",
-                    "streamId": media["id"]
-                })
-                context_menu.append(
-                    (self.addon.localize(30019),
-                     "PlayMedia({0})".format(context_url_trailer))
-                )
-                context_menu.append(
-                    (self.addon.localize(30015),
-                     "RunPlugin({0})".format(context_url_rent))
-                )
-                is_rental = True
-            except Exception:
-                label = media["title"]
-                is_rental = False
-
-            if media["id"].startswith("s"):
-                plugin_url = self.addon.plugin_url({
-                    "menu": "series",
-                    "seriesId": media["id"]
-                })
-                is_folder = True
-                is_playable = False
-            elif media["id"].startswith("m"):
-                plugin_url = self.addon.plugin_url({
-                    "menu": "play",
-                    "streamType": "rental" if is_rental else "vod",
-                    "streamId": media["id"]
-                })
-                is_folder = False
-                is_playable = True
-
-            self._add_folder_item(
-                items, label, plugin_url, icon, fanart,
-                info=description, genre=genre, is_playable=is_playable,
-                is_folder=is_folder, imdb=imdb, duration=duration,
-                context_menu_items=context_menu, rating=rating, title=title
-            )
+        for media_item in schema.normalize_all(panel["items"]):
+            self._add_media_item(items, media_item)
 
         if "pageInfo" in panel and panel["pageInfo"]["hasNextPage"]:
             plugin_url = self.addon.plugin_url({
@@ -595,159 +615,170 @@ class MenuList():
 
     @logging
     def panel_menu(self, panel_id, page, search=False):
+        if search and page == 0 and self.indexed_items is not None:
+            self._indexed_search_menu(panel_id)
+            return
+
         results_per_page = self.addon.get_setting_as_int("moviesPerPage")
         offset = page*results_per_page
+        stream = self.addon.get_setting_as_bool("streamResponses")
 
         if not search:
             panel = self.telia_play.get_panel(
-                panel_id, results_per_page, offset
+                panel_id, results_per_page, offset, stream
             )
         else:
             # Reuse panel menu for search menu; no need to reinvent the wheel.
             query = self.search_history.get(panel_id)
             # Searching won't work if the number of results per page is too large.
-            results_per_page = 50
+            results_per_page = self.search_page_size
             offset = page*results_per_page
-            panel = self.telia_play.search(query, results_per_page, offset)
+            panel = self.telia_play.search(
+                query, results_per_page, offset, stream
+            )
 
         items = []
-        try:
-            if not search:
-                panel_items = panel["items"]
-            else:
-                panel_items = panel["posters"]
-        except KeyError:
-            panel_items = []
-
-        for item in panel_items:
-
-            try:
-                icon = urllib.parse.unquote(
-                    item["image"]["source"]
-                )
-            except Exception:
-                icon = None
-
-            try:
-                fanart = urllib.parse.unquote(
-                    item["images"]["showcard16x9"]["source"]
-                )
-            except Exception:
-                fanart = None
-
-            try:
-                genre = item["genre"]
-            except Exception:
-                genre = ""
-
-            try:
-                description = item["description"]
-            except Exception:
-                description = ""
-
-            if not description:
-                try:
-                    description = item["descriptionLong"]
-                except Exception:
-                    description = ""
-
+        if stream:
+            panel_items = panel
+        else:
             try:
-                imdb_url = item["ratings"]["imdb"]["url"]
-                imdb = imdb_url.split("/")[-1]
-            except Exception:
-                imdb = ""
+                if not search:
+                    panel_items = panel["items"]
+                else:
+                    panel_items = panel["posters"]
+            except KeyError:
+                panel_items = []
 
-            try:
-                rating = item["ratings"]["imdb"]["readableScore"]
-            except Exception:
-                rating = ""
+        for media_item in POSTER.normalize_all(panel_items):
+            self._add_media_item(items, media_item)
 
-            try:
-                duration = item["duration"]["readableShort"]
-                duration = TimezoneStamps(
-                    "Europe/Stockholm"
-                ).convert_to_seconds(duration)
-            except Exception:
-                duration = 0
+        if stream:
+            # The rest of the panel is known once all items have been read.
+            panel = panel_items.container or {}
 
-            context_url_add = self.addon.plugin_url({
-                "menu": "addToList",
-                "mediaId": item["id"],
+        if "pageInfo" in panel and panel["pageInfo"]["hasNextPage"]:
+            plugin_url = self.addon.plugin_url({
+                "menu": "search" if search else "panel",
+                "panelId": panel_id,
+                "page": page+1
             })
-            context_menu = [
-                (self.addon.localize(30020),
-                 "RunPlugin({0})".format(context_url_add))
-            ]                
 
-            try:
-                title = item["details"]["overlay"]["placeholder"]
-                label = "{0} [COLOR red]({1})[/COLOR]".format(
-                    title, item["price"]["readable"]
-                )
-                context_url_rent = self.addon.plugin_url({
-                    "menu": "rent",
-                    "videoId": item["id"]
-                })
-                context_url_trailer = self.addon.plugin_url({
-                    "menu": "play",
-                    "streamType": "trailer",
-                    "streamId": media["id"]
-                })
-                context_menu.append(
-                    (self.addon.localize(30019),
-                     "PlayMedia({0})".format(context_url_trailer))
-                )
-                context_menu.append(
-                    (self.addon.localize(30015),
-                     "RunPlugin({0})".format(context_url_rent))
-                )
-                is_rental = True
-            except Exception:
-                label = title = item["details"]["overlay"]["placeholder"]
-                is_rental = False
+            self._add_folder_item(
+                items, self.addon.localize(30014), plugin_url
+            )
 
-            if item["analytics"]["content_media_id"].startswith("s"):
-                plugin_url = self.addon.plugin_url({
-                    "menu": "series",
-                    "seriesId": item["analytics"]["content_media_id"]
-                })
-                is_folder = True
-                is_playable = False
-            elif item["analytics"]["content_media_id"].startswith("m"):
-                plugin_url = self.addon.plugin_url({
-                    "menu": "play",
-                    "streamType": "rental" if is_rental else "vod",
-                    "streamId": item["analytics"]["content_media_id"]
-                })
-                is_folder = False
-                is_playable = True
+        self._end_folder(items)
 
-            self._add_folder_item(
-                items, label, plugin_url, icon, fanart,
-                info=description, genre=genre, is_playable=is_playable,
-                is_folder=is_folder, imdb=imdb, rating=rating,
-                context_menu_items=context_menu, title=title, duration=duration
+    def _indexed_search_menu(self, query_id):
+        # Titles that have been listed before show up at once, search2
+        # results are merged in when they arrive.
+        query = self.search_history.get(query_id)
+        local_items = self.search_index.search(query, self.search_page_size)
+        remote = self.search_index.get_results(
+            query, self.search_results_max_age
+        )
+        if remote is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(self._remote_search, query)
+            executor.shutdown(wait=False)
+            (done, _) = wait(
+                [future], self.search_wait if local_items else None
             )
+            if future not in done:
+                self._search_results(query_id, local_items, [], False)
+                if future.exception():
+                    self.addon.log("Search failed: {0}".format(
+                        future.exception()
+                    ))
+                    return
+                # The results are stored in the index by now.
+                self.update_if_current(self.addon.plugin_url({
+                    "menu": "search", "panelId": query_id, "page": 0
+                }))
+                return
+            remote = future.result()
+
+        (remote_items, has_next) = remote
+        self._search_results(query_id, local_items, remote_items, has_next)
+
+    def _remote_search(self, query):
+        stream = self.addon.get_setting_as_bool("streamResponses")
+        panel = self.telia_play.search(
+            query, self.search_page_size, 0, stream
+        )
+        if stream:
+            media_items = list(POSTER.normalize_all(panel))
+            panel = panel.container or {}
+        else:
+            media_items = list(POSTER.normalize_all(panel.get("posters", [])))
 
-        if "pageInfo" in panel and panel["pageInfo"]["hasNextPage"]:
+        has_next = bool(panel.get("pageInfo") and
+                        panel["pageInfo"]["hasNextPage"])
+        self.search_index.put_results(query, media_items, has_next)
+        return (media_items, has_next)
+
+    def _search_results(self, query_id, local_items, remote_items, has_next):
+        items = []
+        shown = set()
+        for media_item in local_items + remote_items:
+            if media_item.media_id in shown:
+                continue
+            shown.add(media_item.media_id)
+            self._add_media_item(items, media_item, searchable=False)
+
+        if has_next:
             plugin_url = self.addon.plugin_url({
-                "menu": "search" if search else "panel",
-                "panelId": panel_id,
-                "page": page+1
+                "menu": "search",
+                "panelId": query_id,
+                "page": 1
             })
-
             self._add_folder_item(
                 items, self.addon.localize(30014), plugin_url
             )
 
         self._end_folder(items)
 
+    @contextlib.contextmanager
+    def _timed(self, timings, stage):
+        start = time.perf_counter()
+        with tracer.span("play", stage):
+            yield
+        timings[stage] = (time.perf_counter() - start)*1000
+
+    def _acquire_ticket(self, stream_id, stream_type, timings):
+        # Returns the ticket's session id and stream.
+        ticket_path = self.telia_play.ticket_path(stream_id, stream_type)
+        ticket = self.tickets.claim(self.username, ticket_path, stream_type)
+        if ticket:
+            return ticket
+
+        with self._timed(timings, "provision"):
+            provisioned = self.telia_play.provision()
+        try:
+            with self._timed(timings, "ticket"):
+                stream = self.telia_play.get_stream(stream_id, stream_type)
+        except TeliaException:
+            if provisioned:
+                raise
+            # The remembered provisioning may no longer be valid.
+            self.telia_play.forget_provision()
+            with self._timed(timings, "provision"):
+                self.telia_play.provision()
+            with self._timed(timings, "ticket"):
+                stream = self.telia_play.get_stream(stream_id, stream_type)
+
+        self.tickets.add(
+            self.username, self.telia_play.session_id, ticket_path,
+            stream_type, stream
+        )
+        return (self.telia_play.session_id, stream)
+
     @logging
     def rent_menu(self, video_id):
         rent_ok = Dialog().yesno(self.addon.name, self.addon.localize(30101))
 
         if rent_ok:
-            tz_sthlm_stamps = TimezoneStamps("Europe/Stockholm")
+            tz_sthlm_stamps = timezone_stamps("Europe/Stockholm")
             pin_code = self.addon.get_setting(
                 "PIN" + self.addon.get_setting("DefaultUser")
             )
@@ -792,115 +823,14 @@ class MenuList():
         if not media:
             return
 
-        try:
-            icon = urllib.parse.unquote(
-                series["images"]["backdrop16x9"]["source"]
-            )
-        except Exception:
-            icon = None
-
-        try:
-            fanart = urllib.parse.unquote(
-                series["images"]["backdrop16x9"]["source"]
-            )
-        except Exception:
-            fanart = None
-
-        try:
-            description = media["descriptionLong"]
-        except Exception:
-            description = ""
-
-        try:
-            genre = media["genre"]
-        except Exception:
-            genre = ""
-
-        try:
-            duration = media["duration"]["readableShort"]
-            duration = TimezoneStamps(
-                "Europe/Stockholm"
-            ).convert_to_seconds(duration)
-        except Exception:
-            duration = 0
-
-        context_url_add = self.addon.plugin_url({
-            "menu": "addToList",
-            "mediaId": media["id"],
-        })
-        context_menu = [
-            (self.addon.localize(30020),
-             "RunPlugin({0})".format(context_url_add))
-        ]
-        try:
-            label = "{0} [COLOR red]({1})[/COLOR]".format(
-                media["episodeNumber"]["readable"], media["price"]["readable"]
-            )
-            context_url_rent = self.addon.plugin_url({
-                "menu": "rent",
-                "videoId": media["id"]
-            })
-            context_url_trailer = self.addon.plugin_url({
-                "menu": "play",
-                "streamType": "trailer",
-                "streamId": media["id"]
-            })
-            context_menu.append(
-                (self.addon.localize(30019),
-                 "PlayMedia({0})".format(context_url_trailer))
-            )
-            context_menu.append(
-                (self.addon.localize(30015),
-                 "RunPlugin({0})".format(context_url_rent))
-            )
-            is_rental = True
-        except Exception:
-            label = media["episodeNumber"]["readable"]
-            is_rental = False
-
-        if media["id"].startswith("s"):
-            plugin_url = self.addon.plugin_url({
-                "menu": "series",
-                "seriesId": media["id"]
-            })
-            is_folder = True
-            is_playable = False
-        elif media["id"].startswith("m"):
-            plugin_url = self.addon.plugin_url({
-                "menu": "play",
-                "streamType": "rental" if is_rental else "vod",
-                "streamId": media["id"]
-            })
-            is_folder = False
-            is_playable = True
+        series_item = SERIES.normalize(series)
+        media_item = SUGGESTED_EPISODE.normalize(media)
+        media_item.icon = media_item.fanart = series_item.fanart
 
         items = []
-        self._add_folder_item(
-            items, label, plugin_url, icon, fanart, info=description,
-            is_folder=is_folder, is_playable=is_playable, genre=genre,
-            duration=duration, context_menu_items=context_menu
-        )
+        self._add_media_item(items, media_item, searchable=False)
 
         for season in media["series"]["seasonLinks"]["items"]:
-            try:
-                icon = urllib.parse.unquote(
-                    series["images"]["showcard2x3"]["source"]
-                )
-            except Exception:
-                icon = None
-
-            try:
-                fanart = urllib.parse.unquote(
-                    series["images"]["backdrop16x9"]["source"]
-                )
-            except Exception:
-                fanart = None
-
-            try:
-                description = season["descriptionLong"]
-            except Exception:
-                description = ""
-
             plugin_url = self.addon.plugin_url({
                 "menu": "season",
                 "seasonId": season["id"]
@@ -910,86 +840,54 @@ class MenuList():
                 self.addon.localize(30012), season["seasonNumber"]["number"])
 
             self._add_folder_item(
-                items, label, plugin_url, icon, fanart, info=description
+                items, label, plugin_url, series_item.icon, series_item.fanart,
+                info=season.get("descriptionLong") or ""
             )
 
         self._end_folder(items)
 
     @logging
     def season_menu(self, season_id):
-        episodes = self.telia_play.get_season(season_id)
+        episodes = list(EPISODE.normalize_all(self.telia_play.get_season(
+            season_id, self.addon.get_setting_as_bool("streamResponses")
+        )))
+        labels = TimezoneStamps.format_timestamps(
+            [episode.available_from for episode in episodes
+             if episode.available_from],
+            ("%Y-%m-%d %H:%M:%S", "%x", "%X"), "ms"
+        )
 
         items = []
         for episode in episodes:
-
-            try:
-                icon = urllib.parse.unquote(
-                    episode["image"]["source"]
-                )
-            except Exception:
-                icon = None
-
-            try:
-                fanart = urllib.parse.unquote(
-                    episode["images"]["showcard16x9"]["source"]
-                )
-            except Exception:
-                fanart = None
-
-            try:
-                description = episode["descriptionLong"]
-            except Exception:
-                description = ""
-
-            try:
-                tz_sthlm_stamps = TimezoneStamps("Europe/Stockholm")
-                datetime_str = tz_sthlm_stamps.local_datetime_str(
-                    episode["availableFrom"]["timestamp"],
-                    "%Y-%m-%d %H:%M:%S", "ms"
-                )
-                date_label = tz_sthlm_stamps.local_datetime_str(
-                    episode["availableFrom"]["timestamp"], "%x", "ms"
-                )
-                time_label = tz_sthlm_stamps.local_datetime_str(
-                    episode["availableFrom"]["timestamp"], "%X", "ms"
-                )
-                time_label = tz_sthlm_stamps.strip_seconds(time_label)
-            except Exception:
+            if episode.available_from:
+                (datetime_str, date_label, time_label) = \
+                    labels[episode.available_from]
+                time_label = TimezoneStamps.strip_seconds(time_label)
+            else:
                 datetime_str = ""
                 date_label = ""
                 time_label = ""
 
-            try:
-                duration = episode["duration"]["readableShort"]
-                duration = TimezoneStamps(
-                    "Europe/Stockholm"
-                ).convert_to_seconds(duration)
-            except Exception:
-                duration = 0
-
-            try:
+            if episode.price:
                 episode_label = "{0} [COLOR red]({1})[/COLOR]".format(
-                    episode["episodeNumber"]["readable"],
-                    episode["price"]["readable"]
+                    episode.episode, episode.price
                 )
                 context_url = self.addon.plugin_url({
                     "menu": "rent",
-                    "videoId": episode["analytics"]["content_media_id"]
+                    "videoId": episode.media_id
                 })
                 context_menu = [
                     (self.addon.localize(30015),
                      "RunPlugin({0})".format(context_url))
                 ]
-                is_rental = True
-            except Exception:
-                episode_label = episode["details"]["aside"]["header"]
+            else:
+                episode_label = episode.title
                 context_menu = None
-                is_rental = False
 
             plugin_url = self.addon.plugin_url({
                 "menu": "play",
-                "streamType": "rental" if is_rental else "vod",
-                "streamId": episode["analytics"]["content_media_id"]
+                "streamType": "rental" if episode.price else "vod",
+                "streamId": episode.media_id
             })
 
             label = "{0} [COLOR orange]{1}[/COLOR] [COLOR yellow]{2}[/COLOR]".format(
@@ -997,53 +895,82 @@ class MenuList():
             )
 
             self._add_folder_item(
-                items, label, plugin_url, icon, fanart, info=description,
-                is_playable=True, is_folder=False, datetime_str=datetime_str,
-                duration=duration, context_menu_items=context_menu
+                items, label, plugin_url, episode.icon, episode.fanart,
+                info=episode.description, is_playable=True, is_folder=False,
+                datetime_str=datetime_str, duration=episode.duration,
+                context_menu_items=context_menu
             )
 
         self._end_folder(items, sort_methods=(SORT_METHOD_DATEADDED,))
 
+    @property
+    def epg_store(self):
+        if self._epg_store is None and self.addon.get_setting_as_bool("epg"):
+            self._epg_store = EpgStore(self.addon.profile, self.username)
+        return self._epg_store
+
     @logging
     def tv_channels_menu(self, page=0):
         channel_limit = self.addon.get_setting_as_int("channelsPerPage")
         offset = channel_limit*page
-        tz_sthlm_stamps = TimezoneStamps("Europe/Stockholm")
-        menu = self.telia_play.get_channels(
-            tz_sthlm_stamps.now("ms"), channel_limit, offset
-        )
+        tz_sthlm_stamps = timezone_stamps("Europe/Stockholm")
+        timestamp_now = tz_sthlm_stamps.now("ms")
+
+        channels = None
+        if self.epg_store:
+            (channels, has_next_page) = self.epg_store.get_channels(
+                channel_limit, offset
+            )
+            programs = self.epg_store.current_programs(
+                [channel["id"] for channel in channels], timestamp_now
+            )
+            # Use the network until the service has synced the guide.
+            if not programs:
+                channels = None
+
+        if channels is None:
+            # Round down to whole minutes so that the response can be cached.
+            timestamp = timestamp_now // 60000 * 60000
+            menu = self.telia_play.get_channels(
+                timestamp, channel_limit, offset
+            )
+            channels = []
+            programs = {}
+            for channel in menu["channelItems"]:
+                channels.append(channel_record(channel))
+                try:
+                    programs[channel["id"]] = program_record(
+                        channel["programs"]["programItems"][0]
+                    )
+                except IndexError:
+                    pass
+            has_next_page = "pageInfo" in menu and \
+                menu["pageInfo"]["hasNextPage"]
+
+        # The day labels are the same for every channel.
+        days = [tz_sthlm_stamps.today(day_offset, units="ms")
+                for day_offset in EpgSync.days]
+        day_labels = TimezoneStamps.format_timestamps(days, ("%a %d %b",), "ms")
+
+        channels = [
+            channel for channel in channels if channel["id"] in programs
+        ]
+        zapping = self.addon.get_setting_as_bool("zapping")
 
         items = []
-        for channel in menu["channelItems"]:
-            try:
-                icon = urllib.parse.unquote(channel["icons"]["dark"]["source"])
-            except Exception:
-                icon = None
-            try:
-                program = channel["programs"]["programItems"][0]
-            except IndexError:
-                continue
-            try:
-                fanart = urllib.parse.unquote(
-                    program["media"]["images"]["showcard16x9"]["source"]
-                )
-            except Exception:
-                fanart = None
+        for (index, channel) in enumerate(channels):
+            program = programs[channel["id"]]
 
-            context_url = self.addon.plugin_url({
+            context_url = urllib.parse.unquote(self.addon.plugin_url({
                 "menu": "page",
                 "pageId": "epg",
                 "dayOffset": "{0}",
                 "channelId": channel["id"]
-            })
+            }))
 
-            tz_sthlm_stamps = TimezoneStamps("Europe/Stockholm")
             context_menu = []
-            for day_offset in range(-7, 8):
-                timestamp = tz_sthlm_stamps.today(day_offset, units="ms")
-                menu_entry_label = tz_sthlm_stamps.local_datetime_str(
-                    timestamp, "%a %d %b", "ms"
-                )
+            for (day_offset, timestamp) in zip(EpgSync.days, days):
+                menu_entry_label = day_labels[timestamp][0]
                 if day_offset == 0:
                     menu_entry_label = "[COLOR blue]{0}[/COLOR]".format(
                         menu_entry_label
@@ -1051,25 +978,31 @@ class MenuList():
                 context_menu.append(
                     (menu_entry_label,
                      "ActivateWindow(videos, {0}, return)".format(
-                         urllib.parse.unquote(context_url).format(day_offset)
+                         context_url.format(day_offset)
                      ))
                 )
 
-            plugin_url = self.addon.plugin_url({
+            query = {
                 "menu": "play",
                 "streamType": "live",
                 "streamId": channel["id"]
-            })
+            }
+            if zapping:
+                adjacent = channels[max(0, index - 1):index] + \
+                    channels[index + 1:index + 2]
+                query["adjacentIds"] = ",".join(
+                    adjacent_channel["id"] for adjacent_channel in adjacent
+                )
+            plugin_url = self.addon.plugin_url(query)
 
-            program_description = program["media"]["descriptionLong"]
             self._add_folder_item(
-                items, program["media"]["title"], plugin_url, icon=icon,
-                fanart=fanart, info=program_description, is_folder=False,
-                is_playable=True, offscreen=False,
+                items, program["title"], plugin_url, icon=channel["icon"],
+                fanart=program["fanart"], info=program["description"],
+                is_folder=False, is_playable=True, offscreen=False,
                 context_menu_items=context_menu
             )
 
-        if "pageInfo" in menu and menu["pageInfo"]["hasNextPage"]:
+        if has_next_page:
             plugin_url = self.addon.plugin_url({
                 "menu": "page",
                 "pageId": "epg",
@@ -1083,59 +1016,50 @@ class MenuList():
 
     @logging
     def tv_programs_menu(self, channel_id, day_offset):
-        tz_sthlm_stamps = TimezoneStamps("Europe/Stockholm")
+        tz_sthlm_stamps = timezone_stamps("Europe/Stockholm")
         timestamp = tz_sthlm_stamps.today(int(day_offset), "ms")
+        day_end = tz_sthlm_stamps.today(int(day_offset) + 1, "ms")
 
-        channel = self.telia_play.get_channel(
-            channel_id, timestamp
-        )
+        programs = None
+        if self.epg_store:
+            programs = self.epg_store.get_day(
+                channel_id, timestamp, day_end,
+                EpgSync.max_age(int(day_offset))
+            )
 
-        items = []
-        for program in channel["programs"]["programItems"]:
-            try:
-                icon = urllib.parse.unquote(
-                    program["media"]["images"]["showcard2x3"]["source"]
-                )
-            except Exception:
-                icon = None
-            try:
-                fanart = urllib.parse.unquote(
-                    program["media"]["images"]["showcard16x9"]["source"]
+        if programs is None:
+            channel = self.telia_play.get_channel(
+                channel_id, timestamp
+            )
+            program_items = channel["programs"]["programItems"]
+            if self.epg_store:
+                self.epg_store.store_day(
+                    channel_id, timestamp, day_end, program_items
                 )
-            except Exception:
-                fanart = None
-
-            try:
-                imdb_url = program["media"]["ratings"]["imdb"]["url"]
-                imdb = imdb_url.split("/")[-1]
-            except Exception:
-                imdb = ""
-
-            try:
-                rating = program["media"]["ratings"]["imdb"]["readableScore"]
-            except Exception:
-                rating = ""
-
-            timestamp_now = tz_sthlm_stamps.now("ms")
+            # Malformed programs are skipped, as when storing the day.
+            programs = []
+            for program in program_items:
+                try:
+                    programs.append(program_record(program))
+                except (KeyError, TypeError):
+                    continue
 
-            start_timestamp = program["startTime"]["timestamp"]
-            end_timestamp = program["endTime"]["timestamp"]
-            is_live = start_timestamp <= timestamp_now <= end_timestamp
-            duration = (end_timestamp - start_timestamp) // 1000
+        timestamp_now = tz_sthlm_stamps.now("ms")
+        start_times = TimezoneStamps.format_timestamps(
+            [program["start"] for program in programs], ("%X",), "ms"
+        )
 
-            start_time = tz_sthlm_stamps.local_datetime_str(
-                start_timestamp, "%X", "ms"
-            )
-            start_time = tz_sthlm_stamps.strip_seconds(start_time)
+        items = []
+        for program in programs:
+            is_live = program["start"] <= timestamp_now <= program["end"]
+            duration = (program["end"] - program["start"]) // 1000
 
-            end_time = tz_sthlm_stamps.local_datetime_str(
-                end_timestamp, "%X", "ms"
+            start_time = TimezoneStamps.strip_seconds(
+                start_times[program["start"]][0]
             )
-            end_time = tz_sthlm_stamps.strip_seconds(end_time)
 
-            title = program["media"]["title"]
             label = "[COLOR yellow]{2}[/COLOR] [COLOR {0}]{1}[/COLOR]".format(
-                "blue" if is_live else "white", title, start_time
+                "blue" if is_live else "white", program["title"], start_time
             )
 
             if is_live:
@@ -1146,64 +1070,166 @@ class MenuList():
             plugin_url = self.addon.plugin_url({
                 "menu": "play",
                 "streamType": stream_type,
-                "streamId": program["media"]["id"]
+                "streamId": program["media_id"]
             })
 
             self._add_folder_item(
-                items, label, plugin_url, icon=icon, fanart=fanart,
-                info=program["media"]["descriptionLong"], is_folder=False,
-                is_playable=True, duration=duration, imdb=imdb, rating=rating,
-                title=title
+                items, label, plugin_url, icon=program["icon"],
+                fanart=program["fanart"], info=program["description"],
+                is_folder=False, is_playable=True, duration=duration,
+                imdb=program["imdb"], rating=program["rating"],
+                title=program["title"]
             )
 
         self._end_folder(items)
 
     @logging
-    def play_stream(self, stream_id, stream_type):
+    def play_stream(self, stream_id, stream_type, adjacent_ids=None):
         if stream_type == "live_vod":
             stream_type = "vod"
             is_live_vod = True
         else:
             is_live_vod = False
 
-        self.telia_play.validate_stream()
-        stream = self.telia_play.get_stream(stream_id, stream_type)
-
-        is_helper = inputstreamhelper.Helper("mpd", drm="com.widevine.alpha")
-        if is_helper.check_inputstream():
-            play_item = ListItem(path=stream["url"])
-            play_item.setContentLookup(False)
-            play_item.setMimeType("application/dash+xml")
-            play_item.setProperty("inputstream", is_helper.inputstream_addon)
-            play_item.setProperty("inputstream.adaptive.manifest_type", "mpd")
-            if stream_type != "trailer":
-                license_url = stream["drm"]["licenseUrl"]
-                license_headers = "User-Agent=kodi.tv&Content-Type=&{0}".format(
-                    urllib.parse.urlencode(stream["drm"]["headers"])
-                )
-                play_item.setProperty(
-                    "inputstream.adaptive.license_type", "com.widevine.alpha"
-                )
-                play_item.setProperty(
-                    "inputstream.adaptive.license_key",
-                    "{url}|{headers}|R{{SSM}}|".format(
-                        url=license_url,
-                        headers=license_headers
-                    )
+        # The ticket is fetched while inputstreamhelper checks the add-ons.
+        timings = {}
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=1)
+        ticket = executor.submit(
+            self._acquire_ticket, stream_id, stream_type, timings
+        )
+        executor.shutdown(wait=False)
+
+        # Whatever fails from here on, the ticket must not keep holding a
+        # stream slot.
+        try:
+            self._play_ticket(
+                ticket, stream_id, stream_type, is_live_vod, adjacent_ids,
+                timings, start
+            )
+        except Exception:
+            self._release_pending_ticket(
+                ticket, self.telia_play.ticket_path(stream_id, stream_type)
+            )
+            raise
+
+    def _play_ticket(self, ticket, stream_id, stream_type, is_live_vod,
+                     adjacent_ids, timings, start):
+        inputstream_check = InputstreamCheck("mpd", "com.widevine.alpha")
+        with self._timed(timings, "inputstream"):
+            inputstream_addon = inputstream_check.check()
+        (session_id, stream) = ticket.result()
+        ticket_path = self.telia_play.ticket_path(stream_id, stream_type)
+
+        if not inputstream_addon:
+            setResolvedUrl(self.addon.handle, False, listitem=ListItem())
+            self._release_ticket(ticket_path, session_id)
+            return
+
+        manifest_url = stream["url"]
+        manifest_port = self.addon.get_property("manifestPort")
+        if manifest_port and self.addon.get_setting_as_bool("manifestProxy"):
+            # The service serves the manifest without the representations
+            # that would not be picked anyway.
+            manifest_url = "http://127.0.0.1:{0}/manifest.mpd?{1}".format(
+                manifest_port, urllib.parse.urlencode({
+                    "url": stream["url"],
+                    "maxHeight": self.addon.get_setting("manifestMaxHeight"),
+                    "languages": self.addon.get_setting("manifestLanguages")
+                })
+            )
+
+        play_item = ListItem(path=manifest_url)
+        play_item.setContentLookup(False)
+        play_item.setMimeType("application/dash+xml")
+        play_item.setProperty("inputstream", inputstream_addon)
+        play_item.setProperty("inputstream.adaptive.manifest_type", "mpd")
+        if stream_type != "trailer":
+            license_url = stream["drm"]["licenseUrl"]
+            license_headers = "User-Agent=kodi.tv&Content-Type=&{0}".format(
+                urllib.parse.urlencode(stream["drm"]["headers"])
+            )
+            play_item.setProperty(
+                "inputstream.adaptive.license_type", "com.widevine.alpha"
+            )
+            play_item.setProperty(
+                "inputstream.adaptive.license_key",
+                "{url}|{headers}|R{{SSM}}|".format(
+                    url=license_url,
+                    headers=license_headers
                 )
+            )
 
-        if is_live_vod and Dialog().yesno(
+        timings["total"] = (time.perf_counter() - start)*1000
+        notes = [
+            note for (note, applies) in (
+                ("cached inputstream check", inputstream_check.cached),
+                ("reused ticket", "ticket" not in timings)
+            ) if applies
+        ]
+        self.addon.log("Stream {0} ready: {1}{2}".format(stream_id, ", ".join(
+            "{0} {1:.0f} ms".format(stage, timings[stage])
+            for stage in ("provision", "ticket", "inputstream", "total")
+            if stage in timings
+        ), " ({0})".format(", ".join(notes)) if notes else ""))
+        tracer.event(
+            "play", "ready", inputstream_cached=inputstream_check.cached,
+            ticket_reused="ticket" not in timings, **timings
+        )
+
+        seek_to_start = is_live_vod and Dialog().yesno(
             self.addon.name, self.addon.localize(30100)
-        ):
+        )
+
+        if self.addon.get_property("playbackMonitor"):
+            # The service seeks and releases the ticket once playback has
+            # started and ended, so this invocation can end right away.
+            # Handoffs are keyed by URL, another stream may be starting.
+            handoff = self.addon.get_property("playback")
+            handoffs = json.loads(handoff) if handoff else {}
+            replaced = handoffs.get(manifest_url)
+            if replaced and replaced["sessionId"] != session_id:
+                # Its stream never started.
+                self.tickets.schedule_release(replaced["sessionId"], 0)
+            handoffs[manifest_url] = {
+                "username": self.username,
+                "sessionId": session_id,
+                "ticketPath": ticket_path,
+                "streamId": stream_id,
+                "streamType": stream_type,
+                "url": manifest_url,
+                "seekToStart": seek_to_start,
+                # Channels to resolve ahead in zapping mode
+                "adjacent": adjacent_ids.split(",") if adjacent_ids else [],
+                "resolved": time.time()
+            }
+            self.addon.set_property("playback", json.dumps(handoffs))
             setResolvedUrl(self.addon.handle, True, listitem=play_item)
-            # Wait for vod stream to start and set playback from the beginning
-            xbmc.sleep(4000)
+            return
+
+        setResolvedUrl(self.addon.handle, True, listitem=play_item)
+        # Wait for the stream to start
+        xbmc.sleep(4000)
+        if seek_to_start:
             xbmc.Player().seekTime(0.0)
-        else:
-            setResolvedUrl(self.addon.handle, True, listitem=play_item)
-            xbmc.sleep(4000)
+
+        if not xbmc.Player().isPlaying():
+            # Probe again next time, something may have broken since.
+            inputstream_check.invalidate()
 
         while xbmc.Player().isPlaying():
             xbmc.sleep(250)
 
-        self.telia_play.delete_stream()
+        self._release_ticket(ticket_path, session_id)
+
+    def _release_ticket(self, ticket_path, session_id):
+        self.tickets.remove(session_id)
+        self.telia_play.delete_stream(ticket_path, session_id)
+
+    def _release_pending_ticket(self, ticket, ticket_path):
+        # The ticket may never have been acquired.
+        try:
+            (session_id, _) = ticket.result()
+        except Exception:
+            return
+        self._release_ticket(ticket_path, session_id)
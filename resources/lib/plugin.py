@@ -4,6 +4,7 @@ from xbmcgui import Dialog
 from resources.lib.api import TeliaException
 from resources.lib.menus import MenuList
 from resources.lib.kodiutils import AddonUtils
+from resources.lib.tracing import tracer
 
 
 class Router():
@@ -61,8 +62,14 @@ class Router():
                 self.menu_list.refresh()
             elif self.params["menu"] == "play":
                 self.menu_list.play_stream(
-                    self.params["streamId"], self.params["streamType"]
+                    self.params["streamId"], self.params["streamType"],
+                    self.params.get("adjacentIds")
                 )
+            elif self.params["menu"] == "diagnostics":
+                self.menu_list.diagnostics_menu()
+            elif self.params["menu"] == "cleartraces":
+                tracer.clear()
+                self.menu_list.refresh()
         else:
             self.menu_list.main_menu()
 
@@ -104,8 +111,12 @@ def run():
     paramstring = sys.argv[2][1:]
     params = dict(parse_qsl(paramstring))
 
+    addon = AddonUtils()
+    tracer.configure(addon.profile, addon.get_setting_as_bool("tracing"))
+
     try:
-        router = Router(params)
-        router.main_menu()
+        with tracer.span("route", params.get("menu", "main"), params=params):
+            router = Router(params)
+            router.main_menu()
     except TeliaException as te:
         Dialog().textviewer(AddonUtils().name, str(te))
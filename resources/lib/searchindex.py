@@ -0,0 +1,177 @@
+import re
+import time
+import hashlib
+import unicodedata
+from resources.lib.database import Database
+from resources.lib.mediaitem import MediaItem
+
+
+WORD = re.compile(r"\w+")
+
+
+def fold(text):
+    # Lower case without diacritics, so that "hav" finds "Håvard".
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+
+
+def terms(text):
+    return WORD.findall(fold(text or ""))
+
+
+class SearchIndex(Database):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS items ("
+        "id TEXT PRIMARY KEY, media_id TEXT, title TEXT, episode TEXT, "
+        "icon TEXT, fanart TEXT, genre TEXT, description TEXT, imdb TEXT, "
+        "rating TEXT, duration INTEGER, price TEXT, available_from INTEGER, "
+        "seen REAL)",
+        "CREATE INDEX IF NOT EXISTS items_seen ON items (seen)",
+        # field is 0 for title terms and 1 for genre terms.
+        "CREATE TABLE IF NOT EXISTS terms ("
+        "term TEXT, item_id TEXT, field INTEGER, "
+        "PRIMARY KEY (term, item_id, field)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS terms_item ON terms (item_id)",
+        "CREATE TABLE IF NOT EXISTS results ("
+        "query TEXT PRIMARY KEY, item_ids TEXT, has_next INTEGER, "
+        "stored REAL)"
+    )
+    max_items = 20000
+
+    def __init__(self, directory, username):
+        # The catalog depends on the subscription, so index per account.
+        scope = hashlib.sha1(username.encode("utf-8")).hexdigest()[:12]
+        super().__init__(directory, "search_{0}.db".format(scope))
+
+    def add(self, media_items):
+        now = time.time()
+        rows = {}
+        for media_item in media_items:
+            if media_item.id and media_item.title:
+                rows[media_item.id] = tuple(
+                    getattr(media_item, name) for name in MediaItem.__slots__
+                ) + (now,)
+        if not rows:
+            return
+
+        term_rows = []
+        for row in rows.values():
+            (item_id, title, genre) = (row[0], row[2], row[6])
+            term_rows.extend((term, item_id, 0) for term in set(terms(title)))
+            term_rows.extend((term, item_id, 1) for term in set(terms(genre)))
+
+        with self.connection() as conn:
+            conn.executemany(
+                "DELETE FROM terms WHERE item_id = ?",
+                [(item_id,) for item_id in rows]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO items ({0}, seen) VALUES ({1}, ?)".format(
+                    ", ".join(MediaItem.__slots__),
+                    ", ".join("?" for _ in MediaItem.__slots__)
+                ), list(rows.values())
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO terms (term, item_id, field) "
+                "VALUES (?, ?, ?)", term_rows
+            )
+            self.prune(conn)
+
+    def prune(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        if count <= self.max_items:
+            return
+        # Make room for a while, so that not every panel has to prune.
+        conn.execute(
+            "DELETE FROM items WHERE id IN (SELECT id FROM items "
+            "ORDER BY seen LIMIT ?)", (count - self.max_items*9//10,)
+        )
+        conn.execute(
+            "DELETE FROM terms WHERE item_id NOT IN (SELECT id FROM items)"
+        )
+
+    def search(self, query, limit=50):
+        # Every query word has to be a prefix of a title or genre word.
+        # Items matching on their title come before genre-only matches.
+        query_terms = sorted(set(terms(query)), key=len, reverse=True)
+        if not query_terms:
+            return []
+
+        matches = None
+        with self.connection() as conn:
+            for term in query_terms:
+                # Ranges on the primary key find all words with this prefix.
+                found = {}
+                for (item_id, field) in conn.execute(
+                    "SELECT item_id, field FROM terms "
+                    "WHERE term >= ? AND term < ?", (term, term + "\uffff")
+                ):
+                    found[item_id] = min(field, found.get(item_id, 1))
+                if matches is None:
+                    matches = found
+                else:
+                    matches = {
+                        item_id: max(field, found[item_id])
+                        for (item_id, field) in matches.items()
+                        if item_id in found
+                    }
+                if not matches:
+                    return []
+
+            media_items = self.load_items(conn, list(matches))
+
+        media_items.sort(key=lambda media_item: (
+            matches[media_item.id], fold(media_item.title)
+        ))
+        return media_items[:limit]
+
+    def load_items(self, conn, item_ids):
+        media_items = []
+        # Older SQLite versions allow at most 999 parameters per statement.
+        for start in range(0, len(item_ids), 500):
+            chunk = item_ids[start:start + 500]
+            for row in conn.execute(
+                "SELECT {0} FROM items WHERE id IN ({1})".format(
+                    ", ".join(MediaItem.__slots__),
+                    ", ".join("?" for _ in chunk)
+                ), chunk
+            ):
+                media_item = MediaItem()
+                for (name, value) in zip(MediaItem.__slots__, row):
+                    setattr(media_item, name, value)
+                media_items.append(media_item)
+        return media_items
+
+    def put_results(self, query, media_items, has_next):
+        # Remembers the order of remote search results for a while, so that
+        # the listing can be redrawn with them without searching again.
+        self.add(media_items)
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(query, item_ids, has_next, stored) VALUES (?, ?, ?, ?)",
+                (fold(query.strip()), "\n".join(
+                    media_item.id for media_item in media_items
+                    if media_item.id
+                ), int(has_next), time.time())
+            )
+
+    def get_results(self, query, max_age):
+        with self.connection() as conn:
+            result = conn.execute(
+                "SELECT item_ids, has_next, stored FROM results "
+                "WHERE query = ?", (fold(query.strip()),)
+            ).fetchone()
+            if result is None or time.time() - result[2] > max_age:
+                return None
+            item_ids = result[0].split("\n") if result[0] else []
+            by_id = dict(
+                (media_item.id, media_item)
+                for media_item in self.load_items(conn, item_ids)
+            )
+        return (
+            [by_id[item_id] for item_id in item_ids if item_id in by_id],
+            bool(result[1])
+        )
@@ -0,0 +1,330 @@
+import json
+import time
+import uuid
+import threading
+import urllib.parse
+import xbmc
+from resources.lib.kodiutils import AddonUtils, InputstreamCheck
+from resources.lib.sessionpool import SessionPoolServer
+
+
+class PlaybackMonitor(xbmc.Player):
+    # Releases streaming tickets when playback ends, so that plugin
+    # invocations can return as soon as the stream has been resolved. The
+    # plugin hands each stream over in the "playback" window property, a
+    # map from the resolved URL to the stream's session.
+    # Tickets are released after a grace period, so zapping back to a
+    # channel can reuse its ticket. In zapping mode the channels next to a
+    # playing channel are resolved ahead, so switching to them only has to
+    # claim their tickets.
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+        self.session = None
+        self.lock = threading.Lock()
+
+    def playing_file(self):
+        try:
+            return self.getPlayingFile()
+        except RuntimeError:
+            return None
+
+    def handoffs(self):
+        handoffs = self.service.addon.get_property("playback")
+        return json.loads(handoffs) if handoffs else {}
+
+    def handed_over(self):
+        playing_file = self.playing_file()
+        handoffs = self.handoffs()
+        session = handoffs.pop(playing_file, None)
+        if session is None:
+            # Something else is playing, the streams may still start.
+            return None
+
+        # Streams resolved before this one were never started.
+        for superseded in list(handoffs.values()):
+            if superseded["resolved"] <= session["resolved"]:
+                self.release(superseded)
+                del handoffs[superseded["url"]]
+        if handoffs:
+            self.service.addon.set_property("playback", json.dumps(handoffs))
+        else:
+            self.service.addon.clear_property("playback")
+        return session
+
+    def onAVStarted(self):
+        session = self.handed_over()
+        if session is None:
+            if self.session and self.playing_file() != self.session["url"]:
+                # Playback moved on to something outside the add-on.
+                self.end()
+            return
+
+        with self.lock:
+            (previous, self.session) = (self.session, session)
+        if previous:
+            self.release(previous)
+        # Playing a reused ticket again may have scheduled its release.
+        self.service.tickets.hold(session["sessionId"])
+        self.service.tickets.keep_alive(session["sessionId"])
+        if session.get("seekToStart"):
+            self.seekTime(0.0)
+        if session.get("adjacent"):
+            thread = threading.Thread(
+                target=self.service.preresolve,
+                args=(session["username"], session["adjacent"])
+            )
+            thread.daemon = True
+            thread.start()
+
+    def onPlayBackStopped(self):
+        self.end()
+
+    def onPlayBackEnded(self):
+        self.end()
+
+    def onPlayBackError(self):
+        # Probe inputstream again before the next stream.
+        InputstreamCheck().invalidate()
+        # Kodi does not tell which stream failed.
+        for session in self.handoffs().values():
+            self.release(session)
+        self.service.addon.clear_property("playback")
+        self.end()
+
+    def end(self):
+        with self.lock:
+            (session, self.session) = (self.session, None)
+        if session:
+            self.release(session)
+
+    def release(self, session):
+        self.service.tickets.schedule_release(
+            session["sessionId"], self.service.ticket_release_delay
+        )
+
+
+class Service():
+    token_refresh_interval = 300
+    epg_sync_interval = 900
+    # Spread the initial guide download over many short bursts.
+    epg_requests_per_tick = 20
+    # Seconds a stopped stream keeps its ticket for zapping back.
+    ticket_release_delay = 60
+    # Tickets resolved ahead for adjacent channels, at most this many at a
+    # time, each held for preresolve_delay seconds unless it is played.
+    max_preresolved = 2
+    preresolve_delay = 120
+
+    def __init__(self):
+        self.addon = AddonUtils()
+        self.monitor = xbmc.Monitor()
+        self.session_pool = None
+        self.manifest_proxy = None
+        self.playback_monitor = None
+        self._web_utils = None
+        self._token_refresher = None
+        self._tickets = None
+        self.preresolve_lock = threading.Lock()
+        self.next_token_refresh = 0
+        self.next_epg_sync = 0
+
+    @property
+    def web_utils(self):
+        if self._web_utils is None:
+            from resources.lib.webutils import WebUtils
+            self._web_utils = WebUtils(
+                base_url=self.addon.get_setting("apiBaseUrl") or None
+            )
+        return self._web_utils
+
+    @property
+    def token_refresher(self):
+        if self._token_refresher is None:
+            from resources.lib.tokens import TokenRefresher
+            self._token_refresher = TokenRefresher(self.web_utils)
+        return self._token_refresher
+
+    @property
+    def tickets(self):
+        if self._tickets is None:
+            from resources.lib.tickets import TicketRegistry
+            self._tickets = TicketRegistry(self.addon.profile)
+        return self._tickets
+
+    def start(self):
+        self.playback_monitor = PlaybackMonitor(self)
+        self.addon.set_property("playbackMonitor", "true")
+
+        if self.addon.get_setting_as_bool("sessionService"):
+            # A base URL override points at a local stand-in server, which
+            # the pool has to be allowed to relay to.
+            base_url = self.addon.get_setting("apiBaseUrl")
+            self.session_pool = SessionPoolServer(extra_hosts=[
+                urllib.parse.urlsplit(base_url).hostname
+            ] if base_url else [])
+            self.session_pool.start()
+            self.addon.set_property("sessionPort", self.session_pool.port)
+            self.addon.log("Session pool listening on port {0}".format(
+                self.session_pool.port
+            ))
+
+        if self.addon.get_setting_as_bool("manifestProxy"):
+            from resources.lib.manifestproxy import ManifestProxyServer
+            from resources.lib.webutils import WebUtils
+
+            self.manifest_proxy = ManifestProxyServer(WebUtils(
+                base_url=self.addon.get_setting("apiBaseUrl") or None
+            ), self.tickets.expiry)
+            self.manifest_proxy.start()
+            self.addon.set_property("manifestPort", self.manifest_proxy.port)
+
+    def stop(self):
+        self.addon.clear_property("playbackMonitor")
+        self.playback_monitor = None
+        # Do not hold on to concurrent stream slots while Kodi is off.
+        self.release_tickets(everything=True)
+        self.addon.clear_property("sessionPort")
+        if self.session_pool:
+            self.session_pool.stop()
+            self.session_pool = None
+        self.addon.clear_property("manifestPort")
+        if self.manifest_proxy:
+            self.manifest_proxy.stop()
+            self.manifest_proxy = None
+
+    def accounts(self):
+        for user_id in range(1, 6):
+            username = self.addon.get_setting("user{0}".format(user_id))
+            if username:
+                password = self.addon.get_setting("pass{0}".format(user_id))
+                yield (username, password)
+
+    def default_account(self):
+        default_user = self.addon.get_setting("defaultUser")
+        return (
+            self.addon.get_setting("user" + default_user),
+            self.addon.get_setting("pass" + default_user)
+        )
+
+    def refresh_tokens(self):
+        try:
+            self.token_refresher.refresh_all(self.accounts())
+        except Exception as e:
+            self.addon.log("Token refresh failed: {0}".format(e))
+
+    def sync_epg(self):
+        from resources.lib.api import TeliaPlay
+        from resources.lib.epg import EpgStore, EpgSync
+        from resources.lib.timeutils import timezone_stamps
+
+        (username, password) = self.default_account()
+        if not username or not self.addon.get_setting_as_bool("epg"):
+            return True
+
+        try:
+            userdata = self.token_refresher.get_userdata(username, password)
+            epg_sync = EpgSync(
+                TeliaPlay(userdata, web_utils=self.web_utils),
+                EpgStore(self.addon.profile, username),
+                timezone_stamps("Europe/Stockholm")
+            )
+            return epg_sync.sync(
+                self.epg_requests_per_tick, self.monitor.abortRequested
+            )
+        except Exception as e:
+            self.addon.log("EPG sync failed: {0}".format(e))
+            return True
+
+    def release_tickets(self, everything=False):
+        from resources.lib.api import TeliaPlay
+
+        tickets = self.tickets.due(everything)
+        for (session_id, username, ticket_path) in tickets:
+            try:
+                userdata = self.token_refresher.userdata_store.get(username)
+                TeliaPlay(userdata, web_utils=self.web_utils).delete_stream(
+                    ticket_path, session_id
+                )
+            except Exception as e:
+                self.addon.log("Releasing streaming ticket failed: {0}".format(
+                    e
+                ))
+
+    def preresolve(self, username, channel_ids):
+        from resources.lib.api import TeliaPlay
+        from resources.lib.webutils import WebUtils
+
+        # Zapping quickly should not pile up requests.
+        with self.preresolve_lock:
+            try:
+                userdata = self.token_refresher.userdata_store.get(username)
+                # Runs next to the service loop, so it gets its own session.
+                telia_play = TeliaPlay(userdata, web_utils=WebUtils(
+                    base_url=self.addon.get_setting("apiBaseUrl") or None
+                ))
+                telia_play.state_store = self.token_refresher.userdata_store
+            except Exception as e:
+                self.addon.log("Resolving channels ahead failed: {0}".format(
+                    e
+                ))
+                return
+
+            ticket_paths = [
+                telia_play.ticket_path(channel_id, "live")
+                for channel_id in channel_ids
+            ]
+            # Zapping on leaves the old neighbours behind.
+            self.tickets.release_preresolved(username, ticket_paths)
+            self.release_tickets()
+
+            for (channel_id, ticket_path) in zip(channel_ids, ticket_paths):
+                if self.tickets.has_valid(username, ticket_path, "live"):
+                    continue
+                if self.tickets.preresolved_count(username) >= \
+                        self.max_preresolved:
+                    break
+                try:
+                    telia_play.session_id = str(uuid.uuid4())
+                    telia_play.provision()
+                    stream = telia_play.get_stream(channel_id, "live")
+                    self.tickets.add(
+                        username, telia_play.session_id, ticket_path, "live",
+                        stream, self.preresolve_delay
+                    )
+                    # The proxy keeps the manifest, otherwise this at least
+                    # warms the CDN for the request that follows.
+                    if self.manifest_proxy:
+                        self.manifest_proxy.original(stream["url"])
+                    else:
+                        telia_play.get_manifest(stream["url"])
+                except Exception as e:
+                    self.addon.log("Resolving channel {0} failed: {1}".format(
+                        channel_id, e
+                    ))
+
+    def tick(self):
+        session = self.playback_monitor and self.playback_monitor.session
+        if session:
+            self.tickets.keep_alive(session["sessionId"])
+        self.release_tickets()
+        if time.time() >= self.next_token_refresh:
+            self.refresh_tokens()
+            self.next_token_refresh = time.time() + self.token_refresh_interval
+
+        if time.time() >= self.next_epg_sync:
+            if self.sync_epg():
+                self.next_epg_sync = time.time() + self.epg_sync_interval
+
+    def run_forever(self):
+        self.start()
+        while not self.monitor.abortRequested():
+            self.tick()
+            if self.monitor.waitForAbort(10):
+                break
+        self.stop()
+
+
+def run():
+    Service().run_forever()
@@ -0,0 +1,159 @@
+import json
+import socket
+import struct
+import socketserver
+import threading
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+ALLOWED_HOST_SUFFIXES = (".telia.net", ".t6a.net")
+FRAME_HEADER = struct.Struct(">II")
+
+
+class SessionPoolUnavailable(Exception):
+    pass
+
+
+class SessionPoolError(Exception):
+    pass
+
+
+def send_message(sock, header, body=b""):
+    header_bytes = json.dumps(header).encode("utf-8")
+    sock.sendall(
+        FRAME_HEADER.pack(len(header_bytes), len(body)) + header_bytes + body
+    )
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise SessionPoolError("Connection closed by session pool")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    (header_size, body_size) = FRAME_HEADER.unpack(
+        recv_exactly(sock, FRAME_HEADER.size)
+    )
+    header = json.loads(recv_exactly(sock, header_size).decode("utf-8"))
+    body = recv_exactly(sock, body_size)
+    return (header, body)
+
+
+def build_response(status, reason, url, encoding, headers, content):
+    response = requests.models.Response()
+    response.status_code = status
+    response.reason = reason
+    response.url = url
+    response.encoding = encoding
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content
+    # Lets iter_content() slice the body instead of reading from a socket.
+    response._content_consumed = True
+    return response
+
+
+class SessionPoolHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        (header, body) = recv_message(self.request)
+        try:
+            response = self.server.execute(header, body)
+        except Exception as e:
+            send_message(self.request, {"error": str(e)})
+            return
+
+        send_message(self.request, {
+            "status": response.status_code,
+            "reason": response.reason,
+            "url": response.url,
+            "encoding": response.encoding,
+            "headers": dict(response.headers)
+        }, response.content)
+
+
+class SessionPoolServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, pool_size=10, extra_hosts=()):
+        super().__init__(("127.0.0.1", 0), SessionPoolHandler)
+        self.extra_hosts = tuple(extra_hosts)
+        self.session = requests.session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def execute(self, header, body):
+        # Only relay requests to the Telia backends, never act as an open proxy.
+        host = urllib.parse.urlsplit(header["url"]).hostname or ""
+        if not host.endswith(ALLOWED_HOST_SUFFIXES) and \
+                host not in self.extra_hosts:
+            raise SessionPoolError("Host '{0}' is not allowed".format(host))
+
+        return self.session.request(
+            header["method"], header["url"], headers=header["headers"],
+            data=body if body else None
+        )
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.session.close()
+
+
+class SessionPoolClient():
+
+    def __init__(self, port, timeout=60):
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, method, url, headers=None, payload=None):
+        try:
+            sock = socket.create_connection(
+                ("127.0.0.1", self.port), timeout=self.timeout
+            )
+        except OSError as e:
+            raise SessionPoolUnavailable(str(e))
+
+        headers = dict(headers) if headers else {}
+        body = b""
+        if payload is not None:
+            body = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        with sock:
+            send_message(sock, {
+                "method": method,
+                "url": url,
+                "headers": headers
+            }, body)
+            (header, content) = recv_message(sock)
+
+        if "error" in header:
+            raise SessionPoolError(header["error"])
+
+        return build_response(
+            header["status"], header["reason"], header["url"],
+            header["encoding"], header["headers"], content
+        )
@@ -0,0 +1,159 @@
+import json
+import time
+from resources.lib.database import Database
+
+
+class TicketRegistry(Database):
+    # Streaming tickets issued to this device. Each one occupies a
+    # concurrent stream slot until it is released, and a ticket that is
+    # still valid can be played again instead of minting a new one.
+    filename = "tickets.db"
+    schema = (
+        # release_at is NULL while the ticket is playing. A ticket is only
+        # reused within ticket_ttl of issued_at, while alive_until is moved
+        # on during playback and tells when the ticket was abandoned.
+        # preresolved marks tickets resolved ahead that were never claimed.
+        "CREATE TABLE IF NOT EXISTS tickets ("
+        "session_id TEXT PRIMARY KEY, username TEXT, path TEXT, "
+        "stream_type TEXT, stream TEXT, issued_at REAL, alive_until REAL, "
+        "release_at REAL, preresolved INTEGER DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS tickets_stream "
+        "ON tickets (username, path, stream_type)"
+    )
+    # The gateway does not say how long a ticket stays valid.
+    ticket_ttl = 600
+    # Leave time to start playing a reused ticket.
+    reuse_margin = 30
+
+    def add(self, username, session_id, path, stream_type, stream,
+            release_delay=None):
+        # Tickets resolved ahead of playback are released after
+        # release_delay unless they are claimed.
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tickets (session_id, username, path, "
+                "stream_type, stream, issued_at, alive_until, release_at, "
+                "preresolved) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (session_id, username, path, stream_type, json.dumps(stream),
+                 now, now + self.ticket_ttl,
+                 None if release_delay is None else now + release_delay,
+                 release_delay is not None)
+            )
+
+    def reusable_since(self):
+        # Tickets issued before this are too old to be played again.
+        return time.time() + self.reuse_margin - self.ticket_ttl
+
+    def has_valid(self, username, path, stream_type):
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM tickets WHERE username = ? AND path = ? "
+                "AND stream_type = ? AND issued_at > ?",
+                (username, path, stream_type, self.reusable_since())
+            ).fetchone()
+        return row is not None
+
+    def preresolved_count(self, username):
+        # Tickets resolved ahead that are waiting to be claimed. Tickets
+        # kept for zapping back do not count.
+        with self.connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM tickets WHERE username = ? "
+                "AND preresolved = 1 AND release_at > ?",
+                (username, time.time())
+            ).fetchone()[0]
+
+    def release_preresolved(self, username, keep_paths):
+        # Tickets resolved ahead for channels that are no longer adjacent.
+        keep_paths = set(keep_paths)
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT session_id, path FROM tickets WHERE username = ? "
+                "AND preresolved = 1", (username,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tickets SET release_at = ? WHERE session_id = ?",
+                [(time.time(), session_id) for (session_id, path) in rows
+                 if path not in keep_paths]
+            )
+
+    def claim(self, username, path, stream_type):
+        # Returns (session_id, stream) of a valid ticket for the stream and
+        # keeps it from being released, None if a new one is needed.
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT session_id, stream FROM tickets WHERE username = ? "
+                "AND path = ? AND stream_type = ? AND issued_at > ? "
+                "ORDER BY issued_at DESC",
+                (username, path, stream_type, self.reusable_since())
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tickets SET release_at = NULL, preresolved = 0 "
+                "WHERE session_id = ?", (row[0],)
+            )
+        return (row[0], json.loads(row[1]))
+
+    def hold(self, session_id):
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE tickets SET release_at = NULL, preresolved = 0 "
+                "WHERE session_id = ?", (session_id,)
+            )
+
+    def keep_alive(self, session_id):
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE tickets SET alive_until = ? WHERE session_id = ?",
+                (time.time() + self.ticket_ttl, session_id)
+            )
+
+    def schedule_release(self, session_id, delay):
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE tickets SET release_at = ? WHERE session_id = ?",
+                (time.time() + delay, session_id)
+            )
+
+    def due(self, everything=False):
+        # Takes the tickets to release off the registry. Abandoned tickets
+        # are released too, whether or not they were handed over, since a
+        # playing ticket is kept alive by the service.
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if everything:
+                rows = conn.execute(
+                    "SELECT session_id, username, path FROM tickets"
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT session_id, username, path FROM tickets "
+                    "WHERE release_at <= ? OR alive_until <= ?", (now, now)
+                ).fetchall()
+            conn.executemany(
+                "DELETE FROM tickets WHERE session_id = ?",
+                [(row[0],) for row in rows]
+            )
+        return rows
+
+    def expiry(self, url):
+        # Until when the ticket of a manifest URL is alive.
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT stream, alive_until FROM tickets "
+                "WHERE alive_until > ?", (time.time(),)
+            ).fetchall()
+        for (stream, alive_until) in rows:
+            if json.loads(stream).get("url") == url:
+                return alive_until
+        return None
+
+    def remove(self, session_id):
+        with self.connection() as conn:
+            conn.execute(
+                "DELETE FROM tickets WHERE session_id = ?", (session_id,)
+            )
@@ -1,6 +1,5 @@
 import functools
 from datetime import datetime, timedelta
-import pytz
 
 
 class TimestampsException(Exception):
@@ -19,19 +18,52 @@ def unit_conversion_factor(units):
     return factor
 
 
+@functools.lru_cache(maxsize=None)
+def get_timezone(area):
+    import pytz
+    return pytz.timezone(area)
+
+
+@functools.lru_cache(maxsize=None)
+def timezone_stamps(area):
+    # One shared instance per area, so its day table is only built once.
+    return TimezoneStamps(area)
+
+
 class TimezoneStamps():
+    day_window = range(-7, 8)
 
     def __init__(self, area):
-        self.timezone = pytz.timezone(area)
+        self.timezone = get_timezone(area)
+        self.day_table = (None, {})
+
+    def midnight(self, day):
+        # Localizing each date separately keeps midnights right across DST.
+        local_midnight = self.timezone.localize(
+            datetime(day.year, day.month, day.day)
+        )
+        return int(local_midnight.timestamp())
+
+    def day_boundaries(self):
+        today_date = datetime.now(self.timezone).date()
+        if self.day_table[0] != today_date:
+            self.day_table = (today_date, {
+                day_offset: self.midnight(
+                    today_date + timedelta(days=day_offset)
+                ) for day_offset in self.day_window
+            })
+        return self.day_table[1]
 
     def today(self, day_offset=0, units="s"):
         factor = unit_conversion_factor(units)
-        today_date = datetime.now(self.timezone) + timedelta(days=day_offset)
-        today_date = datetime(
-            today_date.year, today_date.month, today_date.day, 0, 0,
-            0, 0
-        )
-        return int(datetime.timestamp(today_date) * factor)
+        boundaries = self.day_boundaries()
+        try:
+            seconds = boundaries[day_offset]
+        except KeyError:
+            seconds = self.midnight(
+                self.day_table[0] + timedelta(days=day_offset)
+            )
+        return seconds * factor
 
     def now(self, units="s"):
         factor = unit_conversion_factor(units)
@@ -44,6 +76,21 @@ class TimezoneStamps():
         datetime_object = datetime.fromtimestamp(timestamp // factor)
         return datetime_object.strftime(time_format)
 
+    @staticmethod
+    def format_timestamps(timestamps, time_formats, units):
+        # Maps each distinct timestamp to its strings in all formats,
+        # converting every timestamp only once.
+        factor = unit_conversion_factor(units)
+        formatted = {}
+        for timestamp in timestamps:
+            if timestamp not in formatted:
+                datetime_object = datetime.fromtimestamp(timestamp // factor)
+                formatted[timestamp] = tuple(
+                    datetime_object.strftime(time_format)
+                    for time_format in time_formats
+                )
+        return formatted
+
     @staticmethod
     def strip_seconds(time_str):
         time_str_split = time_str.split()
@@ -0,0 +1,93 @@
+import os
+import uuid
+import datetime
+from resources.lib.api import TeliaPlay, TeliaException
+from resources.lib.filelock import FileLock
+from resources.lib.kodiutils import AddonUtils
+from resources.lib.userdata import UserDataStore
+
+
+class TokenRefresher():
+    lock_filename = "token.lock"
+    # The service refreshes tokens this long before they expire, plugin
+    # invocations only refresh tokens that are about to expire.
+    background_margin = datetime.timedelta(minutes=45)
+    foreground_margin = datetime.timedelta(minutes=5)
+
+    def __init__(self, web_utils):
+        self.web_utils = web_utils
+        self.addon = AddonUtils()
+        profile = self.addon.profile
+        self.userdata_store = UserDataStore(profile)
+        self.lock_path = os.path.join(profile, self.lock_filename)
+
+    @staticmethod
+    def needs_refresh(userdata, margin):
+        import dateutil.parser
+
+        valid_to = dateutil.parser.isoparse(userdata["tokenData"]["validTo"])
+        time_now = datetime.datetime.now(datetime.timezone.utc)
+        return time_now >= valid_to - margin
+
+    def get_userdata(self, username, password, margin=None):
+        if margin is None:
+            margin = self.foreground_margin
+
+        userdata = self.userdata_store.get(username)
+        if userdata and not self.needs_refresh(userdata, margin):
+            return userdata
+
+        # The lock keeps parallel invocations from all logging in or
+        # refreshing at once; the store itself is safe without it.
+        with FileLock(self.lock_path):
+            # Another process may have refreshed while we waited for the lock.
+            userdata = self.userdata_store.get(username)
+            if not userdata:
+                userdata = self.login(username, password)
+                self.userdata_store.put(username, userdata)
+            elif self.needs_refresh(userdata, margin):
+                userdata = self.refresh(userdata, username, password)
+                self.userdata_store.put_tokens(
+                    username, userdata["tokenData"]
+                )
+        return userdata
+
+    def login(self, username, password):
+        boot_uuid = str(uuid.uuid4())
+        device_uuid = "WEB-" + boot_uuid
+        userdata = {
+            "bootUUID": boot_uuid,
+            "deviceUUID": device_uuid,
+            "tokenData": None
+        }
+        telia_play = TeliaPlay(userdata, web_utils=self.web_utils)
+        token_data = telia_play.login(username, password)
+        telia_play.validate_login()
+        userdata["tokenData"] = token_data
+        return userdata
+
+    def refresh(self, userdata, username, password):
+        telia_play = TeliaPlay(userdata, web_utils=self.web_utils)
+        try:
+            userdata["tokenData"] = telia_play.refresh_token()
+        except TeliaException as te:
+            if "refresh token not found" in str(te).lower():
+                userdata["tokenData"] = telia_play.login(username, password)
+            else:
+                raise te
+        return userdata
+
+    def refresh_all(self, accounts):
+        usernames = set(self.userdata_store.usernames())
+        for (username, password) in accounts:
+            if username not in usernames:
+                continue
+            # One account failing must not keep the others from refreshing.
+            try:
+                self.get_userdata(
+                    username, password, margin=self.background_margin
+                )
+            except Exception as e:
+                self.addon.log("Token refresh failed for {0}: {1}".format(
+                    username, e
+                ))
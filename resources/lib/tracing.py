@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+
+def new_id(size=4):
+    return os.urandom(size).hex()
+
+
+class Tracer():
+    filename = "trace.log"
+    max_bytes = 512*1024
+    backups = 2
+
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.trace_id = None
+        self.logger = None
+        self.local = threading.local()
+
+    def configure(self, directory, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+        # One trace per plugin invocation.
+        self.trace_id = new_id(6)
+        if not enabled or self.logger:
+            return
+
+        # Only pulled in when tracing, it is slow to import.
+        import logging.handlers
+
+        os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            os.path.join(directory, self.filename), maxBytes=self.max_bytes,
+            backupCount=self.backups, encoding="utf-8"
+        )
+        self.logger = logging.getLogger("teliaplay.trace")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.close_handlers()
+        self.logger.addHandler(handler)
+
+    def close_handlers(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    @contextlib.contextmanager
+    def span(self, kind, name, **attributes):
+        # Yields a dict the traced code can add attributes to.
+        if not self.enabled:
+            yield attributes
+            return
+
+        stack = self.local.__dict__.setdefault("stack", [])
+        span_id = new_id()
+        parent = stack[-1] if stack else None
+        stack.append(span_id)
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except Exception as e:
+            attributes["error"] = "{0}: {1}".format(type(e).__name__, e)
+            raise
+        finally:
+            stack.pop()
+            self.write(kind, name, started, (time.perf_counter() - start)*1000,
+                       span_id, parent, attributes)
+
+    def event(self, kind, name, ms=0, **attributes):
+        if not self.enabled:
+            return
+        stack = self.local.__dict__.get("stack")
+        self.write(kind, name, time.time(), ms, new_id(),
+                   stack[-1] if stack else None, attributes)
+
+    def write(self, kind, name, started, ms, span_id, parent, attributes):
+        record = {
+            "trace": self.trace_id,
+            "id": span_id,
+            "parent": parent,
+            "kind": kind,
+            "name": name,
+            "time": round(started, 3),
+            "ms": round(ms, 2)
+        }
+        record.update(attributes)
+        try:
+            self.logger.info(json.dumps(record))
+        except Exception:
+            pass
+
+    def records(self):
+        paths = [os.path.join(self.directory, self.filename)]
+        paths += ["{0}.{1}".format(paths[0], index)
+                  for index in range(1, self.backups + 1)]
+        records = []
+        for path in reversed(paths):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            continue
+            except OSError:
+                continue
+        return records
+
+    def clear(self):
+        if self.logger:
+            self.close_handlers()
+            self.logger = None
+        for index in range(self.backups + 1):
+            path = os.path.join(self.directory, self.filename)
+            if index:
+                path = "{0}.{1}".format(path, index)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction*(len(ordered) - 1))))]
+
+
+def summarize(records, limit=10):
+    routes = {}
+    layers = {}
+    total = 0
+    for record in records:
+        if record["kind"] == "route":
+            routes.setdefault(record["name"], []).append(record["ms"])
+            total += record["ms"]
+        elif record["kind"] in ("request", "listitems", "directory", "cache"):
+            layer = layers.setdefault(record["kind"], {"count": 0, "ms": 0})
+            layer["count"] += 1
+            layer["ms"] += record["ms"]
+
+    # Whatever requests, list items and handing them to Kodi do not account
+    # for is the add-on's own work: decoding, normalizing and bookkeeping.
+    accounted = sum(
+        layers.get(kind, {}).get("ms", 0)
+        for kind in ("request", "listitems", "directory")
+    )
+    layers["other"] = {
+        "count": sum(len(values) for values in routes.values()),
+        "ms": max(0, total - accounted)
+    }
+
+    requests = sorted(
+        (record for record in records if record["kind"] == "request"),
+        key=lambda record: record["ms"], reverse=True
+    )
+    return {
+        "routes": sorted((
+            {"name": name, "count": len(values),
+             "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+            for (name, values) in routes.items()
+        ), key=lambda route: route["p95"], reverse=True),
+        "layers": layers,
+        "total_ms": total,
+        "slowest": requests[:limit]
+    }
+
+
+tracer = Tracer()
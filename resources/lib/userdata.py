@@ -0,0 +1,130 @@
+import os
+import json
+import time
+from resources.lib.database import Database
+
+
+class UserDataStore(Database):
+    filename = "userdata.db"
+    legacy_filename = "userdata.json"
+    schema = (
+        "CREATE TABLE IF NOT EXISTS users ("
+        "username TEXT PRIMARY KEY, boot_uuid TEXT, device_uuid TEXT, "
+        "token_data TEXT, extra TEXT, updated REAL)",
+        # Short-lived per device state, such as playback provisioning.
+        "CREATE TABLE IF NOT EXISTS state ("
+        "scope TEXT, key TEXT, value TEXT, expires REAL, "
+        "PRIMARY KEY (scope, key))"
+    )
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.legacy_path = os.path.join(directory, self.legacy_filename)
+        if os.path.exists(self.legacy_path):
+            self.migrate()
+
+    def migrate(self):
+        # Older versions rewrote userdata.json on every token refresh.
+        try:
+            with open(self.legacy_path, "r") as data_file:
+                userdata_json = json.load(data_file)
+        except (FileNotFoundError, ValueError):
+            userdata_json = {}
+
+        with self.connection() as conn:
+            for (username, userdata) in userdata_json.items():
+                # Whatever another invocation already stored is newer.
+                conn.execute(
+                    "INSERT OR IGNORE INTO users (username, boot_uuid, "
+                    "device_uuid, token_data, extra, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    self.row(username, userdata)
+                )
+        try:
+            os.remove(self.legacy_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def row(username, userdata):
+        extra = dict(
+            (key, value) for (key, value) in userdata.items()
+            if key not in ("bootUUID", "deviceUUID", "tokenData")
+        )
+        return (
+            username, userdata.get("bootUUID"), userdata.get("deviceUUID"),
+            json.dumps(userdata.get("tokenData")), json.dumps(extra),
+            time.time()
+        )
+
+    def get(self, username):
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT boot_uuid, device_uuid, token_data, extra FROM users "
+                "WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        userdata = json.loads(row[3]) if row[3] else {}
+        userdata.update({
+            "bootUUID": row[0],
+            "deviceUUID": row[1],
+            "tokenData": json.loads(row[2]) if row[2] else None
+        })
+        return userdata
+
+    def usernames(self):
+        with self.connection() as conn:
+            rows = conn.execute("SELECT username FROM users").fetchall()
+        return [row[0] for row in rows]
+
+    def put(self, username, userdata):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO users (username, boot_uuid, "
+                "device_uuid, token_data, extra, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)", self.row(username, userdata)
+            )
+
+    def put_tokens(self, username, token_data):
+        # A token refresh only touches the tokens of one user.
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE users SET token_data = ?, updated = ? "
+                "WHERE username = ?",
+                (json.dumps(token_data), time.time(), username)
+            )
+
+    def remove(self, username):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    def clear(self):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM users")
+
+    def get_state(self, scope, key):
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM state WHERE scope = ? AND key = ? "
+                "AND expires > ?", (scope, key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_state(self, scope, key, value, ttl):
+        with self.connection() as conn:
+            conn.execute(
+                "DELETE FROM state WHERE expires <= ?", (time.time(),)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO state (scope, key, value, expires) "
+                "VALUES (?, ?, ?, ?)",
+                (scope, key, json.dumps(value), time.time() + ttl)
+            )
+
+    def clear_state(self, scope, key):
+        with self.connection() as conn:
+            conn.execute(
+                "DELETE FROM state WHERE scope = ? AND key = ?", (scope, key)
+            )
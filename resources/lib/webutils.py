@@ -1,5 +1,9 @@
+import time
 import urllib.parse
 import requests
+from resources.lib.tracing import tracer
+from resources.lib.sessionpool import SessionPoolClient, \
+    SessionPoolUnavailable, SessionPoolError, build_response
 
 
 class WebException(Exception):
@@ -8,20 +12,128 @@ class WebException(Exception):
 
 class WebUtils():
 
-    def __init__(self):
+    def __init__(self, pool_port=None, validator_store=None, base_url=None):
         self.session = requests.session()
+        if pool_port:
+            self.pool_client = SessionPoolClient(pool_port)
+        else:
+            self.pool_client = None
+        self.validator_store = validator_store
+        # The account the stored validators belong to, like the response
+        # cache's scope.
+        self.validator_scope = ""
+        # Sends every request to <base_url>/<host><path> instead, e.g. to a
+        # local stand-in server for offline testing.
+        self.base_url = base_url.rstrip("/") if base_url else None
 
-    def make_request(self, request, headers=None, payload=None):
+    def make_request(self, request, headers=None, payload=None, stream=False):
         url = self.extract_url(request)
         method = list(request.keys())[0]
+        if method not in ("GET", "POST", "DELETE"):
+            raise WebException("Unknown method '{0}'".format(method))
+
+        if not tracer.enabled:
+            return self.dispatch(method, url, headers, payload, stream)
+
+        with tracer.span(
+            "request", self.operation_name(request, payload), method=method,
+            host=request[method]["host"],
+            pooled=self.pool_client is not None and not stream,
+            streamed=stream
+        ) as span:
+            start = time.perf_counter()
+            response = self.dispatch(method, url, headers, payload, stream)
+            span["status"] = response.status_code
+            # requests only exposes the time until the response headers were
+            # parsed; DNS, connect and TLS are part of it and not separable.
+            elapsed = getattr(response, "elapsed", None)
+            if elapsed:
+                span["ttfb_ms"] = round(elapsed.total_seconds()*1000, 2)
+            if not stream:
+                span["bytes"] = len(response.content)
+                span["transfer_ms"] = round(max(
+                    0, (time.perf_counter() - start)*1000 -
+                    span.get("ttfb_ms", 0)
+                ), 2)
+            return response
+
+    def dispatch(self, method, url, headers, payload, stream):
+        # Streamed bodies are consumed incrementally and never stored.
+        if method == "GET" and self.validator_store and not stream:
+            return self.conditional_request(url, headers, payload)
+        return self.send(method, url, headers, payload, stream)
+
+    def operation_name(self, request, payload):
+        method = list(request.keys())[0]
+        try:
+            return request[method]["query"]["operationName"]
+        except (KeyError, TypeError):
+            pass
+        try:
+            return payload["operationName"]
+        except (KeyError, TypeError):
+            return request[method].get("filename", "").rstrip("/").split("/")[-1]
+
+    def conditional_request(self, url, headers, payload):
+        cached = self.validator_store.get(url, self.validator_scope)
+        if cached:
+            headers = dict(headers) if headers else {}
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self.send("GET", url, headers, payload)
+
+        if response.status_code == 304 and cached:
+            self.validator_store.record_revalidation(len(cached["body"]))
+            tracer.event(
+                "cache", "validator", outcome="not-modified",
+                bytes=len(cached["body"])
+            )
+            response_headers = dict(cached["headers"])
+            response_headers.update(response.headers)
+            return build_response(
+                200, "OK", response.url, cached["encoding"],
+                response_headers, cached["body"]
+            )
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            # The stored body is already decoded.
+            response_headers = {
+                key: value for (key, value) in response.headers.items()
+                if key.lower() not in (
+                    "content-encoding", "content-length", "transfer-encoding"
+                )
+            }
+            self.validator_store.put(
+                url, etag, last_modified, response_headers,
+                response.encoding, response.content, self.validator_scope
+            )
+        return response
+
+    def send(self, method, url, headers, payload, stream=False):
+        # The pool hands back whole bodies, so streamed responses are read
+        # from this invocation's own connection instead.
+        if self.pool_client and not stream:
+            try:
+                return self.pool_client.request(method, url, headers, payload)
+            except SessionPoolUnavailable:
+                # The service is not running; stop trying for this invocation.
+                self.pool_client = None
+            except SessionPoolError as e:
+                raise WebException(str(e))
+
         if method == "GET":
-            response = self.session.get(url, headers=headers, json=payload)
+            response = self.session.get(
+                url, headers=headers, json=payload, stream=stream
+            )
         elif method == "POST":
             response = self.session.post(url, headers=headers, json=payload)
-        elif method == "DELETE":
-            response = self.session.delete(url, headers=headers, json=payload)
         else:
-            raise WebException("Unknown method '{0}'".format(method))
+            response = self.session.delete(url, headers=headers, json=payload)
         return response
 
     def extract_url(self, request):
@@ -37,10 +149,15 @@ class WebUtils():
         except KeyError:
             params = ""
 
-        url = "{0}://{1}".format(
-            request[method]["scheme"], request[method]["host"])
-        if path:
-            url = urllib.parse.urljoin(url, path)
+        if self.base_url:
+            url = "{0}/{1}".format(self.base_url, request[method]["host"])
+            if path:
+                url = url + path
+        else:
+            url = "{0}://{1}".format(
+                request[method]["scheme"], request[method]["host"])
+            if path:
+                url = urllib.parse.urljoin(url, path)
         if params:
             url = self.append_params(url, params)
         return url